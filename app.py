@@ -1,17 +1,50 @@
-from venv import create
+import os
+import gc
+import atexit
 import config
+import functools
 
 from flask import Flask
-from sqlalchemy import create_engine
 from flask_cors import CORS
 
-from model import UserDao, TweetDao
-from service import UserService, TweetService
+from model import UserDao, TweetDao, TimelineDao, RecentTweetCache, TimelineCache, FollowGraph, TweetWriter, LRUCache
+from model import SearchIndex, TrendingTopics, TimelineHub
+from model import create_database_from_config, Metrics, instrument_database, instrument_dao, SlowQueryLog
+from service import UserService, TweetService, PasswordHasher
 from view import create_endpoints
+from view.metrics import register_metrics
+from view.admission import register_admission_control
 
 class Services:
     pass
 
+## 프로세스 메모리에만 상태를 두는 기능들. pre-fork 서버 (server.py) 의 워커가 여럿이면 워커끼리 상태를 나누지 않아서
+## 다른 워커가 처리한 트윗, 팔로우, 가입을 모른다. (오래된 타임라인과 캐시, 빠진 검색 결과와 push, 워커 수 배의 rate limit)
+## 그래서 워커가 여럿일 때 켜져 있으면 create_app 이 시작하지 않는다. TIMELINE_FANOUT = 'hybrid' 도 마찬가지다.
+## (UNKNOWN_EMAIL_CACHE_SIZE 와 RATE_LIMITS 는 워커가 여럿이면 기본값이 꺼짐이다.)
+SINGLE_PROCESS_OPTIONS = ('TIMELINE_CACHE_SIZE', 'FOLLOW_GRAPH', 'SEARCH_INDEX', 'TRENDING', 'TIMELINE_PUSH',
+                          'UNKNOWN_EMAIL_CACHE_SIZE', 'RATE_LIMITS')
+
+
+def check_single_process_options(app_config, server_workers):
+    if server_workers <= 1:
+        return
+
+    enabled = [option for option in SINGLE_PROCESS_OPTIONS if app_config.get(option)]
+    if app_config.get('TIMELINE_FANOUT', 'read') == 'hybrid':
+        enabled.insert(0, "TIMELINE_FANOUT = 'hybrid'")
+
+    if enabled:
+        raise ValueError(f'{", ".join(enabled)} keep state in one process and cannot be used with '
+                         f'{server_workers} server workers; turn them off or run server.py --workers 1')
+
+
+def close_app(app):
+    ## create_app 이 등록한 정리 작업 (TweetWriter flush, 검색 색인 저장, bcrypt 프로세스 풀 종료 등) 을 역순으로 부른다.
+    ## 부른 작업은 list 에서 빠지므로 여러 번 불러도 된다. 부르지 않으면 프로세스가 끝날 때 atexit 으로 불린다.
+    while app.shutdown_hooks:
+        app.shutdown_hooks.pop()()
+
 ####################################################
 #       Create App
 ####################################################
@@ -25,20 +58,253 @@ def create_app(test_config = None):
     else:
         app.config.update(test_config)
 
-    database = create_engine(app.config['DB_URL'], encoding = 'utf-8', max_overflow = 0)
+    ## pre-fork 서버 (server.py) 의 워커로 뜨면 워커 수가 MINITER_WORKERS 로, 워커 번호가 MINITER_WORKER_SLOT 으로 주어진다.
+    server_workers = int(os.environ.get('MINITER_WORKERS', 1))
+    worker_slot    = os.environ.get('MINITER_WORKER_SLOT')
+    check_single_process_options(app.config, server_workers)
+
+    ## DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING 으로 pool 을 설정한다.
+    ## DB_READ_URL 을 주면 타임라인과 로그인 조회는 읽기 전용 replica 로 보낸다.
+    database      = create_database_from_config(app.config)
+    read_database = None
+    if app.config.get('DB_READ_URL'):
+        read_database = create_database_from_config(app.config, 'DB_READ_URL')
+
+    app.database      = database
+    app.read_database = read_database
+
+    ## 백그라운드 쓰레드, 프로세스 풀, 파일을 정리하는 함수들. (close_app 참고)
+    app.shutdown_hooks = []
+    atexit.register(close_app, app)
+
+    ## SLOW_QUERY_THRESHOLD (초) 를 주면 그보다 오래 걸린 SQL 을 SLOW_QUERY_LOG 파일에 남기고
+    ## 처음 보는 쿼리는 EXPLAIN 결과도 같이 남긴다. (기본값 None = 사용 안 함)
+    ## SLOW_QUERY_LOG_PER_WORKER 면 파일 이름에 server.py 의 워커 번호 (MINITER_WORKER_SLOT) 를 붙여서
+    ## 워커마다 따로 쓰고 돌린다. (기본값: 워커가 여러 개일 때)
+    slow_query_log = None
+    if app.config.get('SLOW_QUERY_THRESHOLD') is not None:
+        slow_query_log = SlowQueryLog(
+            app.config.get('SLOW_QUERY_LOG', 'slow_query.log'),
+            threshold    = app.config['SLOW_QUERY_THRESHOLD'],
+            max_bytes    = app.config.get('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024),
+            backup_count = app.config.get('SLOW_QUERY_LOG_BACKUPS', 5),
+            explain      = app.config.get('SLOW_QUERY_EXPLAIN', True),
+            worker       = worker_slot if app.config.get('SLOW_QUERY_LOG_PER_WORKER', server_workers > 1) else None
+        )
+        slow_query_log.install(database, 'primary')
+        if read_database is not None:
+            slow_query_log.install(read_database, 'replica')
+        app.shutdown_hooks.append(slow_query_log.close)
 
     ## Persistence Layer
-    user_dao   = UserDao(database)
-    tweet_dao  = TweetDao(database)
+    user_dao   = UserDao(database, read_database)
+    tweet_dao  = TweetDao(database, read_database)
+
+    ## TIMELINE_FANOUT = 'read'   : 읽을 때마다 tweets x users_follow_list 를 조회 (기본값)
+    ## TIMELINE_FANOUT = 'write'  : 쓸 때 home_timeline 테이블에 미리 펼쳐 놓음
+    ## TIMELINE_FANOUT = 'hybrid' : 'write' 와 같지만 팔로워가 FANOUT_FOLLOWER_THRESHOLD 를 넘는
+    ##                              작성자의 트윗은 읽을 때 최근 트윗 캐시에서 합쳐 줌
+    fanout        = app.config.get('TIMELINE_FANOUT', 'read')
+    timeline_dao  = None
+    recent_tweets = None
+    if fanout in ('write', 'hybrid'):
+        timeline_dao = TimelineDao(database, read_database)
+    if fanout == 'hybrid':
+        recent_tweets = RecentTweetCache(app.config.get('RECENT_TWEETS_PER_AUTHOR', 200))
+
+    ## TIMELINE_CACHE_SIZE (엔트리 수) 를 주면 프로세스 안에 타임라인 캐시를 둔다. (기본값 0 = 사용 안 함)
+    timeline_cache = None
+    if app.config.get('TIMELINE_CACHE_SIZE', 0) > 0:
+        timeline_cache = TimelineCache(
+            max_entries = app.config['TIMELINE_CACHE_SIZE'],
+            max_bytes   = app.config.get('TIMELINE_CACHE_BYTES', 64 * 1024 * 1024),
+            ttl         = app.config.get('TIMELINE_CACHE_TTL', 60)
+        )
+
+    ## FOLLOW_GRAPH = True 면 시작할 때 users_follow_list 를 메모리에 올려 두고
+    ## 팔로우 관계는 DB 대신 FollowGraph 에서 찾는다.
+    follow_graph = None
+    if app.config.get('FOLLOW_GRAPH', False):
+        follow_graph = FollowGraph()
+        follow_graph.load(user_dao.iter_follow_edges())
+
+    ## TWEET_BATCH_SIZE 를 주면 트윗 INSERT 를 모아서 한 트랜잭션으로 commit 한다. (기본값 0 = 사용 안 함)
+    ## 배치가 TWEET_WRITE_TIMEOUT 초 (기본값 10) 안에 commit 되지 않으면 /tweet 은 504 를 돌려준다.
+    tweet_writer = None
+    if app.config.get('TWEET_BATCH_SIZE', 0) > 0:
+        tweet_writer = TweetWriter(
+            database,
+            batch_size    = app.config['TWEET_BATCH_SIZE'],
+            batch_window  = app.config.get('TWEET_BATCH_WINDOW', 0.005),
+            max_queue     = app.config.get('TWEET_WRITE_QUEUE_SIZE', 10000),
+            queue_timeout = app.config.get('TWEET_WRITE_QUEUE_TIMEOUT', 1.0),
+            write_timeout = app.config.get('TWEET_WRITE_TIMEOUT', 10.0)
+        )
+        app.shutdown_hooks.append(tweet_writer.close)
+
+    ## SEARCH_INDEX = True 면 트윗 본문의 역색인을 메모리에 두고 /search 를 연다. (기본값 False)
+    ## SEARCH_INDEX_PATH 를 주면 시작할 때 그 파일에서 색인을 읽고 종료할 때 다시 저장한다.
+    ## 어느 쪽이든 시작할 때 색인 이후의 트윗은 DB 에서 읽어서 채운다.
+    search_index = None
+    if app.config.get('SEARCH_INDEX', False):
+        search_index = SearchIndex(max_candidates = app.config.get('SEARCH_MAX_CANDIDATES', 20000))
+        if app.config.get('SEARCH_INDEX_PATH'):
+            search_index.load(app.config['SEARCH_INDEX_PATH'])
+            app.shutdown_hooks.append(functools.partial(search_index.save, app.config['SEARCH_INDEX_PATH']))
+
+    ## TRENDING = True 면 트윗의 해시태그를 최근 TRENDING_WINDOW 초 동안 세서 /trending 으로 top-k 를 내보낸다.
+    ## (기본값 False) window 는 TRENDING_BUCKETS 개의 구간으로 나눠서 구간 단위로 밀려나고, 횟수는
+    ## TRENDING_SKETCH_DEPTH x TRENDING_SKETCH_WIDTH 크기의 count-min sketch 로 추정한다. 프로세스마다 따로 센다.
+    trending = None
+    if app.config.get('TRENDING', False):
+        trending = TrendingTopics(
+            window  = app.config.get('TRENDING_WINDOW', 3600),
+            buckets = app.config.get('TRENDING_BUCKETS', 12),
+            width   = app.config.get('TRENDING_SKETCH_WIDTH', 4096),
+            depth   = app.config.get('TRENDING_SKETCH_DEPTH', 4),
+            k       = app.config.get('TRENDING_SIZE', 50)
+        )
+
+    ## TIMELINE_PUSH = True 면 /timeline/stream (server-sent events) 으로 타임라인의 새 트윗을 바로 보낸다. (기본값 False)
+    ## 새 트윗이 없으면 TIMELINE_PUSH_HEARTBEAT 초 마다 heartbeat 를 보낸다. 연결마다 읽지 않은 트윗이
+    ## TIMELINE_PUSH_BUFFER 개를 넘으면 그 연결을 끊고, 프로세스 당 연결은 TIMELINE_PUSH_MAX_SUBSCRIBERS 개까지 받는다.
+    ## 연결마다 WSGI 서버의 쓰레드를 하나씩 잡고 있으므로 쓰레드 수를 그만큼 넉넉히 준다.
+    timeline_hub = None
+    if app.config.get('TIMELINE_PUSH', False):
+        timeline_hub = TimelineHub(
+            buffer_size     = app.config.get('TIMELINE_PUSH_BUFFER', 100),
+            max_subscribers = app.config.get('TIMELINE_PUSH_MAX_SUBSCRIBERS', 10000)
+        )
+        app.shutdown_hooks.append(timeline_hub.close)
+
+    ## bcrypt 해시/검증은 CPU 코어 수 만큼의 전용 프로세스 풀에서 돌린다.
+    ## pre-fork 서버의 워커가 여럿이면 워커마다 코어 수 만큼 띄우지 않고 코어를 워커 수로 나눠 갖는다.
+    password_hash_workers = None
+    if server_workers > 1:
+        password_hash_workers = max(1, (os.cpu_count() or 1) // server_workers)
+
+    password_hasher = PasswordHasher(
+        rounds      = app.config.get('BCRYPT_ROUNDS', 12),
+        workers     = app.config.get('PASSWORD_HASH_WORKERS', password_hash_workers),
+        max_pending = app.config.get('PASSWORD_HASH_QUEUE_SIZE')
+    )
+    app.shutdown_hooks.append(password_hasher.close)
+
+    ## 없는 이메일로 로그인 시도한 결과를 잠깐 기억해 두는 negative cache
+    ## 가입하면 그 워커의 캐시에서만 지워지므로 워커가 여럿이면 기본으로 쓰지 않는다. (크기 0)
+    unknown_email_cache = LRUCache(
+        max_entries = app.config.get('UNKNOWN_EMAIL_CACHE_SIZE', 10000 if server_workers <= 1 else 0),
+        ttl         = app.config.get('UNKNOWN_EMAIL_CACHE_TTL', 30)
+    )
 
     ## Business Layer
     services = Services
-    services.user_service = UserService(user_dao, config)
-    services.tweet_service = TweetService(tweet_dao)
+    services.user_service = UserService(
+        user_dao,
+        config,
+        timeline_dao        = timeline_dao,
+        timeline_cache      = timeline_cache,
+        follow_graph        = follow_graph,
+        password_hasher     = password_hasher,
+        unknown_email_cache = unknown_email_cache,
+        backfill_size       = app.config.get('HOME_TIMELINE_BACKFILL', 100),
+        timeline_hub        = timeline_hub
+    )
+    services.tweet_service = TweetService(
+        tweet_dao,
+        timeline_dao      = timeline_dao,
+        recent_tweets     = recent_tweets,
+        timeline_cache    = timeline_cache,
+        follow_graph      = follow_graph,
+        tweet_writer      = tweet_writer,
+        fanout_threshold  = app.config.get('FANOUT_FOLLOWER_THRESHOLD', 10000),
+        page_size         = app.config.get('TIMELINE_PAGE_SIZE', 20),
+        max_page_size     = app.config.get('TIMELINE_MAX_PAGE_SIZE', 100),
+        stream_chunk_size = app.config.get('TIMELINE_STREAM_CHUNK_SIZE', 1000),
+        max_stream_count  = app.config.get('TIMELINE_STREAM_MAX_COUNT', 10000),
+        search_index      = search_index,
+        trending          = trending,
+        timeline_hub      = timeline_hub
+    )
+    services.tweet_service.warm_recent_tweets()
+    services.tweet_service.warm_search_index()
 
     ## 엔드포인트들을 생성
     create_endpoints(app, services)
 
+    ## METRICS = True (기본값) 면 라우트/DAO 메소드/SQL 별 처리 시간과
+    ## pool, 캐시 상태를 /metrics 로 내보낸다.
+    if app.config.get('METRICS', True):
+        metrics = Metrics()
+
+        instrument_database(database, metrics, 'primary')
+        if read_database is not None:
+            instrument_database(read_database, metrics, 'replica')
+
+        for dao in (user_dao, tweet_dao, timeline_dao):
+            if dao is not None:
+                instrument_dao(dao, metrics)
+
+        metrics.add_collector('timeline', services.tweet_service.get_fanout_stats)
+        metrics.add_collector('cache', unknown_email_cache.stats, cache = 'unknown_email')
+        if 'token_cache' in app.extensions:
+            metrics.add_collector('cache', app.extensions['token_cache'].stats, cache = 'token')
+        if timeline_cache is not None:
+            metrics.add_collector('cache', timeline_cache.stats, cache = 'timeline')
+        if follow_graph is not None:
+            metrics.add_collector('follow_graph', follow_graph.stats)
+        if tweet_writer is not None:
+            metrics.add_collector('tweet_writer', tweet_writer.stats)
+        if search_index is not None:
+            metrics.add_collector('search_index', search_index.stats)
+        if trending is not None:
+            metrics.add_collector('trending', trending.stats)
+        if timeline_hub is not None:
+            metrics.add_collector('timeline_push', timeline_hub.stats)
+        if slow_query_log is not None:
+            metrics.add_collector('db', slow_query_log.stats)
+
+        register_metrics(app, metrics)
+        app.extensions['metrics'] = metrics
+
+    ## ADMISSION_CONTROL = True (기본값) 면 앱 전체에서 동시에 처리하는 요청 수를 ADMISSION_CONCURRENCY
+    ## (기본값 DB pool 크기) 로 제한하고, ADMISSION_ROUTE_LIMITS ({라우트 : limit}) 로 준 라우트는 그 안에서
+    ## 라우트 별로 한 번 더 제한한다. 넘치는 요청은
+    ## ADMISSION_QUEUE_SIZE 개까지 ADMISSION_QUEUE_TIMEOUT 초 동안만 기다리게 한 뒤 503 + Retry-After 로 거절한다.
+    ## RATE_LIMITS 는 {라우트 : (유저 당 초당 요청 수, burst)} token bucket 이다. ({} 면 사용 안 함)
+    ## bucket 은 프로세스마다 따로라서 워커가 여럿이면 기본값은 {} 이다.
+    ## /timeline/stream 은 연결 내내 자리를 잡고 있게 되므로 기본으로 제외한다. (연결 수는 TIMELINE_PUSH_MAX_SUBSCRIBERS 로 제한)
+    ## (metrics 가 503 도 기록하도록 metrics 보다 뒤에 등록한다.)
+    if app.config.get('ADMISSION_CONTROL', True):
+        limiters, rate_limiters = register_admission_control(
+            app,
+            limit        = app.config.get('ADMISSION_CONCURRENCY',
+                                          app.config.get('DB_POOL_SIZE', 5) + app.config.get('DB_MAX_OVERFLOW', 0)),
+            max_queue    = app.config.get('ADMISSION_QUEUE_SIZE', 50),
+            timeout      = app.config.get('ADMISSION_QUEUE_TIMEOUT', 1.0),
+            route_limits = app.config.get('ADMISSION_ROUTE_LIMITS'),
+            exempt       = app.config.get('ADMISSION_EXEMPT', ('/ping', '/metrics', '/timeline/stream')),
+            rate_limits  = app.config.get('RATE_LIMITS', {
+                '/tweet'    : (1, 30),
+                '/follow'   : (2, 60),
+                '/unfollow' : (2, 60)
+            } if server_workers <= 1 else {}),
+            max_users    = app.config.get('RATE_LIMIT_USERS', 100000)
+        )
+
+        if 'metrics' in app.extensions:
+            for route, limiter in limiters.items():
+                app.extensions['metrics'].add_collector('admission', limiter.stats, route = route)
+            for route, limiter in rate_limiters.items():
+                app.extensions['metrics'].add_collector('rate_limit', limiter.stats, route = route)
+
+    ## GC_FREEZE = True (기본값) 면 시작할 때 만든 객체들 (모듈, SQLAlchemy 메타데이터, FollowGraph, 검색 색인 등) 을
+    ## GC 의 영구 세대로 옮긴다. 요청마다 수천 개씩 만드는 record 때문에 full collection 이 돌 때
+    ## 이 객체들을 다시 훑지 않는다. (GC 를 끄지 않고 한 번만 하므로 다른 쓰레드의 GC 에 영향을 주지 않는다.)
+    if app.config.get('GC_FREEZE', True):
+        gc.collect()
+        gc.freeze()
+
     return app
 
     # app.database = database
@@ -0,0 +1,98 @@
+import gc
+import atexit
+import config
+
+from quart import Quart
+
+from model import AsyncUserDao, AsyncTweetDao, LRUCache, create_async_database_from_config
+from service import AsyncUserService, AsyncTweetService, PasswordHasher
+from view.async_endpoints import create_async_endpoints
+
+class Services:
+    pass
+
+## create_app 에만 있는 기능들. ASGI 앱은 트윗을 쓸 때 fan-out, 캐시 무효화, 색인, push 를 하지 않으므로
+## 이 중 하나라도 켜져 있으면 (같은 DB 를 쓰는 WSGI 프로세스의 타임라인이 조용히 틀어지지 않도록) 시작하지 않는다.
+UNSUPPORTED_OPTIONS = ('TIMELINE_CACHE_SIZE', 'FOLLOW_GRAPH', 'SEARCH_INDEX', 'TRENDING', 'TIMELINE_PUSH')
+
+
+def check_supported_options(app_config):
+    unsupported = [option for option in UNSUPPORTED_OPTIONS if app_config.get(option)]
+    if app_config.get('TIMELINE_FANOUT', 'read') != 'read':
+        unsupported.insert(0, 'TIMELINE_FANOUT')
+
+    if unsupported:
+        raise ValueError(f'ASGI mode does not support {", ".join(unsupported)}; turn them off or serve create_app')
+
+####################################################
+#       Create ASGI App
+####################################################
+## create_app 과 같은 엔드포인트를 asyncio 드라이버 위에서 돌리는 ASGI 앱.
+## DB 를 기다리는 동안 쓰레드를 잡고 있지 않으므로 한 프로세스가 많은 동시 연결을 받을 수 있다.
+##
+##   uvicorn --factory asgi:create_asgi_app --port 5000
+def create_asgi_app(test_config = None):
+    app = Quart(__name__)
+
+    if test_config is None:
+        app.config.from_pyfile("config.py")
+    else:
+        app.config.update(test_config)
+
+    check_supported_options(app.config)
+
+    ## ASYNC_DB_URL 을 따로 주지 않으면 DB_URL 의 드라이버만 async 드라이버로 바꿔서 쓴다.
+    database      = create_async_database_from_config(app.config)
+    read_database = None
+    if app.config.get('DB_READ_URL'):
+        read_database = create_async_database_from_config(app.config, 'DB_READ_URL')
+
+    app.database      = database
+    app.read_database = read_database
+
+    ## Persistence Layer
+    user_dao   = AsyncUserDao(database, read_database)
+    tweet_dao  = AsyncTweetDao(database, read_database)
+
+    password_hasher = PasswordHasher(
+        rounds      = app.config.get('BCRYPT_ROUNDS', 12),
+        workers     = app.config.get('PASSWORD_HASH_WORKERS'),
+        max_pending = app.config.get('PASSWORD_HASH_QUEUE_SIZE')
+    )
+    atexit.register(password_hasher.close)
+
+    ## Business Layer
+    services = Services
+    services.user_service = AsyncUserService(
+        user_dao,
+        config,
+        password_hasher     = password_hasher,
+        unknown_email_cache = LRUCache(
+            max_entries = app.config.get('UNKNOWN_EMAIL_CACHE_SIZE', 10000),
+            ttl         = app.config.get('UNKNOWN_EMAIL_CACHE_TTL', 30)
+        )
+    )
+    services.tweet_service = AsyncTweetService(
+        tweet_dao,
+        page_size     = app.config.get('TIMELINE_PAGE_SIZE', 20),
+        max_page_size = app.config.get('TIMELINE_MAX_PAGE_SIZE', 100)
+    )
+
+    ## 엔드포인트들을 생성
+    create_async_endpoints(app, services)
+
+    ## 서버가 내려갈 때 DB pool 과 bcrypt 프로세스 풀을 정리한다. (테스트는 app.test_app() 으로 같은 정리를 부른다.)
+    @app.after_serving
+    async def close_app():
+        await database.dispose()
+        if read_database is not None:
+            await read_database.dispose()
+
+        password_hasher.close()
+
+    ## 시작할 때 만든 객체들을 GC 의 영구 세대로 옮긴다. (create_app 의 GC_FREEZE 참고)
+    if app.config.get('GC_FREEZE', True):
+        gc.collect()
+        gc.freeze()
+
+    return app
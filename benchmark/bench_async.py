@@ -0,0 +1,135 @@
+## 같은 엔드포인트를 쓰레드 (WSGI) 서버와 asyncio (ASGI) 서버로 띄우고
+## 동시 접속 수를 늘려 가며 /timeline/<user_id> 의 처리량과 latency 를 비교한다.
+## config.test_config 의 DB 를 그대로 쓰므로 테스트 DB 에 데이터가 들어 있어야 한다.
+##
+##   python -m benchmark.bench_async [--concurrency 10 100 500] [--duration 10]
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+
+WSGI_SERVER = """
+import config
+from app import create_app
+from werkzeug.serving import run_simple
+run_simple('127.0.0.1', {port}, create_app(config.test_config), threaded = True)
+"""
+
+ASGI_SERVER = """
+import config
+import uvicorn
+from asgi import create_asgi_app
+uvicorn.run(create_asgi_app(config.test_config), host = '127.0.0.1', port = {port}, log_level = 'warning')
+"""
+
+
+def start_server(source, port):
+    process = subprocess.Popen([sys.executable, '-c', source.format(port = port)])
+
+    ## 서버가 포트를 열 때까지 기다린다.
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout = 1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+async def client(port, path, deadline, latencies, errors):
+    ## keep-alive 연결 하나로 deadline 까지 요청을 계속 보낸다.
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode()
+
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            writer.write(request)
+
+            status  = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if b' 200 ' not in status:
+                errors.append(status)
+            latencies.append(time.perf_counter() - started)
+
+            ## WSGI 개발 서버처럼 keep-alive 를 지원하지 않으면 다시 연결한다.
+            if headers.get('connection', '').lower() == 'close' or status.startswith(b'HTTP/1.0'):
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        errors.append(repr(e))
+    finally:
+        writer.close()
+
+
+async def run_load(port, path, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+
+    await asyncio.gather(*[
+        client(port, path, deadline, latencies, errors) for _ in range(concurrency)
+    ], return_exceptions = True)
+
+    return summarize(latencies, errors, duration)
+
+
+def summarize(latencies, errors, duration):
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+    return {
+        'requests' : len(latencies),
+        'errors'   : len(errors),
+        'rps'      : round(len(latencies) / duration, 1),
+        'p50_ms'   : percentile(0.50),
+        'p95_ms'   : percentile(0.95),
+        'p99_ms'   : percentile(0.99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type = int, nargs = '+', default = [10, 100, 500])
+    parser.add_argument('--duration', type = float, default = 10)
+    parser.add_argument('--user-id', type = int, default = 1)
+    parser.add_argument('--port', type = int, default = 5100)
+    args = parser.parse_args()
+
+    path   = f'/timeline/{args.user_id}'
+    result = {}
+    for offset, (name, source) in enumerate([('wsgi_threaded', WSGI_SERVER), ('asgi', ASGI_SERVER)]):
+        port    = args.port + offset
+        process = start_server(source, port)
+        try:
+            result[name] = {
+                str(concurrency) : asyncio.run(run_load(port, path, concurrency, args.duration))
+                for concurrency in args.concurrency
+            }
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps(result, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
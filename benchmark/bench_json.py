@@ -0,0 +1,84 @@
+## 타임라인 응답 하나를 JSON 응답으로 만드는 비용을 직렬화기별로 비교한다.
+## 'flask_default' 는 기존 CustomJSONEncoder (Flask 기본 provider + set 처리) 와 같은 경로다.
+##
+##   python -m benchmark.bench_json [--tweets 20 100 1000] [--repeat 2000]
+import json
+import time
+import argparse
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from view.json_provider import FastJSONProvider, available_backends
+
+
+class LegacyJSONProvider(DefaultJSONProvider):
+    ## 기존 CustomJSONEncoder 처럼 set 만 list 로 바꿔 주는 Flask 기본 provider
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, set):
+            return list(obj)
+
+        return DefaultJSONProvider.default(obj)
+
+
+def timeline_payload(tweets):
+    return {
+        'user_id'     : 1,
+        'timeline'    : [{
+            'id'      : tweet_id,
+            'user_id' : tweet_id % 50,
+            'tweet'   : f'트윗 {tweet_id} ' + 'hello world ' * 10
+        } for tweet_id in range(tweets, 0, -1)],
+        'next_cursor' : 1,
+        'follow'      : set(range(50))
+    }
+
+
+def measure(app, payload, repeat):
+    with app.app_context():
+        app.json.response(payload)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            response = app.json.response(payload)
+
+        elapsed = (time.perf_counter() - started) / repeat
+
+    return {
+        'us'    : round(elapsed * 1e6, 2),
+        'bytes' : len(response.get_data())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type = int, nargs = '+', default = [20, 100, 1000])
+    parser.add_argument('--repeat', type = int, default = 2000)
+    args = parser.parse_args()
+
+    apps = {}
+
+    app = Flask(__name__)
+    app.json = LegacyJSONProvider(app)
+    apps['flask_default'] = app
+
+    for backend in available_backends():
+        app = Flask(__name__)
+        app.json = FastJSONProvider(app, backend)
+        apps[backend] = app
+
+    result = {}
+    for tweets in args.tweets:
+        payload = timeline_payload(tweets)
+        repeat  = max(10, args.repeat * 20 // tweets)
+
+        result[str(tweets)] = {
+            name : measure(app, payload, repeat) for name, app in apps.items()
+        }
+
+    print(json.dumps(result, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
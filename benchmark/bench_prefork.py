@@ -0,0 +1,102 @@
+## server.py 의 preload (master 에서 앱 모듈을 import 한 뒤 fork) 가 워커 메모리를 얼마나 나눠 쓰는지 잰다.
+## --preload 와 --no-preload 로 각각 워커 N 개를 띄우고, 워커마다 /proc/<pid>/smaps_rollup 의
+## Rss / Pss / Private (다른 프로세스와 나눠 쓰지 않는 페이지) 와 워커가 준비될 때까지 걸린 시간을 JSON 으로 출력한다.
+## 앱은 config.test_config 로 만든다. (DB 에 연결하지 않는다)
+##
+##   python -m benchmark.bench_prefork [--workers 4]
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+
+import config
+
+from app import create_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_test_app():
+    return create_app(config.test_config)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as children:
+        return [int(pid) for pid in children.read().split()]
+
+
+def memory_kb(pid):
+    ## smaps_rollup 의 kB 값들
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                values[fields[0].rstrip(':')] = int(fields[1])
+
+    return values
+
+
+def measure(workers, preload):
+    port    = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'server.py'), '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--factory', 'benchmark.bench_prefork:create_test_app']
+    if not preload:
+        command.append('--no-preload')
+
+    started = time.perf_counter()
+    master  = subprocess.Popen(command, cwd = ROOT, env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path)),
+                               stderr = subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/ping', timeout = 1).read()
+                if len(worker_pids(master.pid)) == workers:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.05)
+
+        ready_seconds = time.perf_counter() - started
+
+        ## 모든 워커가 요청을 한 번씩은 처리하도록
+        for _ in range(workers * 20):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/ping', timeout = 1).read()
+
+        usage = [memory_kb(pid) for pid in worker_pids(master.pid)]
+    finally:
+        master.terminate()
+        master.wait()
+
+    return {
+        'preload'               : preload,
+        'ready_seconds'         : round(ready_seconds, 2),
+        'rss_kb_per_worker'     : sum(u['Rss'] for u in usage) // len(usage),
+        'pss_kb_per_worker'     : sum(u['Pss'] for u in usage) // len(usage),
+        'private_kb_per_worker' : sum(u['Private_Clean'] + u['Private_Dirty'] for u in usage) // len(usage)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type = int, default = 4)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'workers' : args.workers,
+        'results' : [measure(args.workers, preload) for preload in (True, False)]
+    }, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+## 10k 개 짜리 타임라인을 DAO 결과로 만들 때의 메모리 할당과 JSON 직렬화 비용을
+## row 마다 dict 를 만들던 방식 ('dict') 과 __slots__ record ('record') 로 비교한다.
+## 모드마다 새 프로세스에서 sqlite 로 타임라인을 읽고, row 를 변환하는 동안의
+## 할당 횟수 / 바이트 (tracemalloc) 와 RSS 증가량, JSON 응답을 만드는 시간을 잰다.
+##
+##   python -m benchmark.bench_records [--tweets 10000] [--repeat 20]
+import gc
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from model import Tweet
+from model.tweet_dao import timeline_queries
+from view.json_provider import FastJSONProvider
+
+MODES = {
+    'dict'   : lambda rows: [{
+        'id'      : tweet['id'],
+        'user_id' : tweet['user_id'],
+        'tweet'   : tweet['tweet']
+    } for tweet in rows],
+    'record' : Tweet.from_rows
+}
+
+
+def rss_bytes():
+    ## 리눅스가 아니면 None
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def seed(path, tweets):
+    database = create_engine(f'sqlite:///{path}')
+    database.execute(text("CREATE TABLE tweets (id INTEGER PRIMARY KEY, user_id INT, tweet TEXT)"))
+    database.execute(text("CREATE INDEX tweets_user_id_id ON tweets (user_id, id)"))
+    database.execute(text("CREATE TABLE users_follow_list (user_id INT, follow_user_id INT)"))
+    database.execute(text("INSERT INTO tweets (user_id, tweet) VALUES (1, :tweet)"), [
+        {'tweet' : f'트윗 {tweet_id} ' + 'hello world ' * 10} for tweet_id in range(tweets)
+    ])
+    database.dispose()
+
+
+def run(mode, path, repeat, queue):
+    database = create_engine(f'sqlite:///{path}')
+    rows     = database.execute(*timeline_queries([1])[0]).fetchall()
+    convert  = MODES[mode]
+
+    ## create_app 처럼 (GC_FREEZE) 시작할 때 만든 객체들은 GC 의 영구 세대로 옮겨 두고 잰다.
+    gc.collect()
+    gc.freeze()
+
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    timeline   = convert(rows)
+    snapshot   = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    rss_after  = rss_bytes()
+
+    allocations = [stat for stat in snapshot.statistics('filename')]
+
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            body = app.json.dumps_bytes({'user_id' : 1, 'timeline' : timeline})
+        serialize = (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            convert(rows)
+        build = (time.perf_counter() - started) / repeat
+
+    queue.put({
+        'mode'         : mode,
+        'rows'         : len(timeline),
+        'allocations'  : sum(stat.count for stat in allocations),
+        'alloc_bytes'  : sum(stat.size for stat in allocations),
+        'rss_delta_kb' : (rss_after - rss_before) // 1024 if rss_before is not None else None,
+        'build_ms'     : round(build * 1000, 3),
+        'json_ms'      : round(serialize * 1000, 3),
+        'json_bytes'   : len(body),
+        'json_backend' : app.json.backend
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type = int, default = 10000)
+    parser.add_argument('--repeat', type = int, default = 20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'records.db')
+        seed(path, args.tweets)
+
+        result = []
+        for mode in MODES:
+            queue   = multiprocessing.Queue()
+            process = multiprocessing.Process(target = run, args = (mode, path, args.repeat, queue))
+            process.start()
+            result.append(queue.get())
+            process.join()
+
+    print(json.dumps(result, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+## schema/migrations 의 index 들이 있을 때와 없을 때 DAO 의 자주 쓰는 쿼리들의 실행 계획과 실행 시간 비교.
+## 테이블을 primary key 만 있는 상태로 다시 만들어서 데이터를 채우고 EXPLAIN 과 실행 시간을 잰 뒤,
+## index migration 을 실행하고 다시 잰다.
+## 대상 DB (기본값 config.test_config 의 DB_URL) 의 테이블을 지우고 다시 만든다.
+## MySQL 이면 끝난 뒤 migration 전체를 다시 실행해서 테스트가 쓰는 스키마로 돌려 놓는다.
+##
+##   python -m benchmark.bench_schema [--users 2000] [--follows 50] [--tweets 20] [--repeat 50]
+import json
+import time
+import random
+import argparse
+import statistics
+
+import config
+
+from sqlalchemy import create_engine, event, text
+
+from model import UserDao, TweetDao, TimelineDao
+from schema.migrate import find_migrations, upgrade
+from benchmark.loadtest import generate_graph, insert_many
+
+TABLES = ['schema_version', 'home_timeline', 'tweets', 'users_follow_list', 'users']
+
+## index 없이 primary key 만 있는 테이블 (migration 이전에 손으로 만든 DB)
+BARE_TABLES = [
+    """
+    CREATE TABLE users (
+        id              INT NOT NULL,
+        name            VARCHAR(255) NOT NULL,
+        email           VARCHAR(255) NOT NULL,
+        hashed_password VARCHAR(255) NOT NULL,
+        profile         VARCHAR(2000) NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    """
+    CREATE TABLE users_follow_list (
+        user_id         INT NOT NULL,
+        follow_user_id  INT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE tweets (
+        id              INT NOT NULL,
+        user_id         INT NOT NULL,
+        tweet           VARCHAR(300) NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """
+]
+
+
+def drop_tables(database):
+    with database.begin() as connection:
+        if database.dialect.name == 'mysql':
+            connection.execute(text("SET FOREIGN_KEY_CHECKS=0"))
+        for table in TABLES:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        if database.dialect.name == 'mysql':
+            connection.execute(text("SET FOREIGN_KEY_CHECKS=1"))
+
+
+def create_bare_tables(database):
+    drop_tables(database)
+
+    with database.begin() as connection:
+        for statement in BARE_TABLES:
+            connection.execute(text(statement))
+
+
+def seed(database, rng, users, follows, tweets):
+    insert_many(database, """
+        INSERT INTO users (id, name, email, hashed_password, profile)
+        VALUES (:id, :name, :email, 'hash', 'bench')
+    """, [{
+        'id'    : user_id,
+        'name'  : f'user{user_id}',
+        'email' : f'user{user_id}@bench.miniter'
+    } for user_id in range(1, users + 1)])
+
+    insert_many(database, """
+        INSERT INTO users_follow_list (user_id, follow_user_id)
+        VALUES (:user_id, :follow_user_id)
+    """, [{
+        'user_id'        : user_id,
+        'follow_user_id' : follow_id
+    } for user_id, follow_id in generate_graph(rng, users, follows, 1.0)])
+
+    insert_many(database, """
+        INSERT INTO tweets (id, user_id, tweet)
+        VALUES (:id, :user_id, :tweet)
+    """, [{
+        'id'      : tweet_id,
+        'user_id' : rng.randint(1, users),
+        'tweet'   : f'bench tweet {tweet_id}'
+    } for tweet_id in range(1, users * tweets + 1)])
+
+    analyze(database)
+
+
+def analyze(database):
+    ## 옵티마이저가 새 데이터와 index 의 통계를 보도록 한다.
+    if database.dialect.name == 'mysql':
+        database.execute(text("ANALYZE TABLE users, users_follow_list, tweets"))
+    elif database.dialect.name == 'sqlite':
+        database.execute(text("ANALYZE"))
+
+
+def hot_queries(database, users):
+    user_dao     = UserDao(database)
+    tweet_dao    = TweetDao(database)
+    timeline_dao = TimelineDao(database)
+    celebrity    = 1                  ## power-law 그래프에서 팔로워가 가장 많은 유저
+    user_id      = users // 2
+
+    return {
+        'UserDao.get_user_id_and_password' : lambda: user_dao.get_user_id_and_password(f'user{user_id}@bench.miniter'),
+        'TweetDao.get_timeline'            : lambda: tweet_dao.get_timeline(user_id, limit = 21),
+        'TweetDao.get_timeline_version'    : lambda: tweet_dao.get_timeline_version(user_id),
+        'TweetDao.get_user_tweets'         : lambda: tweet_dao.get_user_tweets(user_id, limit = 21),
+        'TweetDao.get_follower_ids'        : lambda: tweet_dao.get_follower_ids(celebrity),
+        'TimelineDao.get_followee_ids'     : lambda: timeline_dao.get_followee_ids(user_id),
+        'TimelineDao.count_followers'      : lambda: timeline_dao.count_followers(celebrity, 10001)
+    }
+
+
+def capture_statements(database, call):
+    statements = []
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(database, 'before_cursor_execute', before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(database, 'before_cursor_execute', before_cursor_execute)
+
+    return statements
+
+
+def explain(database, call):
+    prefix = 'EXPLAIN QUERY PLAN ' if database.dialect.name == 'sqlite' else 'EXPLAIN '
+
+    plans = []
+    with database.connect() as connection:
+        for statement, parameters in capture_statements(database, call):
+            rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+            plans.append([dict(row._mapping) for row in rows])
+
+    return plans[0] if len(plans) == 1 else plans
+
+
+def measure(database, queries, repeat):
+    result = {}
+    for name, call in queries.items():
+        call()
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+
+        result[name] = {
+            'median_ms' : round(statistics.median(timings) * 1000, 3),
+            'plan'      : explain(database, call)
+        }
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default = config.test_config['DB_URL'])
+    parser.add_argument('--users', type = int, default = 2000)
+    parser.add_argument('--follows', type = int, default = 50)
+    parser.add_argument('--tweets', type = int, default = 20)
+    parser.add_argument('--repeat', type = int, default = 50)
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    database = create_engine(args.url, encoding = 'utf-8')
+    queries  = hot_queries(database, args.users)
+
+    create_bare_tables(database)
+    seed(database, random.Random(args.seed), args.users, args.follows, args.tweets)
+
+    before = measure(database, queries, args.repeat)
+
+    index_migration = next(migration for migration in find_migrations() if migration.name == 'hot_query_indexes')
+    with database.begin() as connection:
+        index_migration.run(connection)
+    analyze(database)
+
+    after = measure(database, queries, args.repeat)
+
+    result = {
+        name : {
+            'before'  : before[name],
+            'after'   : after[name],
+            'speedup' : round(before[name]['median_ms'] / after[name]['median_ms'], 1) if after[name]['median_ms'] else None
+        } for name in queries
+    }
+
+    ## 0001 migration 은 MySQL 용이므로 MySQL 일 때만 스키마를 원래대로 만든다.
+    if database.dialect.name == 'mysql':
+        drop_tables(database)
+        upgrade(database)
+
+    print(json.dumps(result, indent = 2, ensure_ascii = False, default = str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+## 검색 색인 (model.SearchIndex) 의 색인 속도, 메모리, 저장/읽기 시간과 검색 latency 를 잰다.
+## 단어 빈도가 Zipf 분포를 따르는 가상의 트윗을 만들어서 색인하고,
+## 흔한 단어 / 중간 단어 / 드문 단어 / 두 단어 검색의 p50 / p99 latency 를 JSON 으로 출력한다.
+##
+##   python -m benchmark.bench_search [--tweets 1000000] [--vocabulary 50000] [--queries 200]
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import itertools
+
+from model import SearchIndex
+
+
+def generate_tweets(rng, tweets, vocabulary, words_per_tweet):
+    ## 단어 i 의 빈도는 1 / (i + 1) 에 비례한다.
+    words   = [f'w{index}' for index in range(vocabulary)]
+    weights = list(itertools.accumulate(1 / (index + 1) for index in range(vocabulary)))
+
+    for tweet_id in range(1, tweets + 1):
+        length = rng.randint(words_per_tweet // 2, words_per_tweet * 3 // 2)
+        yield tweet_id, ' '.join(rng.choices(words, cum_weights = weights, k = length))
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def measure(search_index, queries, limit):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        search_index.search(query, limit)
+        timings.append(time.perf_counter() - started)
+
+    return {
+        'p50_ms' : round(percentile(timings, 0.50) * 1000, 3),
+        'p99_ms' : round(percentile(timings, 0.99) * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type = int, default = 1000000)
+    parser.add_argument('--vocabulary', type = int, default = 50000)
+    parser.add_argument('--words', type = int, default = 12, help = 'average words per tweet')
+    parser.add_argument('--queries', type = int, default = 200)
+    parser.add_argument('--limit', type = int, default = 20)
+    parser.add_argument('--max-candidates', type = int, default = 20000)
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    rng          = random.Random(args.seed)
+    search_index = SearchIndex(max_candidates = args.max_candidates)
+
+    started = time.perf_counter()
+    search_index.build(generate_tweets(rng, args.tweets, args.vocabulary, args.words))
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'search.idx')
+
+        started = time.perf_counter()
+        search_index.save(path)
+        save_seconds = time.perf_counter() - started
+        file_bytes   = os.path.getsize(path)
+
+        started = time.perf_counter()
+        SearchIndex().load(path)
+        load_seconds = time.perf_counter() - started
+
+    ## 단어 번호가 작을수록 흔한 단어
+    bands = {
+        'common'    : range(0, 10),
+        'mid'       : range(100, 1000),
+        'rare'      : range(10000, args.vocabulary),
+        'two_terms' : None
+    }
+
+    latency = {}
+    for name, band in bands.items():
+        if band is None:
+            queries = [f'w{rng.randrange(0, 100)} w{rng.randrange(100, 5000)}' for _ in range(args.queries)]
+        else:
+            queries = [f'w{rng.choice(band)}' for _ in range(args.queries)]
+
+        latency[name] = measure(search_index, queries, args.limit)
+
+    stats = search_index.stats()
+    print(json.dumps({
+        'tweets'            : args.tweets,
+        'terms'             : stats['terms'],
+        'postings'          : stats['postings'],
+        'build_seconds'     : round(build_seconds, 2),
+        'tweets_per_second' : round(args.tweets / build_seconds),
+        'memory_mb'         : round(stats['memory_bytes'] / 1024 / 1024, 1),
+        'bytes_per_posting' : round(stats['bytes_per_posting'], 2),
+        'file_mb'           : round(file_bytes / 1024 / 1024, 1),
+        'save_seconds'      : round(save_seconds, 2),
+        'load_seconds'      : round(load_seconds, 2),
+        'latency'           : latency
+    }, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+## 긴 타임라인을 한 번에 jsonify 할 때와 ?stream=1 로 나눠서 보낼 때의
+## 요청당 최대 메모리 (tracemalloc peak) 비교. config.test_config 의 DB 에 벤치마크용 유저와 트윗을 넣었다가 지운다.
+##
+##   python -m benchmark.bench_stream [--sizes 1000 10000 100000]
+import json
+import time
+import argparse
+import tracemalloc
+
+import config
+
+from app import create_app
+from sqlalchemy import text
+
+BENCH_EMAIL = 'bench-stream@miniter.test'
+
+
+def seed_tweets(database, count):
+    database.execute(text("""
+        INSERT INTO users (
+            name,
+            email,
+            profile,
+            hashed_password
+        ) VALUES (
+            'bench',
+            :email,
+            'benchmark user',
+            ''
+        )
+    """), {'email' : BENCH_EMAIL})
+    user_id = database.execute(text("SELECT id FROM users WHERE email = :email"), {
+        'email' : BENCH_EMAIL
+    }).scalar()
+
+    for start in range(0, count, 10000):
+        database.execute(text("""
+            INSERT INTO tweets (
+                user_id,
+                tweet
+            ) VALUES (
+                :user_id,
+                :tweet
+            )
+        """), [{
+            'user_id' : user_id,
+            'tweet'   : f'benchmark tweet {i} ' + 'x' * 100
+        } for i in range(start, min(start + 10000, count))])
+
+    return user_id
+
+
+def remove_tweets(database):
+    user_id = database.execute(text("SELECT id FROM users WHERE email = :email"), {
+        'email' : BENCH_EMAIL
+    }).scalar()
+    if user_id is None:
+        return
+
+    database.execute(text("DELETE FROM tweets WHERE user_id = :user_id"), {'user_id' : user_id})
+    database.execute(text("DELETE FROM users WHERE id = :user_id"), {'user_id' : user_id})
+
+
+def measure(client, path):
+    ## 응답을 chunk 단위로 받으면서 요청 처리 중의 최대 메모리를 잰다.
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    response = client.get(path, buffered = False)
+    size     = sum(len(chunk) for chunk in response.response)
+    response.close()
+
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'peak_kb'  : round(peak / 1024, 1),
+        'bytes'    : size,
+        'seconds'  : round(elapsed, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1000, 10000, 100000])
+    args = parser.parse_args()
+
+    app = create_app(dict(config.test_config, TIMELINE_MAX_PAGE_SIZE = max(args.sizes),
+                          TIMELINE_STREAM_MAX_COUNT = max(args.sizes)))
+    client = app.test_client()
+
+    remove_tweets(app.database)
+    user_id = seed_tweets(app.database, max(args.sizes))
+
+    result = {}
+    try:
+        for size in args.sizes:
+            result[str(size)] = {
+                'buffered' : measure(client, f'/timeline/{user_id}?count={size}'),
+                'stream'   : measure(client, f'/timeline/{user_id}?stream=1&count={size}')
+            }
+    finally:
+        remove_tweets(app.database)
+
+    print(json.dumps(result, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+## /timeline/stream 의 TimelineHub 비용을 잰다. DB 없이 hub 만 쓴다.
+## WSGI 서버처럼 연결마다 쓰레드 하나가 Subscription.get 에 멈춰 있는 idle 연결을 --subscribers 개 만들고
+##   - idle 연결 하나 당 메모리 (RSS 증가량, hub 가 들고 있는 바이트)
+##   - idle 연결들이 --idle-seconds 동안 쓴 CPU 시간 (heartbeat 로만 깨어난다)
+##   - 팔로워 수 별 publish 시간과 publish 부터 연결 쓰레드가 트윗을 받기까지의 latency (p50 / p99)
+## 를 JSON 으로 출력한다.
+##
+##   python -m benchmark.bench_timeline_push [--subscribers 2000] [--followers 10,100,1000] [--heartbeat 15]
+import os
+import json
+import time
+import argparse
+import threading
+
+from model import TimelineHub, Tweet
+
+
+def rss_bytes():
+    ## 리눅스가 아니면 None
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def connection(subscription, heartbeat, received, stop):
+    ## view 의 timeline_event_stream 처럼 트윗이나 heartbeat 를 기다린다. 트윗을 받은 시각을 남긴다.
+    while not stop.is_set():
+        tweets = subscription.get(heartbeat)
+        if tweets is None:
+            return
+
+        now = time.perf_counter()
+        for tweet in tweets:
+            received.append((tweet.id, now))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type = int, default = 2000)
+    parser.add_argument('--followers', default = '10,100,1000')
+    parser.add_argument('--heartbeat', type = float, default = 15)
+    parser.add_argument('--idle-seconds', type = float, default = 5)
+    parser.add_argument('--publishes', type = int, default = 200)
+    parser.add_argument('--stack-kb', type = int, default = 256, help = 'connection thread stack size')
+    args = parser.parse_args()
+
+    threading.stack_size(args.stack_kb * 1024)
+
+    followers    = [int(count) for count in args.followers.split(',')]
+    timeline_hub = TimelineHub(buffer_size = 100, max_subscribers = args.subscribers + 1)
+    stop         = threading.Event()
+    received     = []
+
+    ## 유저 id 1 이 작성자, 2.. 가 연결된 유저. 앞에서부터 max(followers) 명이 작성자를 팔로우한다.
+    rss_before = rss_bytes()
+    threads    = []
+    for user_id in range(2, args.subscribers + 2):
+        subscription = timeline_hub.subscribe(user_id, [1] if user_id - 2 < max(followers) else [])
+        thread = threading.Thread(target = connection, args = (subscription, args.heartbeat, received, stop), daemon = True)
+        thread.start()
+        threads.append(thread)
+
+    time.sleep(0.5)
+    rss_after = rss_bytes()
+    hub_bytes = timeline_hub.memory_bytes()
+
+    cpu_started = time.process_time()
+    time.sleep(args.idle_seconds)
+    idle_cpu = time.process_time() - cpu_started
+
+    ## 팔로워 수를 바꿔 가며 publish 한다. 팔로우를 끊어서 작성자의 구독자 수를 맞춘다.
+    publish = {}
+    tweet_id = 0
+    for count in sorted(followers, reverse = True):
+        for user_id in range(count + 2, max(followers) + 2):
+            timeline_hub.unfollow(user_id, 1)
+
+        publish_seconds = []
+        latencies       = []
+        for _ in range(args.publishes):
+            tweet_id += 1
+            received.clear()
+
+            started = time.perf_counter()
+            timeline_hub.publish(1, Tweet(tweet_id, 1, 'benchmark'))
+            publish_seconds.append(time.perf_counter() - started)
+
+            deadline = time.perf_counter() + 1
+            while len(received) < count and time.perf_counter() < deadline:
+                time.sleep(0.0005)
+            latencies.extend(at - started for _, at in list(received))
+
+        publish[count] = {
+            'publish_us'     : round(percentile(publish_seconds, 0.50) * 1e6, 1),
+            'delivery_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'delivery_p99_ms': round(percentile(latencies, 0.99) * 1000, 3)
+        }
+
+    stop.set()
+    stats = timeline_hub.stats()
+
+    print(json.dumps({
+        'subscribers'                : args.subscribers,
+        'rss_per_subscriber_kb'      : round((rss_after - rss_before) / args.subscribers / 1024, 1)
+                                       if rss_before is not None else None,
+        'hub_bytes_per_subscriber'   : round(hub_bytes / args.subscribers),
+        'idle_cpu_ms_per_second'     : round(idle_cpu / args.idle_seconds * 1000, 2),
+        'publish_by_followers'       : publish,
+        'evicted'                    : stats['evicted']
+    }, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
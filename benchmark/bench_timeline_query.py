@@ -0,0 +1,111 @@
+## 타임라인 한 페이지를 읽는 시간이 tweets 테이블 크기에 따라 어떻게 변하는지
+## 예전 쿼리 (팔로우 목록 IN 서브쿼리 + 전체 정렬) 와 작성자별 range scan 의 UNION ALL 쿼리로 비교한다.
+## 유저 / 팔로우 수는 그대로 두고 유저당 트윗 수만 늘려 가며 잰다.
+## 팔로우 수가 중간인 유저와 가장 적은 유저 (타임라인에 보일 트윗이 드문 유저) 를 따로 잰다.
+## 대상 DB (기본값 config.test_config 의 DB_URL) 의 테이블을 지우고 다시 만든다.
+##
+##   python -m benchmark.bench_timeline_query [--users 200] [--follows 50] [--tweets 10,100,1000] [--count 21]
+import json
+import time
+import random
+import argparse
+import statistics
+
+import config
+
+from sqlalchemy import create_engine, text
+
+from model import TweetDao
+from schema.migrate import find_migrations, upgrade
+from benchmark.bench_schema import create_bare_tables, drop_tables, seed, analyze
+
+## 이 변경 전의 TweetDao.get_timeline 쿼리
+LEGACY_TIMELINE = """
+    SELECT
+        t.id,
+        t.user_id,
+        t.tweet
+    FROM tweets t
+    WHERE (
+        t.user_id = :user_id
+        OR t.user_id IN (
+            SELECT ufl.follow_user_id
+            FROM users_follow_list ufl
+            WHERE ufl.user_id = :user_id
+        )
+    )
+    ORDER BY t.id DESC
+    LIMIT :limit
+"""
+
+
+def median_ms(call, repeat):
+    call()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def sparse_user_id(database):
+    ## 팔로우 하는 유저가 가장 적은 유저
+    return database.execute(text("""
+        SELECT user_id
+        FROM users_follow_list
+        GROUP BY user_id
+        ORDER BY COUNT(*), user_id
+        LIMIT 1
+    """)).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default = config.test_config['DB_URL'])
+    parser.add_argument('--users', type = int, default = 200)
+    parser.add_argument('--follows', type = int, default = 50)
+    parser.add_argument('--tweets', default = '10,100,1000', help = '유저당 트윗 수 (쉼표로 구분)')
+    parser.add_argument('--count', type = int, default = 21)
+    parser.add_argument('--repeat', type = int, default = 20)
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    database        = create_engine(args.url, encoding = 'utf-8')
+    tweet_dao       = TweetDao(database)
+    index_migration = next(migration for migration in find_migrations() if migration.name == 'hot_query_indexes')
+
+    result = []
+    for tweets in [int(size) for size in args.tweets.split(',')]:
+        create_bare_tables(database)
+        with database.begin() as connection:
+            index_migration.run(connection)
+        seed(database, random.Random(args.seed), args.users, args.follows, tweets)
+        analyze(database)
+
+        for user, user_id in [('median', args.users // 2), ('sparse', sparse_user_id(database))]:
+            legacy = lambda: database.execute(text(LEGACY_TIMELINE), {'user_id' : user_id, 'limit' : args.count}).fetchall()
+            union  = lambda: tweet_dao.get_timeline(user_id, limit = args.count)
+
+            assert [row['id'] for row in legacy()] == [tweet['id'] for tweet in union()]
+
+            result.append({
+                'tweets'    : args.users * tweets,
+                'user'      : user,
+                'followees' : len(tweet_dao.get_followee_ids(user_id)),
+                'legacy_ms' : median_ms(legacy, args.repeat),
+                'union_ms'  : median_ms(union, args.repeat)
+            })
+
+    ## 0001 migration 은 MySQL 용이므로 MySQL 일 때만 스키마를 원래대로 만든다.
+    if database.dialect.name == 'mysql':
+        drop_tables(database)
+        upgrade(database)
+
+    print(json.dumps(result, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
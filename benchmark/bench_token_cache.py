@@ -0,0 +1,84 @@
+## login_required 에서 검증한 JWT 를 캐시 했을 때와 안 했을 때의 요청당 비용 비교
+##
+##   python -m benchmark.bench_token_cache [--requests 20000]
+import jwt
+import json
+import time
+import argparse
+
+from flask import Flask, g
+from datetime import datetime, timedelta
+
+from model import LRUCache
+from view import login_required
+
+SECRET_KEY = 'benchmark'
+
+
+def create_bench_app(cache_size):
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = SECRET_KEY
+
+    if cache_size > 0:
+        app.extensions['token_cache'] = LRUCache(max_entries = cache_size)
+
+    @app.route("/protected", methods=['GET'])
+    @login_required
+    def protected():
+        return str(g.user_id)
+
+    return app
+
+
+def measure_decorator(app, token, requests):
+    ## 요청 컨텍스트 안에서 데코레이터만 반복 호출해서 인증 비용만 잰다.
+    view = app.view_functions['protected']
+
+    with app.test_request_context('/protected', headers = {'Authorization' : token}):
+        view()
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            view()
+
+        return (time.perf_counter() - started) / requests
+
+
+def measure_request(app, token, requests):
+    ## test client 로 전체 요청 처리 비용을 잰다.
+    client = app.test_client()
+    client.get('/protected', headers = {'Authorization' : token})
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get('/protected', headers = {'Authorization' : token})
+
+    return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type = int, default = 20000)
+    args = parser.parse_args()
+
+    token = jwt.encode({
+        'user_id' : 1,
+        'exp'     : datetime.utcnow() + timedelta(seconds = 60 * 60 * 24)
+    }, SECRET_KEY, 'HS256')
+
+    result = {}
+    for name, cache_size in [('no_cache', 0), ('token_cache', 10000)]:
+        app = create_bench_app(cache_size)
+        result[name] = {
+            'decorator_us' : round(measure_decorator(app, token, args.requests) * 1e6, 2),
+            'request_us'   : round(measure_request(app, token, args.requests // 10) * 1e6, 2)
+        }
+
+    result['saved_per_request_us'] = round(
+        result['no_cache']['decorator_us'] - result['token_cache']['decorator_us'], 2)
+
+    print(json.dumps(result, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+## 해시태그 집계 (model.TrendingTopics) 의 sketch 크기 별 정확도와 메모리, 처리 속도를 잰다.
+## 빈도가 Zipf 분포를 따르는 해시태그가 1~3개씩 든 가상의 트윗을 window 하나 안에 넣고,
+## 정확히 센 top-k 와 비교해서 recall 과 그 해시태그들의 추정 횟수 상대 오차를 JSON 으로 출력한다.
+## 정확히 셀 때 쓰는 dict 의 메모리도 같이 출력한다. (해시태그 종류 수에 비례해서 커진다)
+##
+##   python -m benchmark.bench_trending [--tweets 500000] [--vocabulary 1000000] [--widths 256,1024,4096,16384] [--depths 2,4]
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+
+from model import TrendingTopics
+
+
+def generate_tweets(rng, tweets, vocabulary, skew):
+    ## 해시태그 i 의 빈도는 1 / (i + 1)^skew 에 비례한다.
+    tags    = [f't{index}' for index in range(vocabulary)]
+    weights = list(itertools.accumulate(1 / (index + 1) ** skew for index in range(vocabulary)))
+
+    return [
+        ' '.join(f'#{tag}' for tag in rng.choices(tags, cum_weights = weights, k = rng.randint(1, 3)))
+        for _ in range(tweets)
+    ]
+
+
+def exact_counts(tweets):
+    counts = {}
+    for tweet in tweets:
+        for tag in set(tweet.split()):
+            tag = tag[1:]
+            counts[tag] = counts.get(tag, 0) + 1
+
+    return counts
+
+
+def dict_bytes(counts):
+    return sys.getsizeof(counts) + sum(sys.getsizeof(tag) + sys.getsizeof(count) for tag, count in counts.items())
+
+
+def measure(tweets, exact, width, depth, k):
+    trending = TrendingTopics(window = 3600, buckets = 12, width = width, depth = depth, k = k,
+                              refresh = 0, clock = lambda: 0.0)
+
+    started = time.perf_counter()
+    for tweet in tweets:
+        trending.add(tweet)
+    seconds = time.perf_counter() - started
+
+    ## 오차는 실제 top-k 해시태그들의 추정 횟수로 잰다.
+    top      = trending.top()
+    expected = {tag for tag, _ in sorted(exact.items(), key = lambda item: -item[1])[:k]}
+    errors   = [(trending.sum.estimate(tag) - exact[tag]) / exact[tag] for tag in expected]
+    reported = {trend['hashtag'] for trend in top}
+
+    return {
+        'width'               : width,
+        'depth'               : depth,
+        'memory_kb'           : round(trending.memory_bytes() / 1024, 1),
+        'tweets_per_second'   : round(len(tweets) / seconds),
+        'recall'              : round(len(expected & reported) / k, 3),
+        'false_positives'     : len(reported - expected),
+        'mean_relative_error' : round(sum(errors) / len(errors), 4),
+        'max_relative_error'  : round(max(errors), 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tweets', type = int, default = 500000)
+    parser.add_argument('--vocabulary', type = int, default = 1000000)
+    parser.add_argument('--skew', type = float, default = 1.1)
+    parser.add_argument('--widths', default = '256,1024,4096,16384')
+    parser.add_argument('--depths', default = '2,4')
+    parser.add_argument('--k', type = int, default = 50)
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    tweets = generate_tweets(random.Random(args.seed), args.tweets, args.vocabulary, args.skew)
+    exact  = exact_counts(tweets)
+
+    results = [
+        measure(tweets, exact, width, depth, args.k)
+        for depth in map(int, args.depths.split(','))
+        for width in map(int, args.widths.split(','))
+    ]
+
+    print(json.dumps({
+        'tweets'          : args.tweets,
+        'distinct_tags'   : len(exact),
+        'exact_memory_kb' : round(dict_bytes(exact) / 1024, 1),
+        'sketches'        : results
+    }, indent = 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+## 모든 엔드포인트에 대한 부하 테스트.
+## config.test_config 의 DB 를 비우고 가상의 소셜 그래프 (팔로우 수가 power-law 분포) 를 채운 뒤
+## create_app(test_config) 을 별도 프로세스의 쓰레드 서버로 띄우고,
+## 라우트마다 동시 클라이언트로 duration 초 동안 요청을 보내서 rps 와 p50/p95/p99 latency 를 JSON 으로 출력한다.
+## 테스트 DB 의 데이터를 모두 지우므로 운영 DB 에 돌리면 안된다.
+##
+##   python -m benchmark.loadtest [--users 1000] [--concurrency 16] [--duration 10] \
+##                                [--set TIMELINE_FANOUT=write] [--output result.json]
+import os
+import jwt
+import json
+import time
+import bcrypt
+import random
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+import multiprocessing
+
+from datetime import datetime, timedelta
+
+import config
+
+from sqlalchemy import text, inspect
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from model import create_database_from_config
+
+TABLES   = ['home_timeline', 'users_follow_list', 'tweets', 'users']
+PASSWORD = 'loadtest password'
+
+
+####################################################
+#       Synthetic social graph
+####################################################
+def reset_database(database):
+    tables = [table for table in TABLES if inspect(database).has_table(table)]
+
+    with database.begin() as connection:
+        if database.dialect.name == 'mysql':
+            connection.execute(text("SET FOREIGN_KEY_CHECKS=0"))
+            for table in tables:
+                connection.execute(text(f"TRUNCATE {table}"))
+            connection.execute(text("SET FOREIGN_KEY_CHECKS=1"))
+        else:
+            for table in tables:
+                connection.execute(text(f"DELETE FROM {table}"))
+
+
+def generate_graph(rng, users, follows, skew):
+    ## 유저마다 평균 follows 명을 팔로우 한다. 앞 번호 유저일수록 (1 / rank^skew) 많이 팔로우 받으므로
+    ## 소수의 셀럽과 다수의 일반 유저로 이루어진 그래프가 만들어진다.
+    user_ids = list(range(1, users + 1))
+    weights  = [1 / (rank ** skew) for rank in user_ids]
+
+    edges = set()
+    for user_id in user_ids:
+        count = min(users - 1, max(0, int(rng.expovariate(1 / follows)))) if follows else 0
+        for follow_id in rng.choices(user_ids, weights, k = count):
+            if follow_id != user_id:
+                edges.add((user_id, follow_id))
+
+    return sorted(edges)
+
+
+def insert_many(database, statement, rows, chunk_size = 5000):
+    for start in range(0, len(rows), chunk_size):
+        database.execute(text(statement), rows[start:start + chunk_size])
+
+
+def seed_database(database, app_config, rng, users, follows, tweets, skew):
+    reset_database(database)
+
+    hashed_password = bcrypt.hashpw(
+        PASSWORD.encode('UTF-8'),
+        bcrypt.gensalt(app_config.get('BCRYPT_ROUNDS', 12))
+    ).decode('UTF-8')
+
+    insert_many(database, """
+        INSERT INTO users (
+            id,
+            name,
+            email,
+            profile,
+            hashed_password
+        ) VALUES (
+            :id,
+            :name,
+            :email,
+            'load test user',
+            :hashed_password
+        )
+    """, [{
+        'id'              : user_id,
+        'name'            : f'user{user_id}',
+        'email'           : f'user{user_id}@loadtest.miniter',
+        'hashed_password' : hashed_password
+    } for user_id in range(1, users + 1)])
+
+    edges = generate_graph(rng, users, follows, skew)
+    insert_many(database, """
+        INSERT INTO users_follow_list (
+            user_id,
+            follow_user_id
+        ) VALUES (
+            :user_id,
+            :follow_user_id
+        )
+    """, [{'user_id' : user_id, 'follow_user_id' : follow_id} for user_id, follow_id in edges])
+
+    insert_many(database, """
+        INSERT INTO tweets (
+            user_id,
+            tweet
+        ) VALUES (
+            :user_id,
+            :tweet
+        )
+    """, [{
+        'user_id' : rng.randint(1, users),
+        'tweet'   : f'load test tweet {i}'
+    } for i in range(users * tweets)])
+
+    ## fan-out-on-write 모드면 기존 트윗들을 홈 타임라인에도 채워 둔다.
+    if app_config.get('TIMELINE_FANOUT', 'read') != 'read':
+        database.execute(text("""
+            INSERT INTO home_timeline (
+                user_id,
+                tweet_id
+            )
+            SELECT t.user_id, t.id FROM tweets t
+            UNION ALL
+            SELECT ufl.user_id, t.id
+            FROM tweets t
+            JOIN users_follow_list ufl ON ufl.follow_user_id = t.user_id
+        """))
+
+    return edges
+
+
+####################################################
+#       Server
+####################################################
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        ## 요청마다 stderr 에 로그를 남기면 그 비용이 결과에 섞인다.
+        pass
+
+
+def serve(app_config, port):
+    ## 부하를 만드는 클라이언트 쓰레드와 GIL 을 나눠 쓰지 않도록 서버는 별도 프로세스에서 띄운다.
+    ## (PasswordHasher 가 자식 프로세스를 만들어야 하므로 daemon 프로세스로 띄우면 안된다.)
+    from app import create_app
+
+    app = create_app(app_config)
+    make_server('127.0.0.1', port, app, threaded = True,
+                request_handler = KeepAliveRequestHandler).serve_forever()
+
+
+def wait_for_port(port, server, timeout = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and server.is_alive():
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout = 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+####################################################
+#       Load generation
+####################################################
+class Route:
+    ## 한 라우트에 보낼 요청을 만든다. request(client_id, seq) 는 (method, path, body, headers) 를 돌려준다.
+    def __init__(self, name, request, ok = (200,)):
+        self.name    = name
+        self.request = request
+        self.ok      = ok
+
+
+def build_routes(app_config, rng, users, edges):
+    def token(user_id):
+        return jwt.encode({
+            'user_id' : user_id,
+            'exp'     : datetime.utcnow() + timedelta(hours = 1)
+        }, app_config['JWT_SECRET_KEY'], 'HS256')
+
+    tokens = {user_id : token(user_id) for user_id in range(1, users + 1)}
+
+    ## follow 는 아직 없는 관계만, unfollow 는 follow 단계에서 만든 관계만 쓴다.
+    existing  = set(edges)
+    new_edges = []
+    while len(new_edges) < users * 20 and len(existing) < users * (users - 1):
+        edge = (rng.randint(1, users), rng.randint(1, users))
+        if edge[0] != edge[1] and edge not in existing:
+            existing.add(edge)
+            new_edges.append(edge)
+
+    follow_iter = iter(new_edges)
+    followed    = []
+    edge_lock   = threading.Lock()
+
+    def next_follow():
+        with edge_lock:
+            edge = next(follow_iter, None)
+            if edge is not None:
+                followed.append(edge)
+
+            return edge
+
+    def next_unfollow():
+        with edge_lock:
+            return followed.pop() if followed else None
+
+    def user_of(client_id, seq):
+        return (client_id * 7919 + seq) % users + 1
+
+    def auth(user_id):
+        return {'Authorization' : tokens[user_id], 'Content-Type' : 'application/json'}
+
+    def follow_request(name, next_edge):
+        def request(client_id, seq):
+            edge = next_edge()
+            if edge is None:
+                return None
+
+            return 'POST', f'/{name}', {name : edge[1]}, auth(edge[0])
+        return request
+
+    return [
+        Route('GET /ping', lambda c, s: ('GET', '/ping', None, {})),
+        Route('POST /sign-up', lambda c, s: ('POST', '/sign-up', {
+            'name'     : f'new{c}-{s}',
+            'email'    : f'new{c}-{s}@loadtest.miniter',
+            'profile'  : 'load test user',
+            'password' : PASSWORD
+        }, {'Content-Type' : 'application/json'})),
+        Route('POST /login', lambda c, s: ('POST', '/login', {
+            'email'    : f'user{user_of(c, s)}@loadtest.miniter',
+            'password' : PASSWORD
+        }, {'Content-Type' : 'application/json'})),
+        Route('GET /timeline/<user_id>', lambda c, s: ('GET', f'/timeline/{user_of(c, s)}', None, {})),
+        Route('GET /timeline', lambda c, s: ('GET', '/timeline', None, auth(user_of(c, s)))),
+        Route('GET /timeline?max_id', lambda c, s: ('GET', f'/timeline/{user_of(c, s)}?max_id={users * 5}', None, {})),
+        Route('POST /tweet', lambda c, s: ('POST', '/tweet', {
+            'tweet' : f'load test tweet {c}-{s}'
+        }, auth(user_of(c, s)))),
+        Route('POST /follow', follow_request('follow', next_follow)),
+        Route('POST /unfollow', follow_request('unfollow', next_unfollow))
+    ]
+
+
+def run_client(port, route, client_id, deadline, latencies, statuses):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout = 30)
+    seq        = 0
+
+    while time.monotonic() < deadline:
+        request = route.request(client_id, seq)
+        seq    += 1
+        if request is None:
+            break
+
+        method, path, body, headers = request
+        body = json.dumps(body) if body is not None else None
+
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body = body, headers = headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout = 30)
+            status     = 0
+
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    connection.close()
+
+
+def run_route(port, route, concurrency, duration):
+    latencies = [[] for _ in range(concurrency)]
+    statuses  = [{} for _ in range(concurrency)]
+    started   = time.monotonic()
+    deadline  = started + duration
+
+    clients = [
+        threading.Thread(target = run_client, args = (port, route, i, deadline, latencies[i], statuses[i]))
+        for i in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    elapsed = time.monotonic() - started
+
+    merged = {}
+    for client_statuses in statuses:
+        for status, count in client_statuses.items():
+            merged[status] = merged.get(status, 0) + count
+
+    return summarize([latency for client in latencies for latency in client], merged, route.ok, elapsed)
+
+
+def summarize(latencies, statuses, ok, elapsed):
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {
+        'requests' : len(latencies),
+        'errors'   : sum(count for status, count in statuses.items() if status not in ok),
+        'statuses' : {str(status) : count for status, count in sorted(statuses.items())},
+        'rps'      : round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms'  : round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms'   : percentile(0.50),
+        'p95_ms'   : percentile(0.95),
+        'p99_ms'   : percentile(0.99)
+    }
+
+
+####################################################
+#       Main
+####################################################
+def parse_overrides(pairs):
+    ## --set KEY=VALUE 로 test_config 값을 덮어쓴다. 값은 JSON 으로 읽고 실패하면 문자열로 쓴다.
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+
+    return overrides
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd    = os.path.dirname(os.path.abspath(__file__)),
+            stderr = subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type = int, default = 1000)
+    parser.add_argument('--follows', type = int, default = 20, help = 'average followees per user')
+    parser.add_argument('--tweets', type = int, default = 10, help = 'tweets per user')
+    parser.add_argument('--skew', type = float, default = 1.0, help = 'power-law exponent of follower counts')
+    parser.add_argument('--concurrency', type = int, default = 16)
+    parser.add_argument('--duration', type = float, default = 10)
+    parser.add_argument('--routes', nargs = '+', help = 'only run routes whose name contains one of these')
+    parser.add_argument('--seed', type = int, default = 42)
+    parser.add_argument('--port', type = int, default = 5200)
+    parser.add_argument('--set', dest = 'overrides', action = 'append', default = [], metavar = 'KEY=VALUE')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    ## 유저 당 rate limit 은 서버 처리량을 재는 데 방해가 되므로 끈다. (--set RATE_LIMITS=... 로 켤 수 있다.)
+    app_config = dict(config.test_config, RATE_LIMITS = {})
+    app_config.update(parse_overrides(args.overrides))
+    rng        = random.Random(args.seed)
+
+    database = create_database_from_config(app_config)
+    started  = time.perf_counter()
+    edges    = seed_database(database, app_config, rng, args.users, args.follows, args.tweets, args.skew)
+    seeded   = time.perf_counter() - started
+    database.dispose()
+
+    server = multiprocessing.Process(target = serve, args = (app_config, args.port))
+    server.start()
+    try:
+        wait_for_port(args.port, server)
+
+        routes = build_routes(app_config, rng, args.users, edges)
+        if args.routes:
+            routes = [route for route in routes if any(name in route.name for name in args.routes)]
+
+        results = {}
+        for route in routes:
+            results[route.name] = run_route(args.port, route, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        'meta' : {
+            'git_revision' : git_revision(),
+            'timestamp'    : datetime.utcnow().isoformat() + 'Z',
+            'python'       : platform.python_version(),
+            'platform'     : platform.platform(),
+            'config'       : {key : value for key, value in app_config.items()
+                              if key not in ('DB_URL', 'DB_READ_URL', 'JWT_SECRET_KEY')},
+            'users'        : args.users,
+            'follows'      : len(edges),
+            'tweets'       : args.users * args.tweets,
+            'skew'         : args.skew,
+            'seed'         : args.seed,
+            'concurrency'  : args.concurrency,
+            'duration'     : args.duration,
+            'seed_seconds' : round(seeded, 2)
+        },
+        'routes' : results
+    }
+
+    output = json.dumps(report, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
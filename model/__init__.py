@@ -1,7 +1,50 @@
 from .user_dao import UserDao
 from .tweet_dao import TweetDao
+from .timeline_dao import TimelineDao
+from .recent_tweet_cache import RecentTweetCache
+from .cache import LRUCache
+from .timeline_cache import TimelineCache
+from .follow_graph import FollowGraph
+from .tweet_writer import TweetWriter, TweetQueueFull, TweetWriteTimeout
+from .database import create_database, create_database_from_config
+from .database import create_async_database, create_async_database_from_config
+from .async_user_dao import AsyncUserDao
+from .async_tweet_dao import AsyncTweetDao
+from .metrics import Metrics, instrument_database, instrument_dao
+from .slow_query_log import SlowQueryLog
+from .records import Record, Tweet, UserCredential
+from .search_index import SearchIndex
+from .trending import TrendingTopics, CountMinSketch, extract_hashtags
+from .timeline_hub import TimelineHub, Subscription
 
 __all__  = [
     "UserDao",
-    "TweetDao"
+    "TweetDao",
+    "TimelineDao",
+    "RecentTweetCache",
+    "LRUCache",
+    "TimelineCache",
+    "FollowGraph",
+    "TweetWriter",
+    "TweetQueueFull",
+    "TweetWriteTimeout",
+    "create_database",
+    "create_database_from_config",
+    "create_async_database",
+    "create_async_database_from_config",
+    "AsyncUserDao",
+    "AsyncTweetDao",
+    "Metrics",
+    "instrument_database",
+    "instrument_dao",
+    "SlowQueryLog",
+    "Record",
+    "Tweet",
+    "UserCredential",
+    "SearchIndex",
+    "TrendingTopics",
+    "CountMinSketch",
+    "extract_hashtags",
+    "TimelineHub",
+    "Subscription"
 ]
\ No newline at end of file
@@ -0,0 +1,47 @@
+from sqlalchemy import text
+
+from .records import Tweet
+from .tweet_dao import UNION_BATCH_SIZE, timeline_authors, timeline_queries, merge_timelines
+
+
+class AsyncTweetDao:
+    ## TweetDao 와 같은 쿼리를 asyncio 드라이버 (AsyncEngine) 로 실행하는 DAO
+    def __init__(self, database, read_database = None, union_batch_size = UNION_BATCH_SIZE):
+        self.db               = database
+        self.read_db          = read_database if read_database is not None else database  ## 읽기 전용 replica
+        self.union_batch_size = union_batch_size
+
+    async def insert_tweet(self, user_id, tweet):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                INSERT INTO tweets (
+                    user_id,
+                    tweet
+                ) VALUES (
+                    :id,
+                    :tweet
+                )
+            """), {
+                'id'     : user_id,
+                'tweet'  : tweet
+            })
+
+            return result.lastrowid
+
+    async def get_timeline(self, user_id, max_id = None, since_id = None, limit = None):
+        async with self.read_db.connect() as connection:
+            followees = (await connection.execute(text("""
+                SELECT follow_user_id
+                FROM users_follow_list
+                WHERE user_id = :user_id
+            """), {
+                'user_id' : user_id
+            })).fetchall()
+
+            author_ids = timeline_authors(user_id, [row['follow_user_id'] for row in followees])
+            results    = [
+                (await connection.execute(*query)).fetchall()
+                for query in timeline_queries(author_ids, max_id, since_id, limit, self.union_batch_size)
+            ]
+
+        return Tweet.from_rows(merge_timelines(results, limit))
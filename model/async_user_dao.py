@@ -0,0 +1,89 @@
+from sqlalchemy import text
+
+from .records import UserCredential
+
+
+class AsyncUserDao:
+    ## UserDao 와 같은 쿼리를 asyncio 드라이버 (AsyncEngine) 로 실행하는 DAO
+    def __init__(self, database, read_database = None):
+        self.db      = database
+        self.read_db = read_database if read_database is not None else database  ## 읽기 전용 replica
+
+    async def insert_user(self, user):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                INSERT INTO users (
+                    name,
+                    email,
+                    profile,
+                    hashed_password
+                ) VALUES (
+                    :name,
+                    :email,
+                    :profile,
+                    :password
+                )
+            """), user)
+
+            return result.lastrowid
+
+    async def get_user_id_and_password(self, email):
+        ## UserDao 처럼 replica 에 없으면 primary 에서 한 번 더 찾는다. (replica lag)
+        row = await self.find_credential(self.read_db, email)
+        if row is None and self.read_db is not self.db:
+            row = await self.find_credential(self.db, email)
+
+        return UserCredential(*row) if row else None
+
+    async def find_credential(self, database, email):
+        async with database.connect() as connection:
+            return (await connection.execute(text("""
+                SELECT
+                    id,
+                    hashed_password
+                FROM users
+                WHERE email = :email
+            """), {'email' : email})).fetchone()
+
+    async def update_password(self, user_id, hashed_password):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                UPDATE users
+                SET hashed_password = :hashed_password
+                WHERE id = :id
+            """), {
+                'id'              : user_id,
+                'hashed_password' : hashed_password
+            })
+
+            return result.rowcount
+
+    async def insert_follow(self, user_id, follow_id):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                INSERT INTO users_follow_list (
+                    user_id,
+                    follow_user_id
+                ) VALUES (
+                    :id,
+                    :follow
+                )
+            """), {
+                'id'     : user_id,
+                'follow' : follow_id
+            })
+
+            return result.rowcount
+
+    async def insert_unfollow(self, user_id, unfollow_id):
+        async with self.db.begin() as connection:
+            result = await connection.execute(text("""
+                DELETE FROM users_follow_list
+                WHERE user_id = :id
+                AND follow_user_id = :unfollow
+            """), {
+                'id'       : user_id,
+                'unfollow' : unfollow_id
+            })
+
+            return result.rowcount
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    ## 엔트리 수(max_entries)와 바이트 수(max_bytes)로 크기가 제한되는 LRU 캐시.
+    ## ttl 이 주어지면 엔트리는 ttl 초 후에 만료된다.
+    ## sizeof 는 값의 대략적인 바이트 크기를 돌려주는 함수 (max_bytes 를 쓸 때 필요)
+    def __init__(self, max_entries, max_bytes = None, ttl = None, sizeof = None):
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.ttl         = ttl
+        self.sizeof      = sizeof
+
+        self.entries = OrderedDict()   ## key -> (value, expires_at, size)
+        self.bytes   = 0
+        self.lock    = threading.Lock()
+
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default = None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= time.time():
+                self.remove(key)
+                self.expirations += 1
+                self.misses      += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def set(self, key, value, ttl = None, expires_at = None):
+        ## expires_at (epoch 초) 을 직접 주면 ttl 대신 그 시각에 만료된다.
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+
+        if expires_at is None:
+            ttl = self.ttl if ttl is None else ttl
+            if ttl is not None:
+                expires_at = time.time() + ttl
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+            self.entries[key] = (value, expires_at, size)
+            self.bytes       += size
+
+            while len(self.entries) > self.max_entries or (
+                    self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self.remove(key)
+
+    def remove(self, key):
+        ## lock 을 잡은 상태에서만 호출한다.
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+        self.removed(key)
+
+    def removed(self, key):
+        ## 엔트리가 빠질 때마다 불리는 hook (하위 클래스에서 사용)
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries'     : len(self.entries),
+                'bytes'       : self.bytes,
+                'hits'        : self.hits,
+                'misses'      : self.misses,
+                'evictions'   : self.evictions,
+                'expirations' : self.expirations
+            }
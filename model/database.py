@@ -0,0 +1,112 @@
+import time
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+class TimedQueuePool(QueuePool):
+    ## 커넥션을 pool 에서 꺼낼 때까지 기다린 시간을 기록하는 QueuePool
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.stats_lock            = threading.Lock()
+        self.checkouts             = 0
+        self.checkout_wait_seconds = 0.0
+        self.max_checkout_wait     = 0.0
+        self.checkout_timeouts     = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self.stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self.stats_lock:
+                self.checkouts             += 1
+                self.checkout_wait_seconds += waited
+                self.max_checkout_wait      = max(self.max_checkout_wait, waited)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'size'                      : self.size(),
+                'checked_out'               : self.checkedout(),
+                'overflow'                  : self.overflow(),
+                'checkouts'                 : self.checkouts,
+                'checkout_wait_seconds'     : self.checkout_wait_seconds,
+                'max_checkout_wait_seconds' : self.max_checkout_wait,
+                'checkout_timeouts'         : self.checkout_timeouts
+            }
+
+
+def create_database(url, pool_size = 5, max_overflow = 0, pool_timeout = 30,
+                    pool_recycle = -1, pool_pre_ping = False):
+    connect_args = {}
+    if url.startswith('sqlite'):
+        ## 로컬 sqlite 파일로 테스트 할 때 여러 쓰레드가 pool 의 커넥션을 나눠 쓸 수 있도록
+        connect_args['check_same_thread'] = False
+
+    return create_engine(
+        url,
+        encoding      = 'utf-8',
+        poolclass     = TimedQueuePool,
+        pool_size     = pool_size,
+        max_overflow  = max_overflow,
+        pool_timeout  = pool_timeout,
+        pool_recycle  = pool_recycle,
+        pool_pre_ping = pool_pre_ping,
+        connect_args  = connect_args
+    )
+
+
+def create_database_from_config(config, url_key = 'DB_URL'):
+    return create_database(
+        config[url_key],
+        pool_size     = config.get('DB_POOL_SIZE', 5),
+        max_overflow  = config.get('DB_MAX_OVERFLOW', 0),
+        pool_timeout  = config.get('DB_POOL_TIMEOUT', 30),
+        pool_recycle  = config.get('DB_POOL_RECYCLE', -1),
+        pool_pre_ping = config.get('DB_POOL_PRE_PING', False)
+    )
+
+
+def create_async_database(url, pool_size = 5, max_overflow = 0, pool_timeout = 30,
+                          pool_recycle = -1, pool_pre_ping = False):
+    ## asyncio 드라이버용 엔진. 동기 드라이버 URL 을 주면 같은 DB 의 async 드라이버로 바꿔 준다.
+    ## (mysql -> mysql+aiomysql, sqlite -> sqlite+aiosqlite)
+    url     = make_url(url)
+    backend = url.get_backend_name()
+    if backend == 'mysql' and url.get_driver_name() != 'aiomysql':
+        url = url.set(drivername = 'mysql+aiomysql')
+    elif backend == 'sqlite' and url.get_driver_name() != 'aiosqlite':
+        url = url.set(drivername = 'sqlite+aiosqlite')
+
+    if backend == 'sqlite':
+        return create_async_engine(url)
+
+    return create_async_engine(
+        url,
+        pool_size     = pool_size,
+        max_overflow  = max_overflow,
+        pool_timeout  = pool_timeout,
+        pool_recycle  = pool_recycle,
+        pool_pre_ping = pool_pre_ping
+    )
+
+
+def create_async_database_from_config(config, url_key = 'DB_URL'):
+    return create_async_database(
+        config.get('ASYNC_' + url_key, config.get(url_key)),
+        pool_size     = config.get('DB_POOL_SIZE', 5),
+        max_overflow  = config.get('DB_MAX_OVERFLOW', 0),
+        pool_timeout  = config.get('DB_POOL_TIMEOUT', 30),
+        pool_recycle  = config.get('DB_POOL_RECYCLE', -1),
+        pool_pre_ping = config.get('DB_POOL_PRE_PING', False)
+    )
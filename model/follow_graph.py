@@ -0,0 +1,129 @@
+import sys
+import threading
+
+from array import array
+from bisect import bisect_left
+
+
+class FollowGraph:
+    ## users_follow_list 를 메모리에 올려 둔 팔로우 그래프.
+    ## 유저마다 팔로우하는 유저(followees) 와 팔로워(followers) 를
+    ## 정렬된 int32 array 로 들고 있어서 bisect 로 바로 찾을 수 있다.
+    TYPECODE = 'i'
+
+    def __init__(self):
+        self.followee_lists = {}   ## user_id -> 정렬된 array (팔로우 하는 유저들)
+        self.follower_lists = {}   ## user_id -> 정렬된 array (팔로워들)
+        self.edges          = 0
+        self.lock           = threading.Lock()
+
+    def load(self, edges):
+        ## edges 는 (user_id, follow_user_id) 쌍들 (user_id, follow_user_id 순으로 정렬되어 있으면 더 빠르다)
+        followee_lists = {}
+        follower_lists = {}
+
+        for user_id, follow_id in edges:
+            followee_lists.setdefault(user_id, array(self.TYPECODE)).append(follow_id)
+            follower_lists.setdefault(follow_id, array(self.TYPECODE)).append(user_id)
+
+        for lists in (followee_lists, follower_lists):
+            for user_id, ids in lists.items():
+                lists[user_id] = array(self.TYPECODE, sorted(set(ids)))
+
+        with self.lock:
+            self.followee_lists = followee_lists
+            self.follower_lists = follower_lists
+            self.edges          = sum(len(ids) for ids in followee_lists.values())
+
+        return self.edges
+
+    def add(self, user_id, follow_id):
+        with self.lock:
+            if not insert_sorted(self.followee_lists.setdefault(user_id, array(self.TYPECODE)), follow_id):
+                return False
+
+            insert_sorted(self.follower_lists.setdefault(follow_id, array(self.TYPECODE)), user_id)
+            self.edges += 1
+
+            return True
+
+    def remove(self, user_id, unfollow_id):
+        with self.lock:
+            if not remove_sorted(self.followee_lists, user_id, unfollow_id):
+                return False
+
+            remove_sorted(self.follower_lists, unfollow_id, user_id)
+            self.edges -= 1
+
+            return True
+
+    def followees(self, user_id):
+        ## 복사본을 돌려주므로 호출한 쪽에서 마음대로 써도 된다.
+        ids = self.followee_lists.get(user_id)
+
+        return ids[:] if ids is not None else array(self.TYPECODE)
+
+    def followers(self, user_id):
+        ids = self.follower_lists.get(user_id)
+
+        return ids[:] if ids is not None else array(self.TYPECODE)
+
+    def is_following(self, user_id, follow_id):
+        ids = self.followee_lists.get(user_id)
+        if not ids:
+            return False
+
+        index = bisect_left(ids, follow_id)
+
+        return index < len(ids) and ids[index] == follow_id
+
+    def follower_count(self, user_id):
+        return len(self.follower_lists.get(user_id, ()))
+
+    def followee_count(self, user_id):
+        return len(self.followee_lists.get(user_id, ()))
+
+    def memory_bytes(self):
+        ## array 들과 유저 아이디 -> array dict 가 차지하는 대략적인 메모리
+        total = 0
+        for lists in (self.followee_lists, self.follower_lists):
+            total += sys.getsizeof(lists)
+            total += sum(sys.getsizeof(user_id) + sys.getsizeof(ids) for user_id, ids in lists.items())
+
+        return total
+
+    def stats(self):
+        memory_bytes = self.memory_bytes()
+
+        return {
+            'edges'                   : self.edges,
+            'users'                   : len(self.followee_lists.keys() | self.follower_lists.keys()),
+            'memory_bytes'            : memory_bytes,
+            'bytes_per_million_edges' : memory_bytes * 1000000 // self.edges if self.edges else 0
+        }
+
+
+def insert_sorted(ids, value):
+    index = bisect_left(ids, value)
+    if index < len(ids) and ids[index] == value:
+        return False
+
+    ids.insert(index, value)
+
+    return True
+
+
+def remove_sorted(lists, user_id, value):
+    ids = lists.get(user_id)
+    if not ids:
+        return False
+
+    index = bisect_left(ids, value)
+    if index == len(ids) or ids[index] != value:
+        return False
+
+    del ids[index]
+    if not ids:
+        del lists[user_id]
+
+    return True
@@ -0,0 +1,181 @@
+import time
+import inspect
+import bisect
+import threading
+import contextvars
+
+from functools import wraps
+from sqlalchemy import event
+
+## Prometheus 기본 bucket (초)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+## 지금 실행 중인 DAO 메소드 이름. SQL 타이밍 hook 이 어느 DAO 메소드의 쿼리인지 알 수 있게 한다.
+current_dao_method = contextvars.ContextVar('current_dao_method', default = None)
+
+
+class Histogram:
+    ## label 값 조합마다 bucket 별 개수, 합계, 개수를 들고 있는 Prometheus histogram
+    def __init__(self, name, help, label_names, buckets = DEFAULT_BUCKETS):
+        self.name        = name
+        self.help        = help
+        self.label_names = tuple(label_names)
+        self.buckets     = tuple(buckets)
+        self.series      = {}    ## label 값 tuple -> [bucket 별 개수 list, 합계]
+        self.lock        = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            series[0][index] += 1
+            series[1]        += value
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} histogram'
+        ]
+
+        with self.lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self.series.items()]
+
+        for label_values, counts, total in sorted(series):
+            labels     = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le          = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{format_labels(labels, le = le)} {cumulative}')
+
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+
+        return lines
+
+
+class Metrics:
+    ## 프로세스 하나의 metric 들을 모아서 Prometheus text format 으로 내보낸다.
+    ## histogram 은 직접 observe 하고, 캐시나 pool 처럼 stats() 를 가진 객체들은
+    ## collector 로 등록해 두면 scrape 할 때마다 값을 읽어서 gauge 로 내보낸다.
+    def __init__(self, namespace = 'miniter'):
+        self.namespace  = namespace
+        self.histograms = {}
+        self.collectors = []    ## (metric 이름 prefix, stats 함수, label dict)
+        self.lock       = threading.Lock()
+
+    def histogram(self, name, help, label_names, buckets = DEFAULT_BUCKETS):
+        name = f'{self.namespace}_{name}'
+
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, help, label_names, buckets)
+
+            return self.histograms[name]
+
+    def add_collector(self, name, collect, **labels):
+        ## collect() 는 {이름 : 숫자} dict 를 돌려준다. 각 값은 {namespace}_{name}_{이름} gauge 가 된다.
+        with self.lock:
+            self.collectors.append((f'{self.namespace}_{name}', collect, labels))
+
+    def render(self):
+        with self.lock:
+            histograms = list(self.histograms.values())
+            collectors = list(self.collectors)
+
+        lines = []
+        for histogram in histograms:
+            lines.extend(histogram.render())
+
+        gauges = {}
+        for prefix, collect, labels in collectors:
+            for key, value in collect().items():
+                if isinstance(value, (int, float)):
+                    gauges.setdefault(f'{prefix}_{key}', []).append((labels, value))
+
+        for name, samples in gauges.items():
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                lines.append(f'{name}{format_labels(labels.items())} {float(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def instrument_database(database, metrics, name = 'primary'):
+    ## 엔진에서 실행되는 모든 SQL 의 실행 시간을 어느 DAO 메소드에서 실행했는지와 함께 기록한다.
+    histogram = metrics.histogram(
+        'db_query_duration_seconds',
+        'SQL statement execution time',
+        ['database', 'dao_method', 'statement']
+    )
+
+    @event.listens_for(database, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(database, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        histogram.observe(
+            time.perf_counter() - context.query_started,
+            name,
+            current_dao_method.get() or 'other',
+            statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'other'
+        )
+
+    ## TimedQueuePool 이면 pool 상태도 같이 내보낸다.
+    if hasattr(database.pool, 'stats'):
+        metrics.add_collector('db_pool', database.pool.stats, database = name)
+
+
+def instrument_dao(dao, metrics):
+    ## DAO 인스턴스의 public 메소드들을 감싸서 호출 시간을 기록하고
+    ## 실행되는 동안 current_dao_method 를 "클래스.메소드" 로 설정한다.
+    ## (generator 메소드는 호출 시간이 의미 없으므로 감싸지 않는다.)
+    histogram = metrics.histogram(
+        'dao_duration_seconds',
+        'DAO method call time',
+        ['dao', 'method']
+    )
+    dao_name = type(dao).__name__
+
+    for name, method in inspect.getmembers(dao, inspect.ismethod):
+        if name.startswith('_') or inspect.isgeneratorfunction(method):
+            continue
+
+        setattr(dao, name, timed_method(method, histogram, dao_name, name))
+
+    return dao
+
+
+def timed_method(method, histogram, dao_name, name):
+    label = f'{dao_name}.{name}'
+
+    @wraps(method)
+    def timed(*args, **kwargs):
+        ## 다른 DAO 메소드 안에서 불리면 SQL 은 바깥 메소드 (서비스가 부른 메소드) 의 것으로 기록한다.
+        token   = current_dao_method.set(label) if current_dao_method.get() is None else None
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, dao_name, name)
+            if token is not None:
+                current_dao_method.reset(token)
+
+    return timed
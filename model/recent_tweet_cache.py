@@ -0,0 +1,67 @@
+import threading
+
+from collections import deque
+
+
+class RecentTweetCache:
+    ## 팔로워가 많은 작성자(셀럽)의 최근 트윗을 작성자별로 max_size 개까지 들고 있는다.
+    ## 셀럽의 트윗은 fan-out 하지 않고 타임라인을 읽을 때 이 캐시에서 합쳐 준다.
+    def __init__(self, max_size = 200):
+        self.max_size = max_size
+        self.tweets   = {}     ## author_id -> deque (최신 트윗이 왼쪽)
+        self.complete = {}     ## author_id -> 작성자의 트윗을 전부 들고 있는지 여부
+        self.lock     = threading.Lock()
+
+    def __contains__(self, author_id):
+        return author_id in self.tweets
+
+    def __len__(self):
+        return len(self.tweets)
+
+    def warm(self, author_id, tweets):
+        ## tweets 는 최신 순으로 정렬된 작성자의 최근 트윗
+        with self.lock:
+            self.tweets[author_id]   = deque(tweets[:self.max_size], maxlen = self.max_size)
+            self.complete[author_id] = len(tweets) < self.max_size
+
+    def push(self, author_id, tweet):
+        with self.lock:
+            recent = self.tweets.get(author_id)
+            if recent is None:
+                ## 처음 셀럽이 된 작성자는 이전 트윗이 이미 fan-out 되어 있다.
+                recent = self.tweets[author_id] = deque(maxlen = self.max_size)
+                self.complete[author_id] = False
+
+            if len(recent) == self.max_size:
+                self.complete[author_id] = False
+
+            recent.appendleft(tweet)
+
+    def newest_id(self, author_id):
+        ## 새 트윗은 모두 push 되므로 캐시의 맨 앞이 작성자의 가장 최근 트윗이다.
+        with self.lock:
+            recent = self.tweets.get(author_id)
+
+            return recent[0]['id'] if recent else None
+
+    def get(self, author_id, max_id = None, since_id = None, limit = None):
+        ## 요청한 범위를 캐시만으로 채울 수 없으면 None 을 돌려준다.
+        with self.lock:
+            recent   = list(self.tweets.get(author_id, ()))
+            complete = self.complete.get(author_id, False)
+
+        timeline = [
+            tweet for tweet in recent
+            if (max_id is None or tweet['id'] < max_id)
+            and (since_id is None or tweet['id'] > since_id)
+        ]
+
+        if limit is not None and len(timeline) >= limit:
+            return timeline[:limit]
+
+        ## since_id 보다 오래된 트윗까지 캐시에 있으면 범위 안의 트윗은 모두 들고 있는 것이다.
+        reached_since = since_id is not None and recent and recent[-1]['id'] <= since_id
+        if complete or reached_since:
+            return timeline
+
+        return None
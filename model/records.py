@@ -0,0 +1,77 @@
+class Record:
+    ## DAO 가 돌려주는 row 의 공통 부모. 필드는 __slots__ 에만 들고 있어서 row 마다 dict 를 만들지 않는다.
+    ## (10k 개 타임라인 기준 dict 의 약 1/3 크기) 기존 코드가 쓰던 record['id'] 같은 dict 식 접근과
+    ## dict 와의 비교는 그대로 지원한다. JSON 은 view.json_provider 가 as_dict() 로 바로 직렬화한다.
+    ## 자주 만들어지므로 __init__ 과 as_dict 는 하위 클래스에서 필드를 풀어서 직접 쓴다.
+    ## (dataclass 로 만들면 orjson 3.8 은 __dict__ 가 없는 dataclass 를 느린 경로로 직렬화해서 as_dict 보다 두 배 가량 느리다.)
+    __slots__ = ()
+
+    @classmethod
+    def from_rows(cls, rows):
+        ## SELECT 한 컬럼 순서가 필드 순서와 같은 row 들을 record list 로 바꾼다.
+        return [cls(*row) for row in rows]
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def get(self, key, default = None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def as_tuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def as_dict(self):
+        return {field : getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.as_tuple() == other.as_tuple()
+
+        if isinstance(other, dict):
+            return self.as_dict() == other
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+
+        return f'{type(self).__name__}({fields})'
+
+    def __getstate__(self):
+        return self.as_tuple()
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+
+class Tweet(Record):
+    __slots__ = ('id', 'user_id', 'tweet')
+
+    def __init__(self, id, user_id, tweet):
+        self.id      = id
+        self.user_id = user_id
+        self.tweet   = tweet
+
+    def as_dict(self):
+        return {
+            'id'      : self.id,
+            'user_id' : self.user_id,
+            'tweet'   : self.tweet
+        }
+
+
+class UserCredential(Record):
+    __slots__ = ('id', 'hashed_password')
+
+    def __init__(self, id, hashed_password):
+        self.id              = id
+        self.hashed_password = hashed_password
@@ -0,0 +1,319 @@
+import os
+import re
+import sys
+import math
+import heapq
+import struct
+import marshal
+import threading
+import itertools
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+TOKEN = re.compile(r'\w+')
+
+## posting 을 BLOCK_SIZE 개씩 모아서 delta 로 압축한다. delta 의 최대값에 맞는 가장 작은 array typecode 를 쓴다.
+BLOCK_SIZE   = 128
+DELTA_TYPES  = (('B', 1 << 8), ('H', 1 << 16), ('I', 1 << 32), ('Q', 1 << 64))
+MAX_TERM_LEN = 40
+
+## 색인 파일은 header (magic, 버전, block 크기, byte order) 뒤에 int / bytes / str / tuple / dict 만으로 된 상태를
+## marshal 로 붙인다. array 는 typecode 와 raw bytes 로 저장한다. pickle 과 달리 읽을 때 코드가 실행되지 않는다.
+FILE_MAGIC   = b'MNSI'
+FILE_HEADER  = struct.Struct('<4sHHB')
+FILE_VERSION = 2
+
+
+def tokenize(text):
+    ## 소문자로 바꾼 단어 (유니코드 \w 연속) 들. 너무 긴 토큰 (URL 조각 등) 은 버린다.
+    return [token for token in TOKEN.findall(text.lower()) if len(token) <= MAX_TERM_LEN]
+
+
+def pack(ids):
+    ## 정렬된 id 들을 (첫 id, 이웃한 id 끼리의 차이 array) 로 압축한다.
+    deltas = [ids[index] - ids[index - 1] for index in range(1, len(ids))]
+    biggest = max(deltas, default = 0)
+    for typecode, bound in DELTA_TYPES:
+        if biggest < bound:
+            return ids[0], array(typecode, deltas)
+
+
+def unpack(first, deltas):
+    return list(itertools.accumulate(deltas, initial = first))
+
+
+class PostingList:
+    ## 한 단어가 들어간 트윗 id 들. 압축된 block 들 (id 오름차순) 과 아직 block 이 되지 않은 tail 로 나뉜다.
+    ## 트윗 안에서 2번 이상 나온 경우만 tfs 에 따로 들고 있는다. (트윗은 짧아서 거의 다 1번이다.)
+    __slots__ = ('firsts', 'lasts', 'blocks', 'tail', 'count', 'tfs')
+
+    def __init__(self):
+        self.firsts = array('q')   ## block 마다 첫 id
+        self.lasts  = array('q')   ## block 마다 마지막 id
+        self.blocks = []           ## block 마다 delta array
+        self.tail   = array('q')   ## 정렬된 최근 id 들 (BLOCK_SIZE 개가 되면 block 으로 압축)
+        self.count  = 0
+        self.tfs    = None         ## id -> 단어가 나온 횟수 (2 이상만)
+
+    def add(self, tweet_id, tf):
+        if self.lasts and tweet_id <= self.lasts[-1]:
+            ## 이미 압축된 범위보다 오래된 id (여러 쓰레드가 동시에 트윗 한 경우 등) 는 그 block 을 다시 압축한다.
+            if not self.insert_packed(tweet_id):
+                return False
+        elif not self.tail or tweet_id > self.tail[-1]:
+            self.tail.append(tweet_id)
+        else:
+            index = bisect_right(self.tail, tweet_id)
+            if index and self.tail[index - 1] == tweet_id:
+                return False
+            self.tail.insert(index, tweet_id)
+
+        if tf > 1:
+            if self.tfs is None:
+                self.tfs = {}
+            self.tfs[tweet_id] = tf
+
+        self.count += 1
+        if len(self.tail) >= BLOCK_SIZE:
+            self.seal()
+
+        return True
+
+    def insert_packed(self, tweet_id):
+        index = max(0, bisect_right(self.firsts, tweet_id) - 1)
+        ids   = unpack(self.firsts[index], self.blocks[index])
+        where = bisect_right(ids, tweet_id)
+        if where and ids[where - 1] == tweet_id:
+            return False
+
+        ids.insert(where, tweet_id)
+        self.firsts[index], self.blocks[index] = pack(ids)
+        self.lasts[index] = ids[-1]
+
+        return True
+
+    def seal(self):
+        first, deltas = pack(self.tail)
+        self.firsts.append(first)
+        self.lasts.append(self.tail[-1])
+        self.blocks.append(deltas)
+        self.tail = array('q')
+
+    def snapshot(self):
+        ## 검색 쓰레드가 lock 밖에서 읽을 수 있는 복사본. 압축된 block 은 바뀌지 않고 교체만 되므로 list 만 복사한다.
+        return list(self.firsts), list(self.blocks), self.tail[:], self.tfs
+
+    def memory_bytes(self):
+        return (sys.getsizeof(self.firsts) + sys.getsizeof(self.lasts) + sys.getsizeof(self.blocks) +
+                sum(sys.getsizeof(block) for block in self.blocks) + sys.getsizeof(self.tail) +
+                (sys.getsizeof(self.tfs) if self.tfs is not None else 0))
+
+
+def load_array(typecode, data):
+    ## 파일에서 읽은 raw bytes 를 array 로 되돌린다. 형식이 맞지 않으면 ValueError / TypeError
+    if typecode != 'q' and typecode not in {code for code, _ in DELTA_TYPES}:
+        raise ValueError(f'unexpected array typecode {typecode!r}')
+
+    values = array(typecode)
+    values.frombytes(data)
+
+    return values
+
+
+def newest_first(firsts, blocks, tail, max_id = None):
+    ## posting 을 최신 id 부터 돌려준다. 필요한 block 만 그때그때 풀고,
+    ## max_id 가 있으면 그 이후의 block 은 풀지 않고 건너뛴다.
+    if max_id is None:
+        yield from reversed(tail)
+        start = len(blocks) - 1
+    else:
+        yield from reversed(tail[:bisect_left(tail, max_id)])
+        start = bisect_left(firsts, max_id) - 1
+
+    for index in range(start, -1, -1):
+        ids = unpack(firsts[index], blocks[index])
+        if max_id is not None and ids[-1] >= max_id:
+            ids = ids[:bisect_left(ids, max_id)]
+        yield from reversed(ids)
+
+
+class SearchIndex:
+    ## 트윗 본문의 역색인 (단어 -> 트윗 id posting list).
+    ## 트윗을 쓸 때마다 add 로 바로 색인하고, save / load 로 파일에 저장했다가 다시 읽을 수 있다.
+    ## 검색은 BM25 점수 순이고, 단어마다 최신 max_candidates 개의 posting 만 본다. (Earlybird 식 early termination)
+    ## 그래서 아주 흔한 단어도 색인 크기와 상관없이 일정한 시간 안에 끝난다.
+    K1 = 1.2
+    B  = 0.75
+
+    def __init__(self, max_candidates = 20000):
+        self.max_candidates = max_candidates
+        self.terms          = {}            ## 단어 -> PostingList
+        self.doc_lengths    = {}            ## 트윗 id -> 토큰 수 (255 에서 자른다). 색인한 트윗 수 만큼만 커진다.
+        self.docs           = 0
+        self.total_length   = 0
+        self.last_id        = 0             ## 색인한 가장 큰 트윗 id (시작할 때 DB 에서 그 이후만 읽어 온다)
+        self.lock           = threading.Lock()
+
+    def add(self, tweet_id, text):
+        tokens = tokenize(text)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+
+        with self.lock:
+            if tweet_id in self.doc_lengths:
+                return False
+
+            length = max(1, min(len(tokens), 255))
+            self.doc_lengths[tweet_id] = length
+            self.docs         += 1
+            self.total_length += length
+            self.last_id       = max(self.last_id, tweet_id)
+
+            for term, tf in counts.items():
+                postings = self.terms.get(term)
+                if postings is None:
+                    postings = self.terms[term] = PostingList()
+                postings.add(tweet_id, tf)
+
+        return True
+
+    def build(self, tweets):
+        ## (트윗 id, 본문) 들을 색인한다. 색인한 트윗 수를 돌려준다.
+        added = 0
+        for tweet_id, text in tweets:
+            added += self.add(tweet_id, text)
+
+        return added
+
+    def search(self, query, limit = 20, max_id = None):
+        ## 점수가 높은 순 (같으면 최신 순) 으로 트윗 id 를 limit 개 돌려준다.
+        ## max_id 를 주면 그보다 오래된 트윗만 찾는다.
+        terms = set(tokenize(query))
+
+        with self.lock:
+            docs        = self.docs
+            avg_length  = self.total_length / docs if docs else 1.0
+            doc_lengths = self.doc_lengths
+            snapshots   = [
+                (postings.count, postings.snapshot())
+                for postings in (self.terms.get(term) for term in terms) if postings is not None
+            ]
+
+        scores = {}
+        for count, (firsts, blocks, tail, tfs) in snapshots:
+            idf = math.log(1 + (docs - count + 0.5) / (count + 0.5))
+
+            ## tf 가 1 인 트윗의 점수는 트윗 길이로만 정해지므로 길이 별로 미리 계산해 둔다.
+            norms = [
+                idf * (self.K1 + 1) / (1 + self.K1 * (1 - self.B + self.B * length / avg_length))
+                for length in range(256)
+            ]
+
+            for tweet_id in itertools.islice(newest_first(firsts, blocks, tail, max_id), self.max_candidates):
+                if tfs is not None and tweet_id in tfs:
+                    tf     = tfs[tweet_id]
+                    length = doc_lengths[tweet_id]
+                    score  = idf * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * length / avg_length))
+                else:
+                    score = norms[doc_lengths[tweet_id]]
+
+                scores[tweet_id] = scores.get(tweet_id, 0.0) + score
+
+        ranked = heapq.nlargest(limit, scores.items(), key = lambda item: (item[1], item[0]))
+
+        return [tweet_id for tweet_id, _ in ranked]
+
+    def save(self, path):
+        ## 다른 프로세스가 반쯤 쓴 파일을 읽지 않도록 임시 파일에 쓴 뒤 바꿔 치기 한다.
+        ## 여러 worker 가 동시에 저장해도 서로의 임시 파일을 덮어쓰지 않도록 임시 파일 이름에 pid 를 붙인다.
+        with self.lock:
+            doc_ids = array('q', self.doc_lengths.keys())
+            state   = (
+                self.docs,
+                self.total_length,
+                self.last_id,
+                doc_ids.tobytes(),
+                bytes(self.doc_lengths.values()),
+                {
+                    term : (
+                        postings.firsts.tobytes(),
+                        postings.lasts.tobytes(),
+                        tuple((block.typecode, block.tobytes()) for block in postings.blocks),
+                        postings.tail.tobytes(),
+                        postings.count,
+                        postings.tfs
+                    )
+                    for term, postings in self.terms.items()
+                }
+            )
+
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, BLOCK_SIZE, sys.byteorder == 'little'))
+                marshal.dump(state, f)
+            os.replace(temp_path, path)
+
+    def load(self, path):
+        ## save 로 저장한 색인을 읽는다. 파일이 없거나 형식이 다르면 False 를 돌려주고 색인은 그대로 둔다.
+        try:
+            with open(path, 'rb') as f:
+                header = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+                if header != (FILE_MAGIC, FILE_VERSION, BLOCK_SIZE, sys.byteorder == 'little'):
+                    return False
+
+                docs, total_length, last_id, doc_ids, lengths, saved_terms = marshal.load(f)
+
+            doc_ids = load_array('q', doc_ids)
+            if not isinstance(lengths, bytes) or len(lengths) != len(doc_ids):
+                return False
+
+            doc_lengths = dict(zip(doc_ids, lengths))
+            terms       = {}
+            for term, (firsts, lasts, blocks, tail, count, tfs) in saved_terms.items():
+                if not isinstance(term, str) or not isinstance(count, int) or not isinstance(tfs, (dict, type(None))):
+                    return False
+
+                postings = terms[term] = PostingList()
+                postings.firsts = load_array('q', firsts)
+                postings.lasts  = load_array('q', lasts)
+                postings.blocks = [load_array(typecode, block) for typecode, block in blocks]
+                postings.tail   = load_array('q', tail)
+                postings.count  = count
+                postings.tfs    = tfs
+        except (OSError, EOFError, struct.error, ValueError, TypeError, AttributeError):
+            return False
+
+        if not all(isinstance(value, int) for value in (docs, total_length, last_id)):
+            return False
+
+        with self.lock:
+            self.terms        = terms
+            self.doc_lengths  = doc_lengths
+            self.docs         = docs
+            self.total_length = total_length
+            self.last_id      = last_id
+
+        return True
+
+    def memory_bytes(self):
+        with self.lock:
+            return (sys.getsizeof(self.terms) + sys.getsizeof(self.doc_lengths) +
+                    sum(sys.getsizeof(term) + postings.memory_bytes() for term, postings in self.terms.items()))
+
+    def stats(self):
+        with self.lock:
+            postings = sum(postings.count for postings in self.terms.values())
+            docs, terms, last_id = self.docs, len(self.terms), self.last_id
+
+        memory_bytes = self.memory_bytes()
+
+        return {
+            'docs'              : docs,
+            'terms'             : terms,
+            'postings'          : postings,
+            'last_id'           : last_id,
+            'memory_bytes'      : memory_bytes,
+            'bytes_per_posting' : memory_bytes / postings if postings else 0.0
+        }
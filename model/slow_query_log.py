@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+
+from .cache import LRUCache
+
+## IN (%s, %s, ...) 처럼 expanding bind 로 길이만 다른 쿼리는 같은 쿼리로 본다.
+IN_LIST = re.compile(r'IN \((?:\s*(?:%s|\?|%\(\w+\)s|:\w+)\s*,?)+\)', re.IGNORECASE)
+SPACES  = re.compile(r'\s+')
+
+
+class SlowQueryLog:
+    ## threshold 초보다 오래 걸린 SQL 을 파라미터, 실행 시간, row 수와 함께 로그 파일에 남긴다.
+    ## 처음 보는 쿼리면 EXPLAIN 결과도 한 번 남겨서 실행 계획 문제인지 데이터 문제인지 구분할 수 있게 한다.
+    ## 로그는 한 줄에 JSON 하나씩이고 max_bytes 가 넘으면 backup_count 개까지 돌려 쓴다.
+    ## 여러 프로세스가 한 파일을 같이 돌려 쓰면 줄이 섞이거나 사라지므로 worker 를 주면 파일 이름에 붙인다.
+    ## (slow_query.log -> slow_query.<worker>.log) pid 대신 server.py 의 워커 번호를 쓰므로 워커가 다시 떠도
+    ## 같은 파일을 이어서 돌려 쓰고, 파일 수는 워커 번호 수 x (backup_count + 1) 를 넘지 않는다.
+    def __init__(self, path, threshold, max_bytes = 10 * 1024 * 1024, backup_count = 5,
+                 explain = True, max_statements = 1000, worker = None):
+        if worker is not None:
+            root, extension = os.path.splitext(path)
+            path            = f'{root}.{worker}{extension}'
+
+        self.path      = path
+        self.threshold = threshold
+        self.explain   = explain
+        self.explained = LRUCache(max_entries = max_statements)  ## EXPLAIN 을 이미 남긴 쿼리
+        self.executor  = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'slow-query-explain')
+        self.lock      = threading.Lock()
+        self.slow      = 0
+        self.explains  = 0
+
+        self.logger = logging.getLogger(f'miniter.slow_query.{path}')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes = max_bytes, backupCount = backup_count, encoding = 'UTF-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+    def install(self, database, name = 'primary'):
+        @event.listens_for(database, 'before_cursor_execute')
+        def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+            context.slow_query_started = time.perf_counter()
+
+        @event.listens_for(database, 'after_cursor_execute')
+        def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+            duration = time.perf_counter() - context.slow_query_started
+            if duration < self.threshold or not context.execution_options.get('slow_query_log', True):
+                return
+
+            self.record(database, name, statement, parameters, context, executemany, duration, cursor.rowcount)
+
+        return database
+
+    def record(self, database, name, statement, parameters, context, executemany, duration, rowcount):
+        with self.lock:
+            self.slow += 1
+
+        ## 이름이 있는 compiled 파라미터를 남긴다. (드라이버 파라미터는 sqlite 처럼 tuple 일 수 있다.)
+        ## executemany 는 파라미터가 수천 건일 수 있으므로 첫 번째 것과 개수만 남긴다.
+        if context.compiled:
+            batch_size, logged = len(context.compiled_parameters), context.compiled_parameters[0]
+        elif executemany:
+            batch_size, logged = len(parameters), parameters[0] if parameters else None
+        else:
+            batch_size, logged = 1, parameters
+
+        self.write({
+            'type'        : 'slow_query',
+            'time'        : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database'    : name,
+            'duration_ms' : round(duration * 1000, 3),
+            'rowcount'    : rowcount,    ## 드라이버가 모르면 -1 (예: sqlite 의 SELECT)
+            'statement'   : SPACES.sub(' ', statement).strip(),
+            'parameters'  : redact(logged),
+            'batch_size'  : batch_size
+        })
+
+        ## executemany (INSERT 여러 건) 는 실행 계획을 볼 필요가 없다.
+        if not self.explain or executemany:
+            return
+
+        key = statement_key(statement)
+        if key in self.explained:
+            return
+        self.explained.set(key, True)
+
+        ## 이미 느린 요청을 더 느리게 만들지 않도록 EXPLAIN 은 별도 쓰레드에서 실행한다.
+        try:
+            self.executor.submit(self.explain_statement, database, name, statement, parameters, key)
+        except RuntimeError:
+            ## close() 뒤에 (프로세스 종료 중) 실행된 쿼리
+            pass
+
+    def explain_statement(self, database, name, statement, parameters, key):
+        prefix = 'EXPLAIN QUERY PLAN ' if database.dialect.name == 'sqlite' else 'EXPLAIN '
+
+        try:
+            with database.connect() as connection:
+                rows = connection.execution_options(slow_query_log = False) \
+                                 .exec_driver_sql(prefix + statement, parameters).fetchall()
+            plan = [dict(row._mapping) for row in rows]
+        except Exception as e:
+            plan = {'error' : repr(e)}
+
+        with self.lock:
+            self.explains += 1
+
+        self.write({
+            'type'      : 'explain',
+            'time'      : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database'  : name,
+            'statement' : key,
+            'plan'      : plan
+        })
+
+    def write(self, record):
+        self.logger.info(json.dumps(record, ensure_ascii = False, default = str))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'slow_queries' : self.slow,
+                'explains'     : self.explains
+            }
+
+    def close(self):
+        self.executor.shutdown(wait = True)
+        for handler in self.logger.handlers:
+            handler.flush()
+
+
+def statement_key(statement):
+    return IN_LIST.sub('IN (...)', SPACES.sub(' ', statement).strip())
+
+
+def redact(parameters):
+    ## 비밀번호 해시가 로그 파일에 남지 않도록 이름에 password 가 들어간 파라미터는 가린다.
+    if isinstance(parameters, dict):
+        return {
+            key : '***' if 'password' in str(key).lower() else value
+            for key, value in parameters.items()
+        }
+
+    return parameters
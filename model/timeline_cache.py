@@ -0,0 +1,83 @@
+import sys
+
+from .cache import LRUCache
+
+
+def timeline_page_size(page):
+    ## (timeline, next_cursor) 페이지의 대략적인 메모리 크기
+    timeline, _ = page
+
+    return sys.getsizeof(timeline) + sum(
+        sys.getsizeof(tweet) + sys.getsizeof(tweet['tweet']) for tweet in timeline
+    )
+
+
+class TimelineCache(LRUCache):
+    ## 유저별 타임라인 페이지 캐시.
+    ## 키는 (user_id, max_id, since_id, count) 이고, 유저 단위로 무효화 할 수 있도록
+    ## 유저마다 캐시된 키들을 따로 들고 있는다.
+    GENERATION_STRIPES = 4096
+
+    def __init__(self, max_entries = 10000, max_bytes = 64 * 1024 * 1024, ttl = 60):
+        super().__init__(max_entries, max_bytes, ttl, sizeof = timeline_page_size)
+
+        self.user_keys     = {}   ## user_id -> 캐시된 키들
+        self.invalidations = 0
+
+        ## DB 를 읽는 동안 무효화가 일어났으면 그 결과를 캐시하지 않기 위한 세대 카운터.
+        ## 유저 수만큼 늘어나지 않도록 user_id 를 고정된 수의 stripe 로 나눈다.
+        self.generations = [0] * self.GENERATION_STRIPES
+
+    def generation(self, user_id):
+        return self.generations[hash(user_id) % self.GENERATION_STRIPES]
+
+    def get_page(self, user_id, max_id, since_id, count):
+        return self.get((user_id, max_id, since_id, count))
+
+    def set_page(self, user_id, max_id, since_id, count, page, generation):
+        key = (user_id, max_id, since_id, count)
+
+        if generation != self.generation(user_id) or not self.set(key, page):
+            return False
+
+        with self.lock:
+            if key in self.entries:
+                self.user_keys.setdefault(user_id, set()).add(key)
+
+            ## set 하는 사이에 무효화가 일어났으면 방금 넣은 페이지를 버린다.
+            if generation != self.generation(user_id) and key in self.entries:
+                self.remove(key)
+                return False
+
+        return True
+
+    def invalidate(self, user_id):
+        self.invalidate_many((user_id,))
+
+    def invalidate_many(self, user_ids):
+        ## 캐시된 페이지가 없는 유저도 세대는 올린다. 그래야 지금 DB 를 읽고 있는 요청이
+        ## 무효화 전의 페이지를 set_page 로 넣지 못한다. (유저 당 stripe 정수 하나를 올릴 뿐이다)
+        with self.lock:
+            for user_id in user_ids:
+                self.generations[hash(user_id) % self.GENERATION_STRIPES] += 1
+
+                keys = self.user_keys.pop(user_id, ())
+                for key in keys:
+                    if key in self.entries:
+                        self.remove(key)
+
+                self.invalidations += 1
+
+    def removed(self, key):
+        keys = self.user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[key[0]]
+
+    def stats(self):
+        stats = super().stats()
+        stats['users']         = len(self.user_keys)
+        stats['invalidations'] = self.invalidations
+
+        return stats
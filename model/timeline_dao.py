@@ -0,0 +1,164 @@
+from sqlalchemy import text
+
+from .records import Tweet
+from .tweet_dao import cursor_clauses, timeline_version
+
+
+class TimelineDao:
+    def __init__(self, database, read_database = None):
+        self.db      = database
+        self.read_db = read_database if read_database is not None else database  ## 읽기 전용 replica
+
+    def fan_out(self, user_id, tweet_id):
+        ## 작성자 본인과 작성자를 팔로우하는 모든 유저의 홈 타임라인에
+        ## 트윗 아이디를 한 번의 INSERT ... SELECT 로 밀어 넣는다.
+        ## 자기 자신을 팔로우한 작성자는 팔로워 쪽에서 빼야 primary key 가 겹치지 않는다.
+        return self.db.execute(text("""
+            INSERT INTO home_timeline (
+                user_id,
+                tweet_id
+            )
+            SELECT :user_id, :tweet_id
+            UNION ALL
+            SELECT
+                ufl.user_id,
+                :tweet_id
+            FROM users_follow_list ufl
+            WHERE ufl.follow_user_id = :user_id
+            AND ufl.user_id <> :user_id
+        """), {
+            'user_id'  : user_id,
+            'tweet_id' : tweet_id
+        }).rowcount
+
+    def get_home_timeline(self, user_id, max_id = None, since_id = None, limit = None):
+        ## home_timeline 의 (user_id, tweet_id) primary key 범위만 읽으면 되므로
+        ## 팔로우 수와 상관없이 한 번의 index range scan 으로 끝난다.
+        params = {'user_id' : user_id}
+        conditions, limit_clause = cursor_clauses('h.tweet_id', params, max_id, since_id, limit)
+
+        timeline = self.read_db.execute(text(f"""
+            SELECT
+                t.id,
+                t.user_id,
+                t.tweet
+            FROM home_timeline h
+            JOIN tweets t ON t.id = h.tweet_id
+            WHERE h.user_id = :user_id
+            {conditions}
+            ORDER BY h.tweet_id DESC
+            {limit_clause}
+        """), params).fetchall()
+
+        return Tweet.from_rows(timeline)
+
+    def get_timeline_version(self, user_id):
+        ## 홈 타임라인의 최신 트윗 id 와 팔로우 목록을 한 번의 쿼리로 읽는다. (ETag 계산용)
+        ## 둘 다 (user_id, ...) primary key 의 prefix 만 읽는다.
+        rows = self.read_db.execute(text("""
+            SELECT
+                0 AS kind,
+                ufl.follow_user_id AS id
+            FROM users_follow_list ufl
+            WHERE ufl.user_id = :user_id
+            UNION ALL
+            SELECT
+                1 AS kind,
+                MAX(h.tweet_id) AS id
+            FROM home_timeline h
+            WHERE h.user_id = :user_id
+        """), {
+            'user_id' : user_id
+        }).fetchall()
+
+        return timeline_version(rows)
+
+    def backfill(self, user_id, follow_id, limit):
+        ## 새로 팔로우한 유저의 최근 트윗 limit 개를 홈 타임라인에 채워 넣는다.
+        return self.db.execute(text("""
+            INSERT INTO home_timeline (
+                user_id,
+                tweet_id
+            )
+            SELECT
+                :user_id,
+                t.id
+            FROM tweets t
+            WHERE t.user_id = :follow_id
+            AND NOT EXISTS (
+                SELECT 1
+                FROM home_timeline h
+                WHERE h.user_id = :user_id
+                AND h.tweet_id = t.id
+            )
+            ORDER BY t.id DESC
+            LIMIT :limit
+        """), {
+            'user_id'   : user_id,
+            'follow_id' : follow_id,
+            'limit'     : limit
+        }).rowcount
+
+    def rebuild(self, user_id, limit):
+        ## 본인과 팔로우 중인 유저들의 최근 트윗을 limit 개씩 홈 타임라인에 채워 넣는다.
+        ## TIMELINE_FANOUT 을 'read' 에서 'write' / 'hybrid' 로 바꿀 때 기존 유저들의 홈 타임라인을 채우는 데 쓴다.
+        rows = self.backfill(user_id, user_id, limit)
+        for follow_id in self.get_followee_ids(user_id):
+            if follow_id != user_id:
+                rows += self.backfill(user_id, follow_id, limit)
+
+        return rows
+
+    def prune(self, user_id, unfollow_id):
+        ## 언팔로우한 유저의 트윗을 홈 타임라인에서 지운다.
+        return self.db.execute(text("""
+            DELETE FROM home_timeline
+            WHERE user_id = :user_id
+            AND tweet_id IN (
+                SELECT t.id
+                FROM tweets t
+                WHERE t.user_id = :unfollow_id
+            )
+        """), {
+            'user_id'     : user_id,
+            'unfollow_id' : unfollow_id
+        }).rowcount
+
+    def get_followee_ids(self, user_id):
+        rows = self.db.execute(text("""
+            SELECT follow_user_id
+            FROM users_follow_list
+            WHERE user_id = :user_id
+        """), {
+            'user_id' : user_id
+        }).fetchall()
+
+        return [row['follow_user_id'] for row in rows]
+
+    def count_followers(self, user_id, limit):
+        ## limit 개까지만 세면 되므로 팔로워가 수백만인 유저도 limit 개의 index 만 읽는다.
+        return self.db.execute(text("""
+            SELECT COUNT(*) AS count
+            FROM (
+                SELECT 1
+                FROM users_follow_list
+                WHERE follow_user_id = :user_id
+                LIMIT :limit
+            ) followers
+        """), {
+            'user_id' : user_id,
+            'limit'   : limit
+        }).fetchone()['count']
+
+    def get_popular_user_ids(self, threshold):
+        ## 팔로워 수가 threshold 를 넘는 유저들
+        rows = self.db.execute(text("""
+            SELECT follow_user_id
+            FROM users_follow_list
+            GROUP BY follow_user_id
+            HAVING COUNT(*) > :threshold
+        """), {
+            'threshold' : threshold
+        }).fetchall()
+
+        return [row['follow_user_id'] for row in rows]
@@ -0,0 +1,189 @@
+import sys
+import queue
+import threading
+
+from collections import deque
+
+
+class Subscription:
+    ## /timeline/stream 연결 하나. publish 된 트윗이 buffer 에 쌓이고 연결을 맡은 쓰레드가 get 으로 꺼내 간다.
+    ## 기다리는 동안은 Event 하나에 멈춰 있을 뿐이라 새 트윗이 없는 연결은 heartbeat 때만 깨어난다.
+    __slots__ = ('user_id', 'followee_ids', 'buffer', 'ready', 'evicted')
+
+    def __init__(self, user_id, followee_ids):
+        self.user_id      = user_id
+        self.followee_ids = set(followee_ids)
+        self.buffer       = deque()
+        self.ready        = threading.Event()
+        self.evicted      = False
+
+    def get(self, timeout):
+        ## 쌓인 트윗들을 오래된 순으로 꺼낸다. timeout 초 동안 새 트윗이 없으면 [],
+        ## buffer 가 넘쳐서 hub 에서 밀려났으면 None 을 돌려준다.
+        if not self.buffer and not self.evicted:
+            self.ready.wait(timeout)
+
+        ## 꺼내기 전에 clear 해야 그 사이에 들어온 트윗의 set 을 놓치지 않는다.
+        self.ready.clear()
+        if self.evicted:
+            return None
+
+        tweets = []
+        while self.buffer:
+            tweets.append(self.buffer.popleft())
+
+        return tweets
+
+
+class TimelineHub:
+    ## 프로세스 안의 타임라인 pub/sub. 연결마다 Subscription 을 만들어서 그 유저와 팔로우 중인 작성자들에게 걸어 두고,
+    ## publish 는 작성자에게 걸린 Subscription 들에만 트윗을 넣는다. 그래서 연결 수가 많아도
+    ## publish 비용은 그 작성자를 팔로우 하면서 접속 중인 연결 수에만 비례하고 DB 는 읽지 않는다.
+    ## 연결의 buffer 에 buffer_size 개가 넘게 쌓이면 (클라이언트가 못 읽고 있으면) 그 연결을 끊는다.
+    ## 끊긴 클라이언트는 Last-Event-ID 로 다시 연결해서 놓친 트윗을 DB 에서 받아 간다.
+    ## 연결 쓰레드를 깨우는 일 (연결 당 GIL 을 한 번씩 넘겨 주느라 팔로워 1000 명이면 수십 ms) 은 notifier 쓰레드가 맡아서
+    ## 트윗을 쓴 요청은 buffer 에 넣기만 하고 바로 돌아간다.
+    STOP = object()
+
+    def __init__(self, buffer_size = 100, max_subscribers = 10000):
+        self.buffer_size     = buffer_size
+        self.max_subscribers = max_subscribers
+        self.by_author       = {}   ## 작성자 id -> 그 작성자의 트윗을 받을 Subscription set (본인 포함)
+        self.by_user         = {}   ## 유저 id -> 그 유저의 Subscription set (탭 여러 개)
+        self.subscribers     = 0
+        self.lock            = threading.Lock()
+        self.wakeups         = queue.SimpleQueue()   ## 깨울 Subscription list 들
+        self.closed          = False
+
+        self.published = 0
+        self.delivered = 0
+        self.evicted   = 0
+        self.rejected  = 0
+
+        self.thread = threading.Thread(target = self.run, name = 'timeline-hub', daemon = True)
+        self.thread.start()
+
+    def subscribe(self, user_id, followee_ids):
+        ## 연결 수가 max_subscribers 를 넘으면 None 을 돌려준다.
+        subscription = Subscription(user_id, followee_ids)
+
+        with self.lock:
+            if self.subscribers >= self.max_subscribers:
+                self.rejected += 1
+                return None
+
+            self.by_user.setdefault(user_id, set()).add(subscription)
+            for author_id in (user_id, *subscription.followee_ids):
+                self.by_author.setdefault(author_id, set()).add(subscription)
+            self.subscribers += 1
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.detach(subscription)
+
+    def detach(self, subscription):
+        subscriptions = self.by_user.get(subscription.user_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.by_user[subscription.user_id]
+
+        for author_id in (subscription.user_id, *subscription.followee_ids):
+            self.remove_author(author_id, subscription)
+
+        self.subscribers -= 1
+
+    def remove_author(self, author_id, subscription):
+        subscriptions = self.by_author.get(author_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.by_author[author_id]
+
+    def follow(self, user_id, followee_id):
+        ## 접속 중인 유저가 팔로우 하면 그 연결들도 바로 새 작성자의 트윗을 받는다.
+        with self.lock:
+            for subscription in self.by_user.get(user_id, ()):
+                subscription.followee_ids.add(followee_id)
+                self.by_author.setdefault(followee_id, set()).add(subscription)
+
+    def unfollow(self, user_id, followee_id):
+        with self.lock:
+            for subscription in self.by_user.get(user_id, ()):
+                if followee_id in subscription.followee_ids and followee_id != user_id:
+                    subscription.followee_ids.discard(followee_id)
+                    self.remove_author(followee_id, subscription)
+
+    def publish(self, author_id, tweet):
+        ## 작성자의 트윗을 받을 연결들의 buffer 에 넣는다. 넣은 연결 수를 돌려준다.
+        with self.lock:
+            self.published += 1
+
+            subscriptions = self.by_author.get(author_id)
+            if not subscriptions:
+                return 0
+
+            subscriptions = list(subscriptions)
+            delivered     = 0
+            for subscription in subscriptions:
+                if len(subscription.buffer) >= self.buffer_size:
+                    self.detach(subscription)
+                    subscription.evicted = True
+                    self.evicted        += 1
+                else:
+                    subscription.buffer.append(tweet)
+                    delivered += 1
+
+            self.delivered += delivered
+
+        self.wakeups.put(subscriptions)
+
+        return delivered
+
+    def run(self):
+        while True:
+            subscriptions = self.wakeups.get()
+            if subscriptions is self.STOP:
+                return
+
+            for subscription in subscriptions:
+                subscription.ready.set()
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.wakeups.put(self.STOP)
+        self.thread.join()
+
+    def memory_bytes(self):
+        with self.lock:
+            subscriptions = [subscription for subscriptions in self.by_user.values() for subscription in subscriptions]
+
+            return (sys.getsizeof(self.by_author) + sys.getsizeof(self.by_user) +
+                    sum(sys.getsizeof(subscriptions) for subscriptions in self.by_author.values()) +
+                    sum(sys.getsizeof(subscriptions) for subscriptions in self.by_user.values()) +
+                    sum(sys.getsizeof(subscription) + sys.getsizeof(subscription.followee_ids) +
+                        sys.getsizeof(subscription.buffer) + sys.getsizeof(subscription.ready)
+                        for subscription in subscriptions))
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'subscribers' : self.subscribers,
+                'users'       : len(self.by_user),
+                'authors'     : len(self.by_author),
+                'published'   : self.published,
+                'delivered'   : self.delivered,
+                'evicted'     : self.evicted,
+                'rejected'    : self.rejected
+            }
+
+        stats['memory_bytes'] = self.memory_bytes()
+
+        return stats
@@ -0,0 +1,195 @@
+import re
+import sys
+import time
+import operator
+import threading
+
+from array import array
+
+HASHTAG         = re.compile(r'#(\w+)')
+MAX_HASHTAG_LEN = 40
+
+
+def extract_hashtags(text):
+    ## 트윗 본문의 해시태그들 ('#' 를 뺀 소문자, 중복 제거). 숫자로만 된 것 (#1 등) 과 너무 긴 것은 버린다.
+    return {
+        tag for tag in HASHTAG.findall(text.lower())
+        if len(tag) <= MAX_HASHTAG_LEN and not tag.isdigit()
+    }
+
+
+class CountMinSketch:
+    ## depth 개의 행 x width 개의 counter 로 key 별 횟수를 추정한다. key 가 몇 종류든 메모리는 고정이다.
+    ## 추정치는 실제 횟수보다 작지 않고, 전체 횟수가 N 이면 확률 1 - (1/2)^depth 로 실제보다 2N / width 이상 크지 않다.
+    ## 행마다 따로 해시하지 않고 hash(key) 하나를 두 개로 쪼개서 (h1 + 행 * h2) 로 열을 고른다. (Kirsch-Mitzenmacher)
+    ## 문자열 hash 는 프로세스마다 다르므로 sketch 는 프로세스 밖으로 내보내지 않는다.
+    def __init__(self, width, depth):
+        self.width  = width
+        self.depth  = depth
+        self.counts = array('I', bytes(4 * width * depth))   ## 행 순서로 펼친 counter
+
+    def positions(self, key):
+        hashed = hash(key)
+        h1     = hashed & 0xffffffff
+        h2     = (hashed >> 32) | 1
+
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key, count = 1, into = None):
+        ## conservative update: key 의 counter 들을 (가장 작은 값 + count) 까지만 올린다.
+        ## 다른 key 와 겹쳐서 이미 그보다 큰 counter 는 그대로 두므로 흔한 key 에 묻어가는 과대 추정이 줄어든다.
+        ## into (같은 크기의 sketch) 를 주면 올린 만큼 into 에도 더한다. 추정치를 돌려준다.
+        counts    = self.counts
+        positions = self.positions(key)
+        target    = min(counts[position] for position in positions) + count
+
+        for position in positions:
+            if counts[position] < target:
+                if into is not None:
+                    into.counts[position] += target - counts[position]
+                counts[position] = target
+
+        return target
+
+    def estimate(self, key):
+        counts = self.counts
+
+        return min(counts[position] for position in self.positions(key))
+
+    def subtract(self, other):
+        self.counts = array('I', map(operator.sub, self.counts, other.counts))
+
+    def clear(self):
+        self.counts = array('I', bytes(4 * self.width * self.depth))
+
+    def memory_bytes(self):
+        return sys.getsizeof(self.counts)
+
+
+class TrendingTopics:
+    ## 최근 window 초 동안 많이 쓰인 해시태그 top-k.
+    ## window 를 buckets 개의 시간 구간으로 나눠서 구간마다 CountMinSketch 를 두고, 그 합계 sketch 로 window 안의
+    ## 횟수를 추정한다. 구간이 지나면 가장 오래된 구간의 sketch 를 합계에서 빼고 비워서 새 구간으로 쓴다.
+    ## 순위 후보는 추정치가 큰 capacity 개 (기본값 k 의 4배) 만 들고 있어서 해시태그가 몇 종류든 메모리는 고정이다.
+    ## top() 은 refresh 초 마다 한 번 정렬해 둔 결과를 돌려준다.
+    def __init__(self, window = 3600, buckets = 12, width = 4096, depth = 4, k = 50, capacity = None,
+                 refresh = 1.0, clock = time.monotonic):
+        self.window         = window
+        self.bucket_seconds = window / buckets
+        self.k              = k
+        self.capacity       = capacity or k * 4
+        self.refresh        = refresh
+        self.clock          = clock
+
+        self.sketches   = [CountMinSketch(width, depth) for _ in range(buckets)]
+        self.totals     = [0] * buckets                 ## 구간 별 해시태그 수
+        self.sum        = CountMinSketch(width, depth)  ## 모든 구간의 합
+        self.bucket     = int(clock() // self.bucket_seconds)
+        self.candidates = {}                            ## 해시태그 -> window 안의 추정 횟수
+        self.floor      = 0                             ## 후보 중 가장 작은 추정치 (이보다 작으면 후보가 될 수 없다)
+        self.cached     = None                          ## (계산한 시각, top-k list)
+        self.lock       = threading.Lock()
+
+        self.tweets    = 0
+        self.hashtags  = 0
+        self.rotations = 0
+
+    def add(self, text):
+        ## 트윗 본문의 해시태그들을 센다. 센 해시태그 수를 돌려준다.
+        tags = extract_hashtags(text)
+        if not tags:
+            return 0
+
+        with self.lock:
+            self.advance()
+
+            current = self.bucket % len(self.sketches)
+            for tag in tags:
+                self.sketches[current].add(tag, into = self.sum)
+                self.offer(tag, self.sum.estimate(tag))
+
+            self.totals[current] += len(tags)
+            self.tweets          += 1
+            self.hashtags        += len(tags)
+
+        return len(tags)
+
+    def offer(self, tag, count):
+        candidates = self.candidates
+        if tag in candidates or len(candidates) < self.capacity:
+            candidates[tag] = count
+            return
+
+        if count <= self.floor:
+            return
+
+        ## 후보들의 추정치는 늘기만 하므로 floor 는 실제 최소값보다 작을 수 있다. 여기서 다시 맞춘다.
+        victim, smallest = min(candidates.items(), key = operator.itemgetter(1))
+        if count <= smallest:
+            self.floor = smallest
+            return
+
+        del candidates[victim]
+        candidates[tag] = count
+        self.floor      = min(candidates.values())
+
+    def advance(self):
+        ## 현재 시각까지 지난 구간들을 비운다. 구간이 바뀌었으면 후보들의 추정치를 다시 계산한다.
+        bucket = int(self.clock() // self.bucket_seconds)
+        if bucket <= self.bucket:
+            return
+
+        buckets = len(self.sketches)
+        if bucket - self.bucket >= buckets:
+            for sketch in self.sketches:
+                sketch.clear()
+            self.sum.clear()
+            self.totals = [0] * buckets
+        else:
+            for expired in range(self.bucket + 1, bucket + 1):
+                sketch = self.sketches[expired % buckets]
+                self.sum.subtract(sketch)
+                sketch.clear()
+                self.totals[expired % buckets] = 0
+
+        self.rotations += min(bucket - self.bucket, buckets)
+        self.bucket     = bucket
+
+        estimates       = ((tag, self.sum.estimate(tag)) for tag in self.candidates)
+        self.candidates = {tag : count for tag, count in estimates if count}
+        self.floor      = 0
+        self.cached     = None
+
+    def top(self, count = None):
+        ## [{'hashtag' : 해시태그, 'count' : window 안의 추정 횟수}] 를 많은 순으로 최대 count (<= k) 개
+        count = self.k if count is None else max(0, min(count, self.k))
+
+        with self.lock:
+            self.advance()
+
+            now = self.clock()
+            if self.cached is None or now - self.cached[0] >= self.refresh:
+                ranked      = sorted(self.candidates.items(), key = lambda item: (-item[1], item[0]))[:self.k]
+                self.cached = (now, [{'hashtag' : tag, 'count' : tag_count} for tag, tag_count in ranked])
+
+            return self.cached[1][:count]
+
+    def memory_bytes(self):
+        with self.lock:
+            return (sum(sketch.memory_bytes() for sketch in self.sketches) + self.sum.memory_bytes() +
+                    sys.getsizeof(self.candidates) + sum(sys.getsizeof(tag) for tag in self.candidates))
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'window_seconds'  : self.window,
+                'window_hashtags' : sum(self.totals),
+                'candidates'      : len(self.candidates),
+                'tweets'          : self.tweets,
+                'hashtags'        : self.hashtags,
+                'rotations'       : self.rotations
+            }
+
+        stats['memory_bytes'] = self.memory_bytes()
+
+        return stats
@@ -1,9 +1,19 @@
-from sqlalchemy import text
+import heapq
+import itertools
+
+from sqlalchemy import text, bindparam
+
+from .records import Tweet
+
+## 타임라인 쿼리 하나에 UNION ALL 로 묶는 작성자 수. 팔로우가 더 많으면 쿼리를 나눠서 실행하고 합친다.
+UNION_BATCH_SIZE = 500
 
 
 class TweetDao:
-    def __init__(self, database):
-        self.db = database
+    def __init__(self, database, read_database = None, union_batch_size = UNION_BATCH_SIZE):
+        self.db               = database
+        self.read_db          = read_database if read_database is not None else database  ## 읽기 전용 replica
+        self.union_batch_size = union_batch_size
 
     def insert_tweet(self, user_id, tweet):
         return self.db.execute(text("""
@@ -17,22 +27,277 @@ class TweetDao:
         """), {
             'id'     : user_id,
             'tweet'  : tweet
-        }).rowcount
+        }).lastrowid
+
+    def get_timeline(self, user_id, max_id = None, since_id = None, limit = None):
+        ## 최신 트윗부터 id 역순으로 읽는다.
+        ## 팔로우 목록을 먼저 읽고, 유저 본인과 팔로우 하는 유저들의 타임라인을 합쳐서 읽는다.
+        return self.get_authors_timeline(
+            timeline_authors(user_id, self.get_followee_ids(user_id)), max_id, since_id, limit)
+
+    def iter_timeline(self, user_id, max_id = None, since_id = None, limit = None, chunk_size = 1000):
+        ## get_timeline 과 같은 결과를 chunk_size 개씩 list 로 나눠서 돌려준다.
+        ## 결과 전체를 메모리에 올리지 않으므로 아주 긴 타임라인도 일정한 메모리로 읽을 수 있다.
+        author_ids = timeline_authors(user_id, self.get_followee_ids(user_id))
+        queries    = timeline_queries(author_ids, max_id, since_id, limit, self.union_batch_size)
+
+        if self.read_db.dialect.supports_server_side_cursors and len(queries) == 1:
+            ## pymysql / mysqlclient 처럼 server-side cursor 를 지원하면 쿼리 한 번을 스트리밍 한다.
+            with self.read_db.connect() as connection:
+                result = connection.execution_options(stream_results = True).execute(*queries[0])
+
+                for rows in result.partitions(chunk_size):
+                    yield Tweet.from_rows(rows)
+            return
+
+        ## mysql-connector 등은 결과를 클라이언트에 모두 버퍼링 하므로
+        ## 대신 keyset 페이지를 chunk_size 씩 이어서 읽는다.
+        while limit is None or limit > 0:
+            size  = chunk_size if limit is None else min(chunk_size, limit)
+            chunk = self.get_authors_timeline(author_ids, max_id, since_id, size)
+            if chunk:
+                yield chunk
 
-    def get_timeline(self, user_id):
-        timeline = self.db.execute(text("""
+            if len(chunk) < size:
+                return
+
+            max_id = chunk[-1]['id']
+            if limit is not None:
+                limit -= len(chunk)
+
+    def get_timeline_version(self, user_id):
+        ## 타임라인에 보일 최신 트윗 id 와 팔로우 목록을 한 번의 쿼리로 읽는다. (ETag 계산용)
+        ## "user_id = ? OR user_id IN (서브쿼리)" 로 MAX 를 구하면 tweets 전체를 훑을 수 있으므로 (get_timeline 과 같은 이유)
+        ## 본인과 팔로우 하는 유저들을 먼저 펼치고 작성자마다 (user_id, id) index 의 끝만 읽는 서브쿼리로 MAX 를 구한다.
+        rows = self.read_db.execute(text("""
             SELECT
+                0 AS kind,
+                ufl.follow_user_id AS id
+            FROM users_follow_list ufl
+            WHERE ufl.user_id = :user_id
+            UNION ALL
+            SELECT
+                1 AS kind,
+                MAX((
+                    SELECT MAX(t.id)
+                    FROM tweets t
+                    WHERE t.user_id = authors.id
+                )) AS id
+            FROM (
+                SELECT :user_id AS id
+                UNION
+                SELECT ufl.follow_user_id
+                FROM users_follow_list ufl
+                WHERE ufl.user_id = :user_id
+            ) authors
+        """), {
+            'user_id' : user_id
+        }).fetchall()
+
+        return timeline_version(rows)
+
+    def get_authors_newest_id(self, author_ids):
+        ## 작성자들의 가장 최근 트윗 id. GROUP BY user_id 로 작성자마다 MAX 를 구하면 (user_id, id) index 의
+        ## 작성자별 끝만 읽는다. (MySQL loose index scan) 그냥 MAX 를 구하면 작성자들의 트윗 index 를 전부 읽는다.
+        if not author_ids:
+            return None
+
+        return self.read_db.execute(text("""
+            SELECT MAX(newest.id)
+            FROM (
+                SELECT MAX(t.id) AS id
+                FROM tweets t
+                WHERE t.user_id IN :author_ids
+                GROUP BY t.user_id
+            ) newest
+        """).bindparams(bindparam('author_ids', expanding = True)), {
+            'author_ids' : list(author_ids)
+        }).scalar()
+
+    def get_authors_timeline(self, author_ids, max_id = None, since_id = None, limit = None):
+        ## 작성자들의 트윗을 id 역순으로 읽는다. 팔로우 목록을 이미 알고 있을 때 (FollowGraph) 는 바로 부른다.
+        ## 작성자마다 (user_id, id) index 를 limit 개만 range scan 하고 합치므로
+        ## 비용은 tweets 테이블 크기가 아니라 페이지 크기 x 작성자 수에 비례한다.
+        if not author_ids:
+            return []
+
+        results = [
+            self.read_db.execute(*query).fetchall()
+            for query in timeline_queries(list(dict.fromkeys(author_ids)), max_id, since_id, limit, self.union_batch_size)
+        ]
+
+        return Tweet.from_rows(merge_timelines(results, limit))
+
+    def get_user_tweets(self, user_id, max_id = None, since_id = None, limit = None):
+        ## 한 작성자의 트윗만 최신 순으로 읽는다.
+        params = {'user_id' : user_id}
+        conditions, limit_clause = cursor_clauses('t.id', params, max_id, since_id, limit)
+
+        tweets = self.read_db.execute(text(f"""
+            SELECT
+                t.id,
                 t.user_id,
                 t.tweet
             FROM tweets t
-            LEFT JOIN users_follow_list ufl ON ufl.user_id = :user_id
             WHERE t.user_id = :user_id
-            OR t.user_id = ufl.follow_user_id
+            {conditions}
+            ORDER BY t.id DESC
+            {limit_clause}
+        """), params).fetchall()
+
+        return Tweet.from_rows(tweets)
+
+    def get_tweets(self, tweet_ids):
+        ## 트윗들을 primary key 로 읽어서 tweet_ids 순서대로 돌려준다. (없는 id 는 빠진다.)
+        if not tweet_ids:
+            return []
+
+        tweets = {tweet.id : tweet for tweet in Tweet.from_rows(self.read_db.execute(text("""
+            SELECT
+                t.id,
+                t.user_id,
+                t.tweet
+            FROM tweets t
+            WHERE t.id IN :tweet_ids
+        """).bindparams(bindparam('tweet_ids', expanding = True)), {
+            'tweet_ids' : list(tweet_ids)
+        }).fetchall())}
+
+        return [tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets]
+
+    def iter_tweets(self, after_id = 0, chunk_size = 10000):
+        ## after_id 이후의 트윗 (id, 본문) 을 id 순으로 server-side cursor 로 chunk_size 씩 읽어 온다.
+        with self.db.connect() as connection:
+            result = connection.execution_options(stream_results = True).execute(text("""
+                SELECT
+                    id,
+                    tweet
+                FROM tweets
+                WHERE id > :after_id
+                ORDER BY id
+            """), {
+                'after_id' : after_id
+            })
+
+            for rows in result.partitions(chunk_size):
+                for row in rows:
+                    yield row['id'], row['tweet']
+
+    def get_followee_ids(self, user_id):
+        rows = self.read_db.execute(text("""
+            SELECT follow_user_id
+            FROM users_follow_list
+            WHERE user_id = :user_id
+        """), {
+            'user_id' : user_id
+        }).fetchall()
+
+        return [row['follow_user_id'] for row in rows]
+
+    def get_follower_ids(self, user_id):
+        rows = self.db.execute(text("""
+            SELECT user_id
+            FROM users_follow_list
+            WHERE follow_user_id = :user_id
         """), {
             'user_id' : user_id
         }).fetchall()
 
-        return [{
-            'user_id' : tweet['user_id'],
-            'tweet'   : tweet['tweet']
-        } for tweet in timeline]
+        return [row['user_id'] for row in rows]
+
+
+def timeline_authors(user_id, followee_ids):
+    ## 타임라인에 트윗이 보이는 작성자들. 본인을 팔로우 하고 있어도 한 번만 넣는다.
+    return list(dict.fromkeys([user_id, *followee_ids]))
+
+
+def timeline_queries(author_ids, max_id = None, since_id = None, limit = None, batch_size = UNION_BATCH_SIZE):
+    ## 작성자마다 "WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?" 로 (user_id, id) index 를
+    ## 역순으로 limit 개만 읽는 서브쿼리를 만들고 UNION ALL 로 묶은 뒤 다시 id 역순으로 limit 개를 고른다.
+    ## 트윗은 작성자가 한 명이므로 작성자가 중복되지 않으면 각 트윗은 정확히 한 번만 나온다.
+    ## 작성자가 batch_size 보다 많으면 batch_size 명씩 나눈 쿼리 list 를 돌려준다. (merge_timelines 로 합친다.)
+    queries = []
+    for start in range(0, len(author_ids), batch_size):
+        batch  = author_ids[start:start + batch_size]
+        params = {}
+        conditions, limit_clause = cursor_clauses('t.id', params, max_id, since_id, limit)
+
+        scans = []
+        for index, author_id in enumerate(batch):
+            params[f'author_{index}'] = author_id
+            scans.append(f"""
+                SELECT
+                    t.id,
+                    t.user_id,
+                    t.tweet
+                FROM tweets t
+                WHERE t.user_id = :author_{index}
+                {conditions}
+                ORDER BY t.id DESC
+                {limit_clause}
+            """)
+
+        if len(scans) == 1:
+            queries.append((text(scans[0]), params))
+            continue
+
+        ## sqlite 는 UNION 의 각 SELECT 에 ORDER BY / LIMIT 을 바로 붙일 수 없으므로 derived table 로 감싼다.
+        union = '\n            UNION ALL\n'.join(
+            f"            SELECT * FROM ({scan}) a{index}" for index, scan in enumerate(scans))
+
+        queries.append((text(f"""
+            SELECT
+                timeline.id,
+                timeline.user_id,
+                timeline.tweet
+            FROM (
+{union}
+            ) timeline
+            ORDER BY timeline.id DESC
+            {limit_clause}
+        """), params))
+
+    return queries
+
+
+def merge_timelines(results, limit = None):
+    ## id 역순으로 정렬된 쿼리 결과들을 k-way merge 해서 limit 개를 고른다.
+    if len(results) == 1:
+        return results[0]
+
+    merged = heapq.merge(*results, key = lambda tweet: tweet['id'], reverse = True)
+
+    return list(itertools.islice(merged, limit))
+
+
+def timeline_version(rows):
+    ## get_timeline_version 쿼리 결과를 (최신 트윗 id, 팔로우 하는 유저 id 목록) 으로 나눈다.
+    newest_id    = None
+    followee_ids = []
+    for row in rows:
+        if row['kind'] == 1:
+            newest_id = row['id']
+        else:
+            followee_ids.append(row['id'])
+
+    return newest_id, followee_ids
+
+
+def cursor_clauses(column, params, max_id = None, since_id = None, limit = None):
+    ## max_id / since_id / limit 커서를 SQL 조건절로 만들고 params 에 값을 채워 넣는다.
+    conditions = []
+
+    if max_id is not None:
+        conditions.append(f"AND {column} < :max_id")
+        params['max_id'] = max_id
+
+    if since_id is not None:
+        conditions.append(f"AND {column} > :since_id")
+        params['since_id'] = since_id
+
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = "LIMIT :limit"
+        params['limit'] = limit
+
+    return ' '.join(conditions), limit_clause
@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, TimeoutError
+from sqlalchemy import text
+
+
+class TweetQueueFull(Exception):
+    pass
+
+
+class TweetWriteTimeout(Exception):
+    ## 배치가 write_timeout 초 안에 commit 되지 않았다. 트윗은 나중에 쓰여질 수도 있다.
+    pass
+
+
+class TweetWriter:
+    ## 트윗 INSERT 를 모아서 한 번에 쓰는 write-behind 파이프라인.
+    ## insert_tweet 은 큐에 넣고 자신이 속한 배치가 commit 될 때까지 기다린 뒤 트윗 아이디를 돌려준다.
+    ## 배치는 batch_size 개가 모이거나 첫 트윗 이후 batch_window 초가 지나면 쓰여진다.
+    STOP = object()
+
+    ## executemany 의 INSERT ... VALUES 를 길이와 상관없이 한 문장으로 합쳐서 보내는 MySQL 드라이버들.
+    ## (pymysql, mysqlclient 는 문장이 길면 여러 문장으로 나눠 보내므로 LAST_INSERT_ID() 로 id 를 알 수 없다)
+    MULTI_ROW_DRIVERS = ('mysqlconnector',)
+
+    def __init__(self, database, batch_size = 100, batch_window = 0.005,
+                 max_queue = 10000, queue_timeout = 1.0, write_timeout = 10.0):
+        self.db            = database
+        self.batch_size    = batch_size
+        self.batch_window  = batch_window
+        self.queue_timeout = queue_timeout
+        self.write_timeout = write_timeout
+        self.queue         = queue.Queue(maxsize = max_queue)
+        self.closed        = False
+        self.lock          = threading.Lock()   ## closed 확인과 큐에 넣기를, close 의 STOP 넣기와 겹치지 않게 한다
+
+        self.batches  = 0
+        self.written  = 0
+        self.rejected = 0
+
+        self.thread = threading.Thread(target = self.run, name = 'tweet-writer', daemon = True)
+        self.thread.start()
+
+    def insert_tweet(self, user_id, tweet):
+        ## write_timeout 초 안에 배치가 commit 되지 않으면 TweetWriteTimeout 을 던진다.
+        try:
+            return self.submit(user_id, tweet).result(timeout = self.write_timeout)
+        except TimeoutError:
+            raise TweetWriteTimeout(f"tweet was not written within {self.write_timeout} seconds")
+
+    def submit(self, user_id, tweet):
+        ## 큐가 queue_timeout 초 동안 꽉 차 있으면 TweetQueueFull 을 던진다. (backpressure)
+        ## close 가 STOP 을 넣은 뒤에 큐에 들어가서 아무도 꺼내지 않는 일이 없도록 lock 안에서 넣는다.
+        deadline = time.monotonic() + self.queue_timeout
+        if not self.lock.acquire(timeout = self.queue_timeout):
+            self.rejected += 1
+            raise TweetQueueFull("tweet write queue is full")
+
+        try:
+            if self.closed:
+                raise TweetQueueFull("tweet writer is closed")
+
+            future = Future()
+            try:
+                self.queue.put((user_id, tweet, future), timeout = max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                self.rejected += 1
+                raise TweetQueueFull("tweet write queue is full")
+        finally:
+            self.lock.release()
+
+        return future
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            item = self.queue.get()
+            if item is self.STOP:
+                break
+
+            batch    = [item]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout = max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+                if item is self.STOP:
+                    stopped = True
+                    break
+
+                batch.append(item)
+
+            self.write(batch)
+
+    def write(self, batch):
+        rows = [{'user_id' : user_id, 'tweet' : tweet} for user_id, tweet, _ in batch]
+
+        try:
+            with self.db.begin() as connection:
+                tweet_ids = self.insert_rows(connection, rows)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.written += len(batch)
+
+        for (_, _, future), tweet_id in zip(batch, tweet_ids):
+            future.set_result(tweet_id)
+
+    def insert_rows(self, connection, rows):
+        insert = text("""
+            INSERT INTO tweets (
+                user_id,
+                tweet
+            ) VALUES (
+                :user_id,
+                :tweet
+            )
+        """)
+
+        if connection.dialect.name != 'mysql' or not self.consecutive_ids(connection):
+            return [connection.execute(insert, row).lastrowid for row in rows]
+
+        ## executemany 가 multi-row INSERT 한 문장으로 나가고, 그 row 들의 auto increment 값은 연속이다.
+        ## LAST_INSERT_ID() 는 그 중 첫 번째 값을 돌려준다.
+        result = connection.execute(insert, rows)
+        if result.rowcount != len(rows):
+            raise RuntimeError(f"multi-row insert wrote {result.rowcount} of {len(rows)} tweets")
+
+        first_id = connection.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+
+        return [first_id + index for index in range(len(rows))]
+
+    def consecutive_ids(self, connection):
+        ## 한 문장으로 넣은 row 들의 id 가 first_id, first_id + 1, ... 인 것은 아래 경우뿐이다.
+        ##   - 드라이버가 executemany 를 multi-row INSERT 로 바꿔 보낸다
+        ##   - auto_increment_increment 가 1 이다
+        ## row 수가 정해진 multi-row INSERT 는 "simple insert" 라서 innodb_autoinc_lock_mode 가
+        ## 2 (interleaved, MySQL 8 기본값) 여도 한 문장의 id 는 한 번에 연속으로 잡힌다.
+        ## 아니면 같은 트랜잭션 안에서 한 row 씩 넣고 lastrowid 를 읽는다. (commit 은 여전히 배치 당 한 번)
+        if connection.dialect.driver not in self.MULTI_ROW_DRIVERS:
+            return False
+
+        return connection.execute(text("SELECT @@auto_increment_increment")).scalar() == 1
+
+    def close(self):
+        ## 큐에 남아 있는 트윗을 모두 쓰고 나서 writer 쓰레드를 멈춘다.
+        with self.lock:
+            if self.closed:
+                return
+
+            self.closed = True
+            self.queue.put(self.STOP)
+
+        self.thread.join()
+
+        ## writer 쓰레드가 STOP 전에 멈췄으면 남은 트윗은 쓰지 못했다고 알려서 기다리는 요청이 끝나게 한다.
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is not self.STOP:
+                item[2].set_exception(TweetQueueFull("tweet writer is closed"))
+
+    def stats(self):
+        return {
+            'queue_depth' : self.queue.qsize(),
+            'batches'     : self.batches,
+            'written'     : self.written,
+            'rejected'    : self.rejected
+        }
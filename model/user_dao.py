@@ -1,9 +1,12 @@
 from sqlalchemy import text
 
+from .records import UserCredential
+
 
 class UserDao:
-    def __init__(self, database):
-        self.db = database
+    def __init__(self, database, read_database = None):
+        self.db      = database
+        self.read_db = read_database if read_database is not None else database  ## 읽기 전용 replica
 
     def insert_user(self, user):
         return self.db.execute(text("""
@@ -21,18 +24,32 @@ class UserDao:
         """), user). lastrowid
 
     def get_user_id_and_password(self, email):
-        row = self.db.execute(text("""
+        ## replica 에 없으면 primary 에서 한 번 더 찾는다. 방금 가입한 유저가 replica 에 아직 없을 때
+        ## 없는 이메일로 negative cache 되어 UNKNOWN_EMAIL_CACHE_TTL 동안 로그인을 못하지 않도록.
+        row = self.find_credential(self.read_db, email)
+        if row is None and self.read_db is not self.db:
+            row = self.find_credential(self.db, email)
+
+        return UserCredential(*row) if row else None
+
+    def find_credential(self, database, email):
+        return database.execute(text("""
                 SELECT
                     id,
                     hashed_password
                 FROM users
                 WHERE email = :email
             """), {'email' : email}).fetchone()
-        
-        return {
-            'id' : row['id'],
-            'hashed_password' : row['hashed_password']
-        } if row else None
+
+    def update_password(self, user_id, hashed_password):
+        return self.db.execute(text("""
+                UPDATE users
+                SET hashed_password = :hashed_password
+                WHERE id = :id
+            """), {
+                'id'              : user_id,
+                'hashed_password' : hashed_password
+            }).rowcount
 
     def insert_follow(self, user_id, follow_id):
         return self.db.execute(text("""
@@ -58,4 +75,17 @@ class UserDao:
             'unfollow' : unfollow_id
         }).rowcount
 
-    
\ No newline at end of file
+    def iter_follow_edges(self, chunk_size = 10000):
+        ## users_follow_list 전체를 server-side cursor 로 chunk_size 씩 읽어 온다.
+        with self.db.connect() as connection:
+            result = connection.execution_options(stream_results = True).execute(text("""
+                SELECT
+                    user_id,
+                    follow_user_id
+                FROM users_follow_list
+                ORDER BY user_id, follow_user_id
+            """))
+
+            for rows in result.partitions(chunk_size):
+                for row in rows:
+                    yield row['user_id'], row['follow_user_id']
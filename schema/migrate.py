@@ -0,0 +1,165 @@
+## DB 스키마를 만들거나 최신 버전으로 올린다.
+## schema/migrations 의 NNNN_이름.sql (MySQL) 또는 NNNN_이름.py (upgrade(connection) 함수) 를 번호 순으로 실행하고
+## 실행한 버전은 schema_version 테이블에 남겨서 다음에는 건너뛴다.
+##
+##   python -m schema.migrate [upgrade|status] [--test | --url URL] [--to VERSION]
+##
+## TIMELINE_FANOUT 을 'read' 에서 'write' / 'hybrid' 로 바꿀 때는 바꾸기 전에 기존 유저들의 홈 타임라인을 채워 둔다.
+## (home_timeline 은 fan-out 모드에서 쓰여진 트윗과 팔로우할 때 채운 트윗만 들고 있다.) 여러 번 실행해도 중복되지 않는다.
+##
+##   python -m schema.migrate backfill-home-timeline [--test | --url URL] [--limit 100]
+import os
+import re
+import argparse
+import importlib.util
+
+from sqlalchemy import create_engine, inspect, text, Table, MetaData, Index
+
+MIGRATIONS_DIR  = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE  = re.compile(r'^(\d+)_(\w+)\.(sql|py)$')
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name    = name
+        self.path    = path
+
+    def run(self, connection):
+        if self.path.endswith('.sql'):
+            with open(self.path, encoding = 'UTF-8') as f:
+                for statement in split_statements(f.read()):
+                    connection.exec_driver_sql(statement)
+        else:
+            spec   = importlib.util.spec_from_file_location(f'schema.migrations.m{self.version}', self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.upgrade(connection)
+
+
+def split_statements(sql):
+    ## -- 주석 줄을 빼고 ; 로 나눈다. (migration 파일 안에는 문자열 속 ; 를 쓰지 않는다.)
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def find_migrations():
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+
+    return sorted(migrations, key = lambda migration: migration.version)
+
+
+def applied_versions(database):
+    with database.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version     INT NOT NULL,
+                name        VARCHAR(255) NOT NULL,
+                applied_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (version)
+            )
+        """))
+
+        rows = connection.execute(text("SELECT version FROM schema_version")).fetchall()
+
+    return {row['version'] for row in rows}
+
+
+def upgrade(database, target = None):
+    ## 아직 실행하지 않은 migration 들을 순서대로 실행하고 실행한 목록을 돌려준다.
+    ## (MySQL 에서 DDL 은 바로 commit 되므로 실패하면 그 migration 부터 다시 실행하면 된다.)
+    applied = applied_versions(database)
+    ran     = []
+
+    for migration in find_migrations():
+        if migration.version in applied or (target is not None and migration.version > target):
+            continue
+
+        with database.begin() as connection:
+            migration.run(connection)
+            connection.execute(text("""
+                INSERT INTO schema_version (
+                    version,
+                    name
+                ) VALUES (
+                    :version,
+                    :name
+                )
+            """), {
+                'version' : migration.version,
+                'name'    : migration.name
+            })
+
+        ran.append(migration)
+
+    return ran
+
+
+def ensure_index(connection, table, name, columns, unique = False):
+    ## 같은 column 들로 시작하는 index (unique 면 같은 column 의 unique index 나 primary key) 가
+    ## 이미 있으면 아무것도 하지 않는다. 만들었으면 True.
+    inspector  = inspect(connection)
+    candidates = [(inspector.get_pk_constraint(table)['constrained_columns'], True)]
+    candidates += [(index['column_names'], bool(index['unique'])) for index in inspector.get_indexes(table)]
+    candidates += [(constraint['column_names'], True) for constraint in inspector.get_unique_constraints(table)]
+
+    for existing, existing_unique in candidates:
+        if existing[:len(columns)] != columns:
+            continue
+        if not unique or (existing_unique and len(existing) == len(columns)):
+            return False
+
+    table = Table(table, MetaData(), autoload_with = connection)
+    Index(name, *[table.c[column] for column in columns], unique = unique).create(connection)
+
+    return True
+
+
+def backfill_home_timeline(database, limit):
+    ## 모든 유저의 홈 타임라인에 본인과 팔로우 중인 유저들의 최근 트윗을 limit 개씩 채운다. 넣은 row 수를 돌려준다.
+    from model import TimelineDao
+
+    timeline_dao = TimelineDao(database)
+    user_ids     = [row['id'] for row in database.execute(text("SELECT id FROM users ORDER BY id")).fetchall()]
+
+    return sum(timeline_dao.rebuild(user_id, limit) for user_id in user_ids)
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', nargs = '?', choices = ['upgrade', 'status', 'backfill-home-timeline'], default = 'upgrade')
+    parser.add_argument('--url', help = 'database URL (default: config.DB_URL)')
+    parser.add_argument('--test', action = 'store_true', help = 'use config.test_config DB_URL')
+    parser.add_argument('--to', type = int, help = 'upgrade up to this version')
+    parser.add_argument('--limit', type = int, default = 100, help = 'tweets per author for backfill-home-timeline')
+    args = parser.parse_args()
+
+    url      = args.url or (config.test_config['DB_URL'] if args.test else config.DB_URL)
+    database = create_engine(url, encoding = 'utf-8')
+
+    if args.command == 'status':
+        applied = applied_versions(database)
+        for migration in find_migrations():
+            print(f"{migration.version:04d} {migration.name:<30} {'applied' if migration.version in applied else 'pending'}")
+        return
+
+    if args.command == 'backfill-home-timeline':
+        print(f"inserted {backfill_home_timeline(database, args.limit)} home_timeline rows")
+        return
+
+    ran = upgrade(database, args.to)
+    for migration in ran:
+        print(f"applied {migration.version:04d} {migration.name}")
+    if not ran:
+        print("database is up to date")
+
+
+if __name__ == "__main__":
+    main()
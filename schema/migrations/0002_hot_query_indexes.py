@@ -0,0 +1,25 @@
+## DAO 의 자주 쓰는 쿼리들이 index 만으로 처리되도록 하는 index 들.
+## 이 migration 전에 손으로 만든 DB 에는 같은 column 의 index 가 이름만 다르게 있을 수 있으므로
+## 이름 대신 column 목록으로 이미 있는지 확인하고 없는 것만 만든다.
+from schema.migrate import ensure_index
+
+INDEXES = [
+    ## 로그인 (UserDao.get_user_id_and_password) 은 email 로 한 명만 찾는다.
+    ('users', 'users_email', ['email'], True),
+
+    ## 팔로우 목록 (user_id -> follow_user_id) 과 중복 팔로우 방지. 보통 primary key 로 이미 있다.
+    ('users_follow_list', 'users_follow_list_user_follow', ['user_id', 'follow_user_id'], True),
+
+    ## 팔로워 목록 (follow_user_id -> user_id). fan-out, 팔로워 수 세기, 셀럽 찾기에서 쓴다.
+    ## user_id 까지 들어 있으므로 테이블을 읽지 않고 index 만 읽는다.
+    ('users_follow_list', 'users_follow_list_follower', ['follow_user_id', 'user_id'], False),
+
+    ## 작성자별 트윗을 id 역순으로 읽기 (타임라인, 작성자 트윗, 최신 트윗 id, 언팔로우 prune).
+    ## 작성자마다 LIMIT 만큼의 index range 만 읽는다.
+    ('tweets', 'tweets_user_id_id', ['user_id', 'id'], False)
+]
+
+
+def upgrade(connection):
+    for table, name, columns, unique in INDEXES:
+        ensure_index(connection, table, name, columns, unique)
@@ -0,0 +1,7 @@
+-- fan-out-on-write 모드(TIMELINE_FANOUT = 'write')에서 사용하는 홈 타임라인 테이블.
+-- 트윗이 작성될 때 작성자와 팔로워들의 홈 타임라인에 트윗 아이디가 들어간다.
+CREATE TABLE IF NOT EXISTS home_timeline (
+    user_id     INT NOT NULL,
+    tweet_id    INT NOT NULL,
+    PRIMARY KEY (user_id, tweet_id)
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4;
@@ -0,0 +1,439 @@
+import os
+import gc
+import sys
+import time
+import select
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import threading
+import traceback
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger('miniter.server')
+
+####################################################
+#       Pre-fork Server
+####################################################
+## create_app 을 여러 워커 프로세스로 띄우는 pre-fork 서버.
+## master 프로세스가 listen 소켓을 열고 앱 모듈을 미리 import 해 둔 뒤 (--no-preload 가 아니면) 워커들을 fork 한다.
+## import 된 코드는 copy-on-write 로 워커들이 나눠 쓰고, create_app (DB 엔진, 커넥션 pool, 백그라운드 쓰레드,
+## bcrypt 프로세스 풀) 은 fork 한 뒤에 워커마다 따로 부른다. 모든 워커가 같은 listen 소켓에서 accept 한다.
+## 워커들은 MINITER_WORKERS 로 워커 수를, MINITER_WORKER_SLOT 으로 자기 워커 번호를 안다. 워커 번호는 살아 있는 다른
+## 워커가 쓰지 않는 가장 작은 번호라서 다시 띄운 워커는 죽은 워커의 번호 (워커 별 로그 파일 등) 를 이어 받는다.
+## bcrypt 프로세스 풀은 코어 수를 워커 수로 나눈 크기로 띄운다.
+## (PASSWORD_HASH_WORKERS 를 주면 그 값을 쓴다)
+##
+##   SIGHUP         : 워커를 하나씩 새로 띄워서 요청을 받을 준비가 되면 예전 워커를 graceful 하게 내린다. (rolling reload)
+##                    config.py 는 워커가 create_app 할 때 읽으므로 설정 변경이 반영된다. 코드 변경까지 반영하려면
+##                    --no-preload 로 띄운다. 새 워커가 준비되지 못하면 (설정 오류 등) 남은 예전 워커들을 그대로 둔다.
+##                    reload 는 master 의 main loop 에서 한 단계씩 진행되므로 그동안에도 죽은 워커를 다시 띄우고 signal 을 받는다.
+##   SIGTERM/SIGINT : 워커들이 처리 중인 요청을 마치고 내려가기를 --graceful-timeout 초 까지 기다렸다가 끝낸다.
+##   워커가 죽으면 다시 띄운다. 준비되기 전에 죽는 일이 반복되면 점점 늦게 (최대 30초) 다시 띄운다.
+##   처음 띄운 워커들이 하나도 준비되기 전에 앱을 만들지 못하면 (설정 오류, 워커가 여럿일 때 쓸 수 없는 설정 등) 끝낸다.
+##
+##   워커는 끝날 때 앱의 shutdown_hooks (create_app 참고) 를 등록의 역순으로 부른다. (TweetWriter flush, 검색 색인 저장 등)
+##
+##   python server.py --bind 0.0.0.0:5000 --workers 4
+##
+## 워커는 기본 1개다. 프로세스 메모리에만 상태를 두는 기능 (FOLLOW_GRAPH, SEARCH_INDEX, TRENDING, TIMELINE_PUSH,
+## TIMELINE_CACHE_SIZE, TIMELINE_FANOUT = 'hybrid' 등) 은 워커가 여럿이면 create_app 이 거절하므로 (app.py 참고)
+## 그 기능들을 끈 뒤에 --workers 를 늘린다.
+MAX_BACKOFF = 30
+BOOT_ERROR  = 3     ## 앱 factory 가 실패한 워커의 exit code
+
+
+def load_factory(path):
+    ## 'module:callable' 형식의 앱 factory 를 import 한다.
+    module, _, name = path.partition(':')
+
+    return getattr(importlib.import_module(module), name or 'create_app')
+
+
+def create_listener(bind, backlog):
+    host, _, port = bind.rpartition(':')
+    host          = host.strip('[]') or '0.0.0.0'
+    family        = socket.AF_INET6 if ':' in host else socket.AF_INET
+
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, int(port)))
+    listener.listen(backlog)
+    listener.set_inheritable(True)
+
+    return listener
+
+
+def kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class Worker:
+    ## fork 된 워커 프로세스 안에서 돈다. 앱을 만들고 나면 ready_fd 에 1 바이트를 써서 master 에 알리고
+    ## 요청마다 쓰레드를 하나씩 띄워서 처리한다. (동시 처리 수는 앱의 admission control 이 제한한다)
+    ## SIGTERM 을 받으면 accept 를 멈추고 처리 중인 요청 쓰레드들이 끝나기를 기다린 뒤 끝난다.
+    ## master 가 사라지면 (부모 pid 가 바뀌면) 스스로 내려간다.
+    def __init__(self, factory, listener, ready_fd, master_pid):
+        self.factory    = factory
+        self.listener   = listener
+        self.ready_fd   = ready_fd
+        self.master_pid = master_pid
+        self.server     = None
+        self.app        = None
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_term)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)   ## Ctrl-C 는 프로세스 그룹 전체에 가므로 master 가 정리한다
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        try:
+            app = self.app = load_factory(self.factory)()
+        except Exception:
+            traceback.print_exc()
+            return BOOT_ERROR
+
+        host, port = self.listener.getsockname()[:2]
+        server     = make_server(host, port, app, threaded = True, fd = self.listener.fileno())
+        self.listener.close()
+
+        ## server_close 에서 처리 중인 요청 쓰레드들을 기다리도록
+        server.daemon_threads = False
+        server.block_on_close = True
+        self.server           = server
+
+        os.write(self.ready_fd, b'1')
+        os.close(self.ready_fd)
+
+        threading.Thread(target = self.watch_master, name = 'watch-master', daemon = True).start()
+
+        server.serve_forever()
+        server.server_close()
+
+        return 0
+
+    def handle_term(self, signum, frame):
+        if self.server is None:
+            sys.exit(0)
+
+        self.stop()
+
+    def stop(self):
+        ## serve_forever 를 도는 쓰레드에서 shutdown 을 부르면 멈추지 않으므로 다른 쓰레드에서 부른다.
+        threading.Thread(target = self.server.shutdown, name = 'shutdown').start()
+
+    def shutdown(self):
+        ## 앱에 shutdown_hooks (인자 없는 함수 list) 가 있으면 등록의 역순으로 부른다. 하나가 실패해도 나머지는 부른다.
+        hooks = getattr(self.app, 'shutdown_hooks', None) or []
+        while hooks:
+            try:
+                hooks.pop()()
+            except Exception:
+                traceback.print_exc()
+
+    def watch_master(self):
+        while os.getppid() == self.master_pid:
+            time.sleep(1)
+
+        logger.warning("master %d is gone, shutting down", self.master_pid)
+        self.stop()
+
+
+class WorkerProcess:
+    __slots__ = ('pid', 'ready_fd', 'ready')
+
+    def __init__(self, pid, ready_fd):
+        self.pid      = pid
+        self.ready_fd = ready_fd   ## 워커가 준비되면 1 바이트가 오는 pipe (master 쪽)
+        self.ready    = False
+
+
+class Arbiter:
+    ## master 프로세스. 워커를 fork 하고 감시하며 signal 에 따라 reload / 종료한다.
+    def __init__(self, factory, bind, workers, graceful_timeout = 30, ready_timeout = 60,
+                 preload = True, backlog = 2048):
+        self.factory          = factory
+        self.bind             = bind
+        self.worker_count     = workers
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout    = ready_timeout
+        self.preload          = preload
+        self.backlog          = backlog
+
+        self.pid         = os.getpid()
+        self.workers     = {}     ## pid -> WorkerProcess
+        self.terminating = {}     ## SIGTERM 을 보낸 워커 pid -> SIGKILL 할 시각
+        self.slots       = {}     ## 살아 있는 (내려가는 중인 것 포함) 워커 pid -> 워커 번호
+        self.signals     = []
+        self.failures    = 0      ## 준비되기 전에 죽은 워커 수 (준비된 워커가 생기면 0)
+        self.next_spawn  = 0.0
+        self.stopping    = False
+        self.booted      = False  ## 준비된 워커가 한 번이라도 있었는지
+        self.exit_code   = 0
+
+        ## rolling reload 상태. main loop 가 step_reload 로 한 단계씩 진행한다.
+        self.reload_pending  = []     ## 아직 바꾸지 않은 예전 워커 pid
+        self.reload_worker   = None   ## 준비되기를 기다리는 새 워커
+        self.reload_deadline = 0.0
+
+    def run(self):
+        self.listener = create_listener(self.bind, self.backlog)
+        logger.info("listening on %s (%d workers)", self.bind, self.worker_count)
+
+        ## 워커들이 create_app 할 때 워커 수에 맞춰 설정을 고를 수 있도록 (프로세스 별 로그 파일 등) 환경 변수로 알려 준다.
+        os.environ['MINITER_WORKERS'] = str(self.worker_count)
+
+        if self.preload:
+            load_factory(self.factory)
+
+        ## 시그널이 오면 wakeup pipe 에 1 바이트가 써져서 select 가 바로 깨어난다.
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        signal.set_wakeup_fd(self.wakeup_w)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self.handle_signal)
+
+        while not self.stopping or self.workers or self.terminating:
+            self.reap()
+            self.handle_signals()
+            self.step_reload()
+            self.kill_overdue()
+
+            if not self.stopping:
+                self.spawn_missing()
+
+            self.wait(1.0)
+
+        self.listener.close()
+        logger.info("stopped")
+
+        return self.exit_code
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def handle_signals(self):
+        while self.signals:
+            signum = self.signals.pop(0)
+            if signum == signal.SIGHUP and not self.stopping:
+                self.reload()
+            elif signum in (signal.SIGTERM, signal.SIGINT) and not self.stopping:
+                logger.info("shutting down")
+                self.stop()
+
+    def stop(self):
+        self.stopping       = True
+        self.reload_pending = []
+        self.reload_worker  = None
+        for pid in list(self.workers):
+            self.terminate(pid)
+
+    def wait(self, timeout):
+        ## 시그널이나 워커의 준비 알림이 올 때까지 최대 timeout 초 기다린다.
+        pending = {worker.ready_fd : worker for worker in self.workers.values() if worker.ready_fd is not None}
+        try:
+            readable, _, _ = select.select([self.wakeup_r, *pending], [], [], timeout)
+        except InterruptedError:
+            return
+
+        for fd in readable:
+            if fd == self.wakeup_r:
+                try:
+                    while os.read(self.wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                self.check_ready(pending[fd])
+
+    def check_ready(self, worker):
+        ## 1 바이트가 오면 준비된 것이고, EOF 면 준비되기 전에 죽은 것이다. (reap 에서 처리)
+        data = os.read(worker.ready_fd, 1)
+        os.close(worker.ready_fd)
+        worker.ready_fd = None
+        worker.ready    = bool(data)
+
+        if worker.ready:
+            self.failures = 0
+            self.booted   = True
+            logger.info("worker %d ready", worker.pid)
+
+        return worker.ready
+
+    def spawn_missing(self):
+        now = time.monotonic()
+        while len(self.workers) < self.worker_count and now >= self.next_spawn:
+            self.spawn()
+
+    def spawn(self):
+        ready_r, ready_w = os.pipe()
+        slot             = min(set(range(len(self.slots) + 1)) - set(self.slots.values()))
+
+        ## fork 전에 GC 세대를 비우고 얼려 둔다. 워커에서 GC 가 preload 한 객체들을 건드려서
+        ## copy-on-write 페이지가 복사되는 일을 줄인다.
+        gc.collect()
+        gc.freeze()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid:
+            os.close(ready_w)
+            worker = self.workers[pid] = WorkerProcess(pid, ready_r)
+            self.slots[pid] = slot
+            logger.info("spawned worker %d (slot %d)", pid, slot)
+            return worker
+
+        ## 워커 프로세스. master 의 코드로 돌아가지 않고 여기서 끝낸다.
+        ## 워커가 만드는 프로세스 (bcrypt 프로세스 풀) 까지 워커와 같이 정리할 수 있도록 워커마다 프로세스 그룹을 만든다.
+        code   = 1
+        worker = None
+        try:
+            os.setpgid(0, 0)
+            os.environ['MINITER_WORKER_SLOT'] = str(slot)
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.close(self.wakeup_r)
+            os.close(self.wakeup_w)
+            os.close(ready_r)
+            for other in self.workers.values():
+                if other.ready_fd is not None:
+                    os.close(other.ready_fd)
+
+            worker = Worker(self.factory, self.listener, ready_w, self.pid)
+            code   = worker.run()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            ## 앱의 정리 작업을 부르고 끝낸다. master 에서 물려 받은 atexit 은 부르지 않는다.
+            if worker is not None:
+                worker.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+
+            ## 워커가 정리하지 못하고 죽었으면 (SIGKILL 등) 남은 자식 프로세스들이 고아로 남지 않도록 그룹째 내린다.
+            kill_group(pid)
+
+            self.slots.pop(pid, None)
+            self.terminating.pop(pid, None)
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+
+            if self.stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            logger.error("worker %d exited unexpectedly (exit code %d)", pid, code)
+            if code == BOOT_ERROR and not self.booted:
+                logger.error("the app failed to start, shutting down")
+                self.exit_code = 1
+                self.stop()
+                continue
+
+            if not worker.ready:
+                ## 앱을 만들다가 죽는 일이 반복되면 fork 를 반복하지 않도록 점점 늦게 다시 띄운다.
+                self.failures  += 1
+                self.next_spawn = time.monotonic() + min(0.5 * 2 ** (self.failures - 1), MAX_BACKOFF)
+
+    def reload(self):
+        ## 새 워커가 준비된 것을 확인한 뒤에 예전 워커를 하나씩 내린다. 그동안 나머지 워커들이 계속 요청을 받는다.
+        ## 여기서는 바꿀 워커 목록만 정하고 실제 진행은 step_reload 가 한다. reload 중에 다시 SIGHUP 이 오면
+        ## 그때 살아 있는 워커들로 목록을 다시 정한다.
+        self.reload_pending = [pid for pid in self.workers
+                               if pid not in self.terminating and self.workers[pid] is not self.reload_worker]
+        logger.info("reloading %d workers", len(self.reload_pending))
+
+    def step_reload(self):
+        if self.stopping:
+            return
+
+        worker = self.reload_worker
+        if worker is not None:
+            if worker.ready:
+                ## 새 워커가 준비되었으니 예전 워커 하나를 내린다.
+                self.reload_worker = None
+                self.terminate(self.reload_pending.pop(0))
+            elif worker.pid not in self.workers or time.monotonic() >= self.reload_deadline:
+                logger.error("new worker %d did not become ready, keeping the old workers", worker.pid)
+                self.terminate(worker.pid)
+                self.reload_worker  = None
+                self.reload_pending = []
+                return
+            else:
+                return
+
+        ## 바꾸기 전에 죽은 예전 워커는 건너뛴다. (빈 자리는 spawn_missing 이 채운다)
+        while self.reload_pending and self.reload_pending[0] not in self.workers:
+            self.reload_pending.pop(0)
+
+        if self.reload_pending:
+            self.reload_worker   = self.spawn()
+            self.reload_deadline = time.monotonic() + self.ready_timeout
+
+    def terminate(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+
+        self.terminating[pid] = time.monotonic() + self.graceful_timeout
+        worker = self.workers.pop(pid, None)
+        if worker is not None and worker.ready_fd is not None:
+            os.close(worker.ready_fd)
+
+    def kill_overdue(self):
+        ## graceful_timeout 안에 내려가지 않은 워커 (끝나지 않는 스트리밍 응답 등) 는 SIGKILL 한다.
+        now = time.monotonic()
+        for pid, deadline in list(self.terminating.items()):
+            if now >= deadline:
+                logger.warning("worker %d did not stop in %ss, killing it", pid, self.graceful_timeout)
+                kill_group(pid)
+                self.terminating[pid] = now + self.graceful_timeout
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bind', default = '127.0.0.1:5000')
+    parser.add_argument('--workers', type = int, default = 1,
+                        help = 'number of worker processes; features that keep state in one process '
+                               '(FOLLOW_GRAPH, SEARCH_INDEX, TRENDING, TIMELINE_PUSH, ...) need 1')
+    parser.add_argument('--factory', default = 'app:create_app', help = 'module:callable that returns the WSGI app')
+    parser.add_argument('--graceful-timeout', type = float, default = 30)
+    parser.add_argument('--ready-timeout', type = float, default = 60)
+    parser.add_argument('--backlog', type = int, default = 2048)
+    parser.add_argument('--no-preload', dest = 'preload', action = 'store_false',
+                        help = 'import the app in each worker so SIGHUP also reloads code')
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s [%(process)d] %(levelname)s %(message)s')
+
+    arbiter = Arbiter(args.factory, args.bind, args.workers, args.graceful_timeout, args.ready_timeout,
+                      args.preload, args.backlog)
+
+    sys.exit(arbiter.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 from .tweet_service import TweetService
 from .user_service import UserService
+from .password_hasher import PasswordHasher, PasswordHasherBusy
+from .async_user_service import AsyncUserService
+from .async_tweet_service import AsyncTweetService
 
 __all__  = [
     "UserService",
-    "TweetService"
+    "TweetService",
+    "PasswordHasher",
+    "PasswordHasherBusy",
+    "AsyncUserService",
+    "AsyncTweetService"
 ]
\ No newline at end of file
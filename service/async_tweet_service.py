@@ -0,0 +1,30 @@
+class AsyncTweetService:
+    ## TweetService 의 asyncio 버전 (ASGI 모드에서 사용)
+    def __init__(self, tweet_dao, page_size = 20, max_page_size = 100):
+        self.tweet_dao     = tweet_dao
+        self.page_size     = page_size
+        self.max_page_size = max_page_size
+
+    async def tweet(self, user_id, tweet):
+        if len(tweet) > 300:
+            return None
+
+        return await self.tweet_dao.insert_tweet(user_id, tweet)
+
+    async def get_timeline_page(self, user_id, max_id = None, since_id = None, count = None):
+        ## 다음 페이지가 있는지 알기 위해 한 개를 더 읽어 온다.
+        count    = self.clamp_page_size(count)
+        timeline = await self.tweet_dao.get_timeline(user_id, max_id, since_id, count + 1)
+
+        next_cursor = None
+        if len(timeline) > count:
+            timeline    = timeline[:count]
+            next_cursor = timeline[-1]['id']
+
+        return timeline, next_cursor
+
+    def clamp_page_size(self, count):
+        if count is None:
+            return self.page_size
+
+        return max(1, min(count, self.max_page_size))
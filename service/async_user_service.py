@@ -0,0 +1,62 @@
+import jwt
+
+from datetime import datetime, timedelta
+from model import LRUCache
+from .password_hasher import PasswordHasher
+
+
+class AsyncUserService:
+    ## UserService 의 asyncio 버전 (ASGI 모드에서 사용)
+    def __init__(self, user_dao, config, password_hasher = None, unknown_email_cache = None):
+        self.user_dao            = user_dao
+        self.config              = config
+        self.password_hasher     = password_hasher if password_hasher is not None else PasswordHasher(workers = 0)
+        self.unknown_email_cache = unknown_email_cache if unknown_email_cache is not None \
+                                   else LRUCache(max_entries = 10000, ttl = 30)
+
+    async def create_new_user(self, new_user):
+        new_user['password'] = await self.password_hasher.hash_async(new_user['password'])
+
+        new_user_id = await self.user_dao.insert_user(new_user)
+        self.unknown_email_cache.delete(new_user['email'])
+
+        return new_user_id
+
+    async def login(self, credential):
+        ## 인증에 성공하면 유저 아이디를, 실패하면 None 을 돌려준다.
+        email      = credential['email']
+        password   = credential['password']
+
+        if self.unknown_email_cache.get(email):
+            return None
+
+        user_credential = await self.user_dao.get_user_id_and_password(email)
+        if user_credential is None:
+            self.unknown_email_cache.set(email, True)
+            return None
+
+        if not await self.password_hasher.check_async(password, user_credential['hashed_password']):
+            return None
+
+        if self.password_hasher.needs_rehash(user_credential['hashed_password']):
+            await self.user_dao.update_password(
+                user_credential['id'],
+                await self.password_hasher.hash_async(password)
+            )
+
+        return user_credential['id']
+
+    def generate_access_token(self, user_id):
+        payload = {
+                'user_id' : user_id,
+                'exp'     : datetime.utcnow() + timedelta(seconds = 60 * 60 * 24)
+            }
+        token = jwt.encode(payload, self.config.JWT_SECRET_KEY, 'HS256')
+
+        return token
+
+    async def follow(self, user_id, follow_id):
+        return await self.user_dao.insert_follow(user_id, follow_id)
+
+    async def unfollow(self, user_id, unfollow_id):
+        return await self.user_dao.insert_unfollow(user_id, unfollow_id)
@@ -0,0 +1,90 @@
+import os
+import bcrypt
+import asyncio
+import threading
+
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def check_password(password, hashed_password):
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('UTF-8')
+
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed_password)
+
+
+class PasswordHasher:
+    ## bcrypt 는 한 번에 수십 ms 의 CPU 를 쓰므로 request 쓰레드 대신 전용 프로세스 풀에서 돌린다.
+    ## 처리 중이거나 대기 중인 작업이 max_pending 개를 넘으면 기다리지 않고 PasswordHasherBusy 를 던진다.
+    ## workers 가 0 이면 풀 없이 호출한 쓰레드에서 바로 계산한다.
+    def __init__(self, rounds = 12, workers = None, max_pending = None):
+        self.rounds  = rounds
+        self.workers = os.cpu_count() if workers is None else workers
+
+        self.executor = None
+        self.pending  = None
+        if self.workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers = self.workers)
+            self.pending  = threading.BoundedSemaphore(max_pending or self.workers * 4)
+
+            ## 요청을 처리하는 쓰레드들이 생기기 전인 지금 워커 프로세스들을 미리 띄워 둔다.
+            self.executor.submit(os.getpid).result()
+
+        self.rejected = 0
+
+    def hash(self, password):
+        return self.run(hash_password, password, self.rounds)
+
+    def check(self, password, hashed_password):
+        return self.run(check_password, password, hashed_password)
+
+    async def hash_async(self, password):
+        return await asyncio.wrap_future(self.submit(hash_password, password, self.rounds))
+
+    async def check_async(self, password, hashed_password):
+        return await asyncio.wrap_future(self.submit(check_password, password, hashed_password))
+
+    def needs_rehash(self, hashed_password):
+        ## $2b$12$... 형식에서 cost 를 읽어서 설정된 rounds 와 다르면 다시 해시해야 한다.
+        if isinstance(hashed_password, bytes):
+            hashed_password = hashed_password.decode('UTF-8')
+
+        try:
+            return int(hashed_password.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def run(self, function, *args):
+        return self.submit(function, *args).result()
+
+    def submit(self, function, *args):
+        if self.executor is None:
+            future = Future()
+            future.set_result(function(*args))
+            return future
+
+        if not self.pending.acquire(blocking = False):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self.pending.release()
+            raise
+
+        future.add_done_callback(lambda _: self.pending.release())
+
+        return future
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -1,13 +1,339 @@
+import heapq
+import hashlib
+import threading
+import time
+
+from model import Tweet
+
+
 class TweetService:
 
-    def __init__(self, tweet_dao):
-        self.tweet_dao = tweet_dao
+    def __init__(self, tweet_dao, timeline_dao = None, recent_tweets = None, timeline_cache = None,
+                 follow_graph = None, tweet_writer = None, fanout_threshold = 10000,
+                 page_size = 20, max_page_size = 100, stream_chunk_size = 1000, max_stream_count = 10000,
+                 search_index = None, trending = None, timeline_hub = None):
+        self.tweet_dao         = tweet_dao
+        self.tweet_writer      = tweet_writer      ## 주어지면 INSERT 를 모아서 group commit
+        self.timeline_dao      = timeline_dao      ## None 이면 fan-out-on-read
+        self.recent_tweets     = recent_tweets     ## 주어지면 hybrid fan-out
+        self.timeline_cache    = timeline_cache
+        self.follow_graph      = follow_graph      ## 주어지면 팔로우 관계를 DB 대신 메모리에서 찾는다
+        self.fanout_threshold  = fanout_threshold
+        self.page_size         = page_size
+        self.max_page_size     = max_page_size
+        self.stream_chunk_size = stream_chunk_size
+        self.max_stream_count  = max_stream_count
+        self.search_index      = search_index      ## 주어지면 트윗을 쓸 때마다 검색 색인에 넣는다
+        self.trending          = trending          ## 주어지면 트윗을 쓸 때마다 해시태그를 센다
+        self.timeline_hub      = timeline_hub      ## 주어지면 트윗을 쓸 때마다 /timeline/stream 연결들에 보낸다
+
+        self.fanout_lock  = threading.Lock()
+        self.fanout_stats = {
+            'fanout_tweets'   : 0,    ## fan-out 한 트윗 수
+            'fanout_rows'     : 0,    ## home_timeline 에 넣은 row 수
+            'fanout_seconds'  : 0.0,  ## fan-out INSERT 에 걸린 시간
+            'fanout_skipped'  : 0,    ## 셀럽이라서 fan-out 하지 않은 트윗 수
+            'merged_authors'  : 0     ## 읽을 때 합친 셀럽 타임라인 수
+        }
 
     def tweet(self, user_id, tweet):
         if len(tweet) > 300:
             return None
 
-        return self.tweet_dao.insert_tweet(user_id, tweet)
+        writer   = self.tweet_writer if self.tweet_writer is not None else self.tweet_dao
+        tweet_id = writer.insert_tweet(user_id, tweet)
+
+        ## fan-out-on-write 모드면 작성자와 팔로워들의 홈 타임라인에 바로 넣어 준다.
+        if self.timeline_dao is not None:
+            self.fan_out(user_id, tweet_id, tweet)
+
+        if self.search_index is not None:
+            self.search_index.add(tweet_id, tweet)
+
+        if self.trending is not None:
+            self.trending.add(tweet)
+
+        if self.timeline_hub is not None:
+            self.timeline_hub.publish(user_id, Tweet(tweet_id, user_id, tweet))
+
+        self.invalidate_timelines(user_id)
+
+        return tweet_id
+
+    def invalidate_timelines(self, user_id):
+        ## 새 트윗이 보여야 하는 작성자 본인과 팔로워들의 캐시된 타임라인을 지운다.
+        ## 지금 캐시된 페이지가 없는 팔로워도 빼지 않는다. (DB 를 읽는 중인 요청이 예전 페이지를 캐시하지 않도록)
+        if self.timeline_cache is None:
+            return
+
+        self.timeline_cache.invalidate_many([user_id, *self.get_follower_ids(user_id)])
+
+    def get_follower_ids(self, user_id):
+        if self.follow_graph is not None:
+            return self.follow_graph.followers(user_id)
+
+        return self.tweet_dao.get_follower_ids(user_id)
+
+    def get_followee_ids(self, user_id):
+        if self.follow_graph is not None:
+            return self.follow_graph.followees(user_id)
+
+        return self.timeline_dao.get_followee_ids(user_id)
+
+    def fan_out(self, user_id, tweet_id, tweet):
+        ## 팔로워가 fanout_threshold 를 넘는 작성자는 fan-out 대신 최근 트윗 캐시에만 넣는다.
+        if self.is_popular(user_id):
+            self.recent_tweets.push(user_id, Tweet(tweet_id, user_id, tweet))
+            self.add_fanout_stats(fanout_skipped = 1)
+            return
+
+        started = time.perf_counter()
+        rows    = self.timeline_dao.fan_out(user_id, tweet_id)
+
+        self.add_fanout_stats(
+            fanout_tweets  = 1,
+            fanout_rows    = rows,
+            fanout_seconds = time.perf_counter() - started
+        )
+
+    def is_popular(self, user_id):
+        if self.recent_tweets is None:
+            return False
+
+        if user_id in self.recent_tweets:
+            return True
+
+        if self.follow_graph is not None:
+            return self.follow_graph.follower_count(user_id) > self.fanout_threshold
+
+        followers = self.timeline_dao.count_followers(user_id, self.fanout_threshold + 1)
+
+        return followers > self.fanout_threshold
+
+    def warm_recent_tweets(self):
+        ## 서버 시작시 셀럽들의 최근 트윗을 캐시에 채워 둔다.
+        if self.recent_tweets is None:
+            return
+
+        for author_id in self.timeline_dao.get_popular_user_ids(self.fanout_threshold):
+            self.recent_tweets.warm(
+                author_id,
+                self.tweet_dao.get_user_tweets(author_id, limit = self.recent_tweets.max_size)
+            )
+
+    def warm_search_index(self):
+        ## 서버 시작시 (파일에서 읽어 온) 색인 이후에 쓰여진 트윗들을 DB 에서 읽어 색인한다.
+        if self.search_index is None:
+            return 0
+
+        return self.search_index.build(self.tweet_dao.iter_tweets(self.search_index.last_id))
+
+    def search(self, query, count = None, max_id = None):
+        ## 검색어와 관련 높은 순으로 트윗을 count 개 돌려준다. 본문은 색인이 아니라 DB 에서 읽는다.
+        tweet_ids = self.search_index.search(query, self.clamp_page_size(count), max_id)
+
+        return self.tweet_dao.get_tweets(tweet_ids)
+
+    def subscribe_timeline(self, user_id, last_event_id = None):
+        ## 유저의 타임라인에 새로 올라오는 트윗을 받을 Subscription 과, last_event_id 이후에 놓친 트윗들
+        ## (오래된 순, 최대 max_page_size 개) 을 돌려준다. 놓친 트윗이 그보다 많으면 세번째 값이 True 이다.
+        ## 놓친 트윗을 읽는 동안 올라온 트윗도 빠지지 않도록 먼저 구독한다. (겹치는 트윗은 id 로 거른다)
+        ## 연결 수가 너무 많으면 Subscription 이 None 이다.
+        if self.follow_graph is not None:
+            followee_ids = self.follow_graph.followees(user_id)
+        else:
+            followee_ids = self.tweet_dao.get_followee_ids(user_id)
+
+        subscription = self.timeline_hub.subscribe(user_id, followee_ids)
+        if subscription is None or last_event_id is None:
+            return subscription, [], False
+
+        missed, next_cursor = self.get_timeline_page(user_id, since_id = last_event_id, count = self.max_page_size)
+
+        return subscription, missed[::-1], next_cursor is not None
+
+    def get_trending(self, count = None):
+        ## 최근 많이 쓰인 해시태그와 추정 횟수. 메모리의 집계만 읽고 DB 는 읽지 않는다.
+        return self.trending.top(count)
+
+    def get_timeline_etag(self, user_id, *params):
+        ## 타임라인 응답은 보이는 트윗 중 가장 최근 id 와 팔로우 목록, 요청 파라미터만으로 정해진다.
+        ## (트윗은 지워지지 않고 id 순으로만 추가된다.) 그래서 타임라인을 읽지 않고도 ETag 를 만들 수 있다.
+        if self.timeline_dao is not None:
+            newest_id, followee_ids = self.timeline_dao.get_timeline_version(user_id)
+        elif self.follow_graph is not None:
+            followee_ids = self.follow_graph.followees(user_id)
+            newest_id    = self.tweet_dao.get_authors_newest_id([user_id, *followee_ids])
+        else:
+            newest_id, followee_ids = self.tweet_dao.get_timeline_version(user_id)
+
+        ## 셀럽의 새 트윗은 home_timeline 에 없고 최근 트윗 캐시에만 있다.
+        if self.recent_tweets:
+            for author_id in [user_id, *followee_ids]:
+                recent_id = self.recent_tweets.newest_id(author_id) if author_id in self.recent_tweets else None
+                if recent_id is not None and (newest_id is None or recent_id > newest_id):
+                    newest_id = recent_id
+
+        version = f'{user_id}:{newest_id}:{",".join(map(str, sorted(followee_ids)))}:{params}'
+
+        return hashlib.blake2b(version.encode('UTF-8'), digest_size = 12).hexdigest()
+
+    def get_timeline(self, user_id, max_id = None, since_id = None, count = None):
+        timeline, _ = self.get_timeline_page(user_id, max_id, since_id, count)
+
+        return timeline
+
+    def get_timeline_page(self, user_id, max_id = None, since_id = None, count = None):
+        count = self.clamp_page_size(count)
+
+        if self.timeline_cache is None:
+            return self.load_timeline_page(user_id, max_id, since_id, count)
+
+        page = self.timeline_cache.get_page(user_id, max_id, since_id, count)
+        if page is None:
+            generation = self.timeline_cache.generation(user_id)
+            page       = self.load_timeline_page(user_id, max_id, since_id, count)
+            self.timeline_cache.set_page(user_id, max_id, since_id, count, page, generation)
+
+        return page
+
+    def stream_timeline(self, user_id, max_id = None, since_id = None, count = None):
+        ## 타임라인을 chunk 단위로 읽어 오는 TimelineStream 을 돌려준다.
+        ## 스트리밍은 한 번에 많은 트윗을 내려줄 때 쓰므로 count 를 max_page_size 대신 max_stream_count 로 제한하고,
+        ## count 가 없으면 max_stream_count 개까지 읽는다. 캐시는 거치지 않는다.
+        count = self.max_stream_count if count is None else max(1, min(count, self.max_stream_count))
+
+        ## fan-out-on-read 이고 팔로우 목록을 DB 에서 읽을 때만 DAO 의 server-side cursor 로 읽고,
+        ## 그 밖에는 get_timeline_page 와 같은 방법 (home_timeline, 셀럽 합치기, FollowGraph) 으로 keyset 페이지를 이어 읽는다.
+        if self.timeline_dao is None and self.follow_graph is None:
+            def read_chunks(limit):
+                return self.tweet_dao.iter_timeline(user_id, max_id, since_id, limit, self.stream_chunk_size)
+        else:
+            def read_chunks(limit):
+                return self.iter_timeline_pages(user_id, max_id, since_id, limit)
+
+        return TimelineStream(read_chunks, count)
+
+    def iter_timeline_pages(self, user_id, max_id, since_id, limit):
+        ## read_timeline 으로 stream_chunk_size 개씩 max_id 를 옮겨 가며 limit 개까지 읽는다.
+        while limit > 0:
+            size  = min(self.stream_chunk_size, limit)
+            chunk = self.read_timeline(user_id, max_id, since_id, size)
+            if chunk:
+                yield chunk
+
+            if len(chunk) < size:
+                return
+
+            max_id  = chunk[-1]['id']
+            limit  -= len(chunk)
+
+    def load_timeline_page(self, user_id, max_id, since_id, count):
+        ## 다음 페이지가 있는지 알기 위해 한 개를 더 읽어 온다.
+        timeline = self.read_timeline(user_id, max_id, since_id, count + 1)
+
+        next_cursor = None
+        if len(timeline) > count:
+            timeline    = timeline[:count]
+            next_cursor = timeline[-1]['id']
+
+        return timeline, next_cursor
+
+    def read_timeline(self, user_id, max_id, since_id, limit):
+        ## 설정된 fan-out 방식으로 타임라인을 id 역순으로 limit 개 읽는다.
+        if self.timeline_dao is not None:
+            timeline = self.timeline_dao.get_home_timeline(user_id, max_id, since_id, limit)
+            return self.merge_popular(user_id, timeline, max_id, since_id, limit)
+
+        if self.follow_graph is not None:
+            author_ids = [user_id, *self.follow_graph.followees(user_id)]
+            return self.tweet_dao.get_authors_timeline(author_ids, max_id, since_id, limit)
+
+        return self.tweet_dao.get_timeline(user_id, max_id, since_id, limit)
+
+    def merge_popular(self, user_id, timeline, max_id, since_id, limit):
+        ## 홈 타임라인과 팔로우 중인 셀럽들의 최근 트윗을 id 역순으로 k-way merge 한다.
+        if not self.recent_tweets:
+            return timeline
+
+        authors = [
+            author_id for author_id in [user_id, *self.get_followee_ids(user_id)]
+            if author_id in self.recent_tweets
+        ]
+        if not authors:
+            return timeline
+
+        sources = [timeline]
+        for author_id in authors:
+            recent = self.recent_tweets.get(author_id, max_id, since_id, limit)
+            if recent is None:
+                recent = self.tweet_dao.get_user_tweets(author_id, max_id, since_id, limit)
+
+            sources.append(recent)
+
+        self.add_fanout_stats(merged_authors = len(authors))
+
+        ## 셀럽이 되기 전에 fan-out 된 트윗은 홈 타임라인과 캐시에 모두 있을 수 있으므로 중복을 거른다.
+        merged  = []
+        last_id = None
+        for tweet in heapq.merge(*sources, key = lambda tweet: tweet['id'], reverse = True):
+            if tweet['id'] == last_id:
+                continue
+
+            merged.append(tweet)
+            last_id = tweet['id']
+
+            if len(merged) == limit:
+                break
+
+        return merged
+
+    def add_fanout_stats(self, **stats):
+        with self.fanout_lock:
+            for name, value in stats.items():
+                self.fanout_stats[name] += value
+
+    def get_fanout_stats(self):
+        with self.fanout_lock:
+            stats = dict(self.fanout_stats)
+
+        stats['fanout_threshold'] = self.fanout_threshold
+        stats['popular_authors']  = len(self.recent_tweets) if self.recent_tweets is not None else 0
+
+        return stats
+
+    def clamp_page_size(self, count):
+        if count is None:
+            return self.page_size
+
+        return max(1, min(count, self.max_page_size))
+
+
+class TimelineStream:
+    ## 타임라인을 chunk (list of tweet) 단위로 돌려주는 iterable.
+    ## read_chunks(limit) 는 타임라인을 id 역순으로 limit 개까지 chunk 로 나눠 돌려주는 generator 이다.
+    ## 다음 페이지가 있는지는 끝까지 읽어야 알 수 있으므로 next_cursor 는 순회가 끝난 뒤에 채워진다.
+    def __init__(self, read_chunks, count):
+        self.read_chunks = read_chunks
+        self.count       = count
+        self.next_cursor = None
+        self.last_id     = None
+
+    def __iter__(self):
+        ## get_timeline_page 처럼 다음 페이지가 있는지 알기 위해 한 개를 더 읽어 온다.
+        chunks = self.read_chunks(self.count + 1)
+
+        sent = 0
+        for chunk in chunks:
+            if sent + len(chunk) > self.count:
+                chunk = chunk[:self.count - sent]
+                if chunk:
+                    yield chunk
+
+                self.next_cursor = chunk[-1]['id'] if chunk else self.last_id
+                chunks.close()
+                return
 
-    def get_timeline(self, user_id):
-        return self.tweet_dao.get_timeline(user_id)
+            yield chunk
+            sent        += len(chunk)
+            self.last_id = chunk[-1]['id']
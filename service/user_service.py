@@ -1,34 +1,59 @@
 import jwt
-import bcrypt
 
 from datetime import datetime, timedelta
+from model import LRUCache
+from .password_hasher import PasswordHasher
 
 
 class UserService:
 
-    def __init__(self, user_dao ,config):
-        self.user_dao = user_dao
-        self.config   = config
+    def __init__(self, user_dao ,config, timeline_dao = None, timeline_cache = None, follow_graph = None,
+                 password_hasher = None, unknown_email_cache = None, backfill_size = 100, timeline_hub = None):
+        self.user_dao        = user_dao
+        self.config          = config
+        self.timeline_dao    = timeline_dao  ## fan-out-on-write 모드일 때만 주어진다
+        self.timeline_cache  = timeline_cache
+        self.follow_graph    = follow_graph
+        self.backfill_size   = backfill_size
+        self.timeline_hub    = timeline_hub  ## 주어지면 팔로우 변경을 /timeline/stream 연결들에 바로 반영한다
+
+        ## 따로 주지 않으면 request 쓰레드에서 바로 bcrypt 를 계산한다.
+        self.password_hasher = password_hasher if password_hasher is not None else PasswordHasher(workers = 0)
+
+        ## 존재하지 않는 이메일로 로그인 시도가 반복될 때 users 테이블을 다시 조회하지 않도록
+        ## 짧은 TTL 로 기억해 두는 negative cache
+        self.unknown_email_cache = unknown_email_cache if unknown_email_cache is not None \
+                                   else LRUCache(max_entries = 10000, ttl = 30)
 
     def create_new_user(self, new_user):
-        new_user['password'] = bcrypt.hashpw(
-            new_user['password'].encode('UTF-8'),
-            bcrypt.gensalt()
-        )
+        new_user['password'] = self.password_hasher.hash(new_user['password'])
 
         new_user_id = self.user_dao.insert_user(new_user)
+        self.unknown_email_cache.delete(new_user['email'])
 
         return new_user_id
 
     def login(self, credential):
+        ## 인증에 성공하면 유저 아이디를, 실패하면 None 을 돌려준다.
         email      = credential['email']
         password   = credential['password']
+
+        if self.unknown_email_cache.get(email):
+            return None
+
         user_credential = self.user_dao.get_user_id_and_password(email)
+        if user_credential is None:
+            self.unknown_email_cache.set(email, True)
+            return None
 
-        authorized = user_credential and bcrypt.checkpw(password.encode('UTF-8'),
-                                    user_credential['hashed_password'].encode('UTF-8'))
-        
-        return authorized
+        if not self.password_hasher.check(password, user_credential['hashed_password']):
+            return None
+
+        ## 설정된 bcrypt cost 가 바뀌었으면 로그인 하는 김에 새 cost 로 다시 해시해서 저장한다.
+        if self.password_hasher.needs_rehash(user_credential['hashed_password']):
+            self.user_dao.update_password(user_credential['id'], self.password_hasher.hash(password))
+
+        return user_credential['id']
     
     def generate_access_token(self, user_id):
         payload = {
@@ -40,10 +65,40 @@ class UserService:
         return token  # .decode('UTF-8')
 
     def follow(self, user_id, follow_id):
-        return self.user_dao.insert_follow(user_id, follow_id)
+        result = self.user_dao.insert_follow(user_id, follow_id)
+
+        if self.follow_graph is not None:
+            self.follow_graph.add(user_id, follow_id)
+
+        if self.timeline_hub is not None:
+            self.timeline_hub.follow(user_id, follow_id)
+
+        ## 홈 타임라인에 새로 팔로우한 유저의 최근 트윗을 채워 넣는다.
+        if self.timeline_dao is not None:
+            self.timeline_dao.backfill(user_id, follow_id, self.backfill_size)
+
+        if self.timeline_cache is not None:
+            self.timeline_cache.invalidate(user_id)
+
+        return result
 
     def unfollow(self, user_id, unfollow_id):
-        return self.user_dao.insert_unfollow(user_id, unfollow_id)
+        result = self.user_dao.insert_unfollow(user_id, unfollow_id)
+
+        if self.follow_graph is not None:
+            self.follow_graph.remove(user_id, unfollow_id)
+
+        if self.timeline_hub is not None:
+            self.timeline_hub.unfollow(user_id, unfollow_id)
+
+        ## 홈 타임라인에서 언팔로우한 유저의 트윗을 지운다. (자기 자신을 언팔로우해도 본인 트윗은 남는다)
+        if self.timeline_dao is not None and unfollow_id != user_id:
+            self.timeline_dao.prune(user_id, unfollow_id)
+
+        if self.timeline_cache is not None:
+            self.timeline_cache.invalidate(user_id)
+
+        return result
     
     def get_user_id_and_password(self, email):
         return self.user_dao.get_user_id_and_password(email)
\ No newline at end of file
@@ -1,9 +1,15 @@
+import os
+import json
 import bcrypt
 import pytest
 import config
 
-from model import UserDao, TweetDao
-from sqlalchemy import create_engine, text
+from model import UserDao, TweetDao, TimelineDao, RecentTweetCache, TimelineCache, FollowGraph, TweetWriter
+from model import TweetQueueFull
+from model import create_database, SlowQueryLog, Tweet, UserCredential, SearchIndex, TrendingTopics, extract_hashtags
+from model import TimelineHub
+from sqlalchemy import create_engine, text, inspect
+from schema.migrate import ensure_index, find_migrations
 
 database = create_engine(config.test_config['DB_URL'], encoding = 'utf-8',
                         max_overflow = 0)
@@ -16,6 +22,10 @@ def user_dao():
 def tweet_dao():
     return TweetDao(database)
 
+@pytest.fixture
+def timeline_dao():
+    return TimelineDao(database)
+
 def setup_function():
     ## Create a test user
     hashed_password = bcrypt.hashpw(
@@ -69,6 +79,7 @@ def teardown_function():
     database.execute(text("TRUNCATE users"))
     database.execute(text("TRUNCATE tweets"))
     database.execute(text("TRUNCATE users_follow_list"))
+    database.execute(text("TRUNCATE home_timeline"))
     database.execute(text("SET FOREIGN_KEY_CHECKS=1"))
 
 def get_user(user_id):
@@ -155,6 +166,7 @@ def test_insert_tweet(tweet_dao):
 
     assert timeline == [
         {
+            'id': 2,
             'user_id': 1,
             'tweet': 'tweet test'
         }
@@ -167,17 +179,418 @@ def test_timeline(user_dao, tweet_dao):
 
     timeline = tweet_dao.get_timeline(1)
 
+    ## 최신 트윗이 먼저 오고, 내 트윗은 한 번만 나와야 한다.
     assert timeline == [
         {
+            'id': 3,
             'user_id': 2,
-            'tweet': 'Hello World!'
+            'tweet': 'tweet test 2'
         },
         {
+            'id': 2,
             'user_id': 1,
             'tweet': 'tweet test'
         },
         {
+            'id': 1,
             'user_id': 2,
-            'tweet': 'tweet test 2'
+            'tweet': 'Hello World!'
         }
-    ]
\ No newline at end of file
+    ]
+
+def test_timeline_records(user_dao, tweet_dao):
+    ## row 마다 dict 대신 __slots__ record 를 돌려주고, dict 처럼 읽을 수 있어야 한다.
+    tweet_dao.insert_tweet(1, "tweet test")
+    timeline = tweet_dao.get_timeline(1)
+    credential = user_dao.get_user_id_and_password('songew@gmail.com')
+
+    assert all(isinstance(tweet, Tweet) for tweet in timeline)
+    assert not hasattr(timeline[0], '__dict__')
+    assert timeline[0]['tweet'] == timeline[0].tweet == "tweet test"
+    assert timeline[0].as_dict() == {'id': 2, 'user_id': 1, 'tweet': "tweet test"}
+
+    assert isinstance(credential, UserCredential)
+    assert credential['id'] == credential.id == 1
+
+def test_timeline_cursor(user_dao, tweet_dao):
+    tweet_dao.insert_tweet(1, "tweet test")
+    tweet_dao.insert_tweet(2, "tweet test 2")
+    user_dao.insert_follow(1, 2)
+
+    ## limit 만큼만 최신 순으로 읽어 온다.
+    timeline = tweet_dao.get_timeline(1, limit=2)
+    assert [tweet['id'] for tweet in timeline] == [3, 2]
+
+    ## max_id 보다 오래된 트윗만 읽어 온다.
+    timeline = tweet_dao.get_timeline(1, max_id=2)
+    assert [tweet['id'] for tweet in timeline] == [1]
+
+    ## since_id 이후의 새 트윗만 읽어 온다.
+    timeline = tweet_dao.get_timeline(1, since_id=1)
+    assert [tweet['id'] for tweet in timeline] == [3, 2]
+
+def test_timeline_union_batches(user_dao, tweet_dao):
+    ## 팔로우 목록을 작성자 한 명씩 나눈 쿼리로 읽어서 합쳐도 결과는 같아야 하고,
+    ## 자기 자신을 팔로우 해도 내 트윗은 한 번만 나와야 한다.
+    tweet_dao.insert_tweet(1, "tweet test")
+    tweet_dao.insert_tweet(2, "tweet test 2")
+    user_dao.insert_follow(1, 2)
+    user_dao.insert_follow(1, 1)
+
+    batched_dao = TweetDao(database, union_batch_size=1)
+
+    assert [tweet['id'] for tweet in batched_dao.get_timeline(1)] == [3, 2, 1]
+    assert [tweet['id'] for tweet in batched_dao.get_timeline(1, limit=2)] == [3, 2]
+    assert [tweet['id'] for tweet in batched_dao.get_timeline(1, max_id=3, since_id=1)] == [2]
+    assert [[tweet['id'] for tweet in chunk] for chunk in batched_dao.iter_timeline(1, chunk_size=2)] == [[3, 2], [1]]
+    assert batched_dao.get_timeline(1) == tweet_dao.get_timeline(1)
+
+def test_timeline_version(user_dao, tweet_dao):
+    ## 본인과 팔로우 중인 유저들의 가장 최근 트윗 id 와 팔로우 목록 (ETag 계산용)
+    assert tweet_dao.get_timeline_version(1) == (None, [])
+
+    user_dao.insert_follow(user_id=1, follow_id=2)
+    assert tweet_dao.get_timeline_version(1) == (1, [2])
+
+    tweet_id = tweet_dao.insert_tweet(1, "tweet test")
+    assert tweet_dao.get_timeline_version(1) == (tweet_id, [2])
+    assert tweet_dao.get_timeline_version(2) == (1, [])
+
+def test_fan_out(user_dao, tweet_dao, timeline_dao):
+    ## 유저 1이 유저 2를 팔로우한 뒤 유저 2가 트윗을 하면
+    ## 유저 1과 유저 2의 홈 타임라인에 모두 들어가야 한다.
+    user_dao.insert_follow(user_id=1, follow_id=2)
+    tweet_id = tweet_dao.insert_tweet(2, "tweet test")
+    timeline_dao.fan_out(2, tweet_id)
+
+    assert timeline_dao.get_home_timeline(1) == [
+        {
+            'id': tweet_id,
+            'user_id': 2,
+            'tweet': 'tweet test'
+        }
+    ]
+    assert timeline_dao.get_home_timeline(2) == timeline_dao.get_home_timeline(1)
+
+    ## 자기 자신을 팔로우한 작성자도 본인 홈 타임라인에 한 번만 들어간다.
+    user_dao.insert_follow(user_id=2, follow_id=2)
+    tweet_id = tweet_dao.insert_tweet(2, "tweet test 2")
+    assert timeline_dao.fan_out(2, tweet_id) == 2
+    assert [tweet['id'] for tweet in timeline_dao.get_home_timeline(2)] == [tweet_id, tweet_id - 1]
+
+def test_backfill_and_prune(user_dao, timeline_dao):
+    ## 팔로우 하면 유저 2의 기존 트윗이 채워지고, 언팔로우 하면 지워진다.
+    user_dao.insert_follow(user_id=1, follow_id=2)
+    timeline_dao.backfill(1, 2, limit=10)
+
+    assert timeline_dao.get_home_timeline(1) == [
+        {
+            'id': 1,
+            'user_id': 2,
+            'tweet': 'Hello World!'
+        }
+    ]
+
+    ## 두 번 채워도 중복되지 않는다.
+    timeline_dao.backfill(1, 2, limit=10)
+    assert len(timeline_dao.get_home_timeline(1)) == 1
+
+    user_dao.insert_unfollow(user_id=1, unfollow_id=2)
+    timeline_dao.prune(1, 2)
+
+    assert timeline_dao.get_home_timeline(1) == []
+
+def test_rebuild_home_timeline(user_dao, tweet_dao, timeline_dao):
+    ## fan-out 모드로 바꾸기 전에 쓰여진 트윗들도 본인과 팔로워의 홈 타임라인에 채워진다.
+    user_dao.insert_follow(user_id=1, follow_id=2)
+    tweet_id = tweet_dao.insert_tweet(1, "tweet test")
+
+    assert timeline_dao.rebuild(1, limit=10) == 2
+    assert [tweet['id'] for tweet in timeline_dao.get_home_timeline(1)] == [tweet_id, 1]
+
+    ## 다시 채워도 중복되지 않는다.
+    assert timeline_dao.rebuild(1, limit=10) == 0
+
+def test_recent_tweet_cache():
+    recent_tweets = RecentTweetCache(max_size=2)
+    recent_tweets.warm(2, [{'id': 1, 'user_id': 2, 'tweet': 'Hello World!'}])
+
+    ## 작성자의 트윗을 전부 들고 있으면 캐시만으로 응답한다.
+    assert [tweet['id'] for tweet in recent_tweets.get(2, limit=10)] == [1]
+
+    ## max_size 를 넘어서 오래된 트윗이 밀려나면 모자란 범위는 None 을 돌려준다.
+    recent_tweets.push(2, {'id': 2, 'user_id': 2, 'tweet': 'tweet test'})
+    recent_tweets.push(2, {'id': 3, 'user_id': 2, 'tweet': 'tweet test 2'})
+
+    assert [tweet['id'] for tweet in recent_tweets.get(2, limit=2)] == [3, 2]
+    assert recent_tweets.get(2, limit=3) is None
+    assert [tweet['id'] for tweet in recent_tweets.get(2, since_id=2, limit=3)] == [3]
+
+def test_timeline_cache():
+    timeline_cache = TimelineCache(max_entries=2)
+    page = ([{'id': 1, 'user_id': 2, 'tweet': 'Hello World!'}], None)
+
+    generation = timeline_cache.generation(1)
+    timeline_cache.set_page(1, None, None, 20, page, generation)
+    assert timeline_cache.get_page(1, None, None, 20) == page
+
+    ## 다른 유저를 무효화 해도 유저 1의 캐시는 그대로 남는다.
+    timeline_cache.invalidate(2)
+    assert timeline_cache.get_page(1, None, None, 20) == page
+
+    ## 유저 1을 무효화 하면 유저 1의 모든 페이지가 지워진다.
+    timeline_cache.invalidate(1)
+    assert timeline_cache.get_page(1, None, None, 20) is None
+
+    ## 읽는 도중에 무효화가 일어났으면 (세대가 바뀌었으면) 캐시하지 않는다.
+    assert not timeline_cache.set_page(1, None, None, 20, page, generation)
+
+    ## 캐시된 페이지가 없던 유저가 무효화 되어도 읽는 도중이던 페이지는 캐시하지 않는다.
+    generation = timeline_cache.generation(3)
+    timeline_cache.invalidate_many([3])
+    assert not timeline_cache.set_page(3, None, None, 20, page, generation)
+
+    ## max_entries 를 넘으면 가장 오래 안 쓴 페이지부터 밀려난다.
+    for user_id in [1, 2, 3]:
+        timeline_cache.set_page(user_id, None, None, 20, page, timeline_cache.generation(user_id))
+
+    stats = timeline_cache.stats()
+    assert stats['entries'] == 2
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+
+def test_follow_graph(user_dao):
+    ## users_follow_list 에서 읽어 온 팔로우 관계가 그대로 들어가야 한다.
+    user_dao.insert_follow(user_id=1, follow_id=2)
+
+    follow_graph = FollowGraph()
+    follow_graph.load(user_dao.iter_follow_edges())
+
+    assert list(follow_graph.followees(1)) == [2]
+    assert list(follow_graph.followers(2)) == [1]
+    assert follow_graph.is_following(1, 2)
+    assert not follow_graph.is_following(2, 1)
+
+    ## 쓰기도 바로 반영된다.
+    assert follow_graph.add(2, 1)
+    assert not follow_graph.add(2, 1)
+    assert follow_graph.remove(1, 2)
+
+    assert list(follow_graph.followees(1)) == []
+    assert list(follow_graph.followers(1)) == [2]
+    assert follow_graph.stats()['edges'] == 1
+
+def test_tweet_writer(tweet_dao):
+    ## 여러 트윗을 한 배치로 모아서 쓰고, 각 트윗의 아이디를 돌려줘야 한다.
+    tweet_writer = TweetWriter(database, batch_size=10, batch_window=0.1)
+    futures = [tweet_writer.submit(1, f"tweet test {index}") for index in range(3)]
+    tweet_writer.close()
+
+    tweet_ids = [future.result() for future in futures]
+    timeline = tweet_dao.get_timeline(1)
+
+    assert tweet_ids == [2, 3, 4]
+    assert [tweet['id'] for tweet in timeline] == [4, 3, 2]
+    assert [tweet['tweet'] for tweet in timeline] == ["tweet test 2", "tweet test 1", "tweet test 0"]
+    assert tweet_writer.stats()['batches'] == 1
+
+    ## 닫힌 writer 에는 더 넣을 수 없다.
+    with pytest.raises(TweetQueueFull):
+        tweet_writer.submit(1, "tweet test 3")
+
+def test_read_replica(tmp_path):
+    ## 로컬 sqlite 파일 두 개를 primary / replica 로 써서
+    ## 쓰기는 primary 로, 타임라인과 로그인 조회는 replica 로 가는지 확인한다.
+    primary = create_database(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_database(f"sqlite:///{tmp_path / 'replica.db'}")
+
+    for db in (primary, replica):
+        db.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT, profile TEXT, hashed_password TEXT)"))
+        db.execute(text("CREATE TABLE tweets (id INTEGER PRIMARY KEY, user_id INT, tweet TEXT)"))
+        db.execute(text("CREATE TABLE users_follow_list (user_id INT, follow_user_id INT)"))
+
+    replica.execute(text("INSERT INTO users (id, email, hashed_password) VALUES (1, 'songew@gmail.com', 'hash')"))
+
+    user_dao = UserDao(primary, replica)
+    tweet_dao = TweetDao(primary, replica)
+
+    tweet_dao.insert_tweet(1, "tweet test")
+
+    assert primary.execute(text("SELECT COUNT(*) FROM tweets")).scalar() == 1
+    assert tweet_dao.get_timeline(1) == []
+    assert user_dao.get_user_id_and_password('songew@gmail.com')['id'] == 1
+
+    ## 방금 가입해서 replica 에 아직 없는 유저는 primary 에서 찾는다.
+    user_id = user_dao.insert_user({'name': 'new', 'email': 'new@gmail.com', 'profile': '', 'password': 'hash'})
+    assert user_dao.get_user_id_and_password('new@gmail.com')['id'] == user_id
+    assert user_dao.get_user_id_and_password('unknown@gmail.com') is None
+
+    ## pool 에서 커넥션을 꺼낸 횟수와 기다린 시간이 기록된다.
+    stats = primary.pool.stats()
+    assert stats['checkouts'] >= 1
+    assert stats['checkout_wait_seconds'] >= 0
+
+
+def test_slow_query_log(tmp_path):
+    db = create_database(f"sqlite:///{tmp_path / 'slow.db'}")
+    db.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT, profile TEXT, hashed_password TEXT)"))
+    db.execute(text("CREATE TABLE tweets (id INTEGER PRIMARY KEY, user_id INT, tweet TEXT)"))
+    db.execute(text("CREATE TABLE users_follow_list (user_id INT, follow_user_id INT)"))
+
+    ## threshold 0 이면 모든 쿼리가 느린 쿼리로 기록된다.
+    slow_query_log = SlowQueryLog(str(tmp_path / 'slow.log'), threshold = 0)
+    slow_query_log.install(db)
+
+    user_dao = UserDao(db)
+    tweet_dao = TweetDao(db)
+
+    user_dao.insert_user({
+        'name': 'songew',
+        'email': 'songew@gmail.com',
+        'profile': 'test profile',
+        'password': 'hash'
+    })
+    tweet_dao.get_timeline(1)
+    tweet_dao.get_timeline(1)
+    slow_query_log.close()
+
+    records = [json.loads(line) for line in open(tmp_path / 'slow.log')]
+    slow_queries = [record for record in records if record['type'] == 'slow_query']
+    explains = [record for record in records if record['type'] == 'explain']
+
+    ## get_timeline 은 팔로우 목록과 타임라인 두 번 조회한다.
+    assert len(slow_queries) == 5
+    assert slow_queries[0]['parameters']['password'] == '***'
+    assert slow_queries[1]['parameters']['user_id'] == 1
+    assert slow_queries[1]['duration_ms'] >= 0
+
+    ## EXPLAIN 은 쿼리마다 한 번만
+    assert len(explains) == 3
+    assert slow_query_log.stats() == {'slow_queries': 5, 'explains': 3}
+
+    ## worker 를 주면 워커마다 다른 파일에 쓴다.
+    worker_log = SlowQueryLog(str(tmp_path / 'slow.log'), threshold = 0, worker = 2)
+    assert worker_log.path == str(tmp_path / 'slow.2.log')
+    worker_log.close()
+
+
+def test_hot_query_indexes(tmp_path):
+    db = create_database(f"sqlite:///{tmp_path / 'schema.db'}")
+    db.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)"))
+    db.execute(text("CREATE TABLE tweets (id INTEGER PRIMARY KEY, user_id INT, tweet TEXT)"))
+    db.execute(text("CREATE TABLE users_follow_list (user_id INT, follow_user_id INT, PRIMARY KEY (user_id, follow_user_id))"))
+    db.execute(text("CREATE INDEX legacy_tweets_user ON tweets (user_id, id)"))
+
+    index_migration = [migration for migration in find_migrations() if migration.name == 'hot_query_indexes'][0]
+    for _ in range(2):
+        with db.begin() as connection:
+            index_migration.run(connection)
+
+    indexes = {
+        table: {tuple(index['column_names']): index['unique'] for index in inspect(db).get_indexes(table)}
+        for table in ('users', 'tweets', 'users_follow_list')
+    }
+
+    ## 필요한 index 만 한 번씩 만들고, 이미 있는 index (primary key 포함) 는 다시 만들지 않는다.
+    assert indexes['users'] == {('email',): 1}
+    assert indexes['tweets'] == {('user_id', 'id'): 0}
+    assert indexes['users_follow_list'] == {('follow_user_id', 'user_id'): 0}
+
+    with db.begin() as connection:
+        assert ensure_index(connection, 'tweets', 'tweets_user_id', ['user_id']) is False
+
+
+def test_search_index(tmp_path):
+    search_index = SearchIndex()
+    search_index.build([
+        (1, "Hello World!"),
+        (2, "hello python, hello flask"),
+        (3, "파이썬 으로 만든 miniter"),
+        (4, "nothing to see")
+    ])
+    ## 여러 쓰레드가 동시에 트윗 하면 id 순서가 뒤바뀌어 들어올 수 있다.
+    for tweet_id in range(1000, 200, -1):
+        search_index.add(tweet_id, f"bulk tweet {tweet_id}")
+
+    ## 자주 나온 단어일수록, 같은 점수면 최신 트윗이 먼저
+    assert search_index.search("hello") == [2, 1]
+    assert search_index.search("HELLO python")[0] == 2
+    assert search_index.search("파이썬") == [3]
+    assert search_index.search("unknown") == []
+    assert search_index.search("bulk", limit=3) == [1000, 999, 998]
+    assert search_index.search("bulk", limit=3, max_id=500) == [499, 498, 497]
+    assert search_index.add(1, "Hello World!") is False
+
+    ## 저장했다가 다시 읽어도 같은 결과
+    path = str(tmp_path / 'search.idx')
+    search_index.save(path)
+
+    loaded = SearchIndex()
+    assert loaded.load(path) is True
+    assert loaded.search("hello") == [2, 1]
+    assert loaded.search("bulk", limit=3, max_id=500) == [499, 498, 497]
+    assert loaded.stats()['docs'] == 804
+    assert loaded.last_id == 1000
+
+    assert SearchIndex().load(str(tmp_path / 'missing.idx')) is False
+
+    ## 형식이 다른 파일 (예전 pickle 파일 등) 은 읽지 않는다.
+    (tmp_path / 'broken.idx').write_bytes(b'\x80\x04garbage')
+    assert SearchIndex().load(str(tmp_path / 'broken.idx')) is False
+
+def test_trending_topics():
+    assert extract_hashtags("#Python 과 #python, #1 그리고 #플라스크") == {'python', '플라스크'}
+
+    now      = [0.0]
+    trending = TrendingTopics(window=60, buckets=6, width=256, depth=4, k=2, refresh=0, clock=lambda: now[0])
+
+    for _ in range(3):
+        trending.add("#python #flask")
+    trending.add("#python")
+    for tag in range(100):
+        trending.add(f"#tag{tag}")
+
+    ## sketch 추정치는 실제보다 작지 않고, 후보는 capacity (k * 4) 개를 넘지 않는다.
+    assert trending.top() == [{'hashtag': 'python', 'count': 4}, {'hashtag': 'flask', 'count': 3}]
+    assert trending.top(count=1) == [{'hashtag': 'python', 'count': 4}]
+    assert trending.stats()['candidates'] == 8
+
+    ## 구간이 밀려나면 window 밖의 횟수는 빠진다.
+    now[0] = 30.0
+    trending.add("#flask")
+    now[0] = 65.0
+    assert trending.top() == [{'hashtag': 'flask', 'count': 1}]
+
+    now[0] = 1000.0
+    assert trending.top() == []
+    assert trending.stats()['window_hashtags'] == 0
+
+def test_timeline_hub():
+    timeline_hub = TimelineHub(buffer_size=2, max_subscribers=2)
+    follower     = timeline_hub.subscribe(1, [2])
+    author       = timeline_hub.subscribe(2, [])
+    assert timeline_hub.subscribe(3, []) is None
+
+    ## 작성자 본인과 팔로워에게만 간다.
+    assert timeline_hub.publish(2, Tweet(10, 2, 'hello')) == 2
+    assert timeline_hub.publish(1, Tweet(11, 1, 'hi')) == 1
+    assert follower.get(0) == [Tweet(10, 2, 'hello'), Tweet(11, 1, 'hi')]
+    assert follower.get(0.01) == []
+
+    timeline_hub.unfollow(1, 2)
+    assert timeline_hub.publish(2, Tweet(12, 2, 'bye')) == 1
+
+    ## 읽지 않는 연결 (author) 은 buffer 가 넘치면 밀려난다.
+    timeline_hub.follow(1, 2)
+    assert timeline_hub.publish(2, Tweet(13, 2, 'again')) == 1
+    assert follower.get(0) == [Tweet(13, 2, 'again')]
+    assert author.get(0) is None
+    assert timeline_hub.stats()['evicted'] == 1
+    assert timeline_hub.stats()['subscribers'] == 1
+
+    timeline_hub.unsubscribe(follower)
+    assert timeline_hub.stats()['subscribers'] == 0
+    assert timeline_hub.publish(2, Tweet(15, 2, 'nobody')) == 0
+
+    timeline_hub.close()
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import subprocess
+import urllib.request
+
+import config
+
+from app import create_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_test_app():
+    ## 워커 프로세스들이 fork 한 뒤에 부르는 factory
+    return create_app(config.test_config)
+
+
+def create_follow_graph_app():
+    return create_app(dict(config.test_config, FOLLOW_GRAPH=True))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    ## /proc 에서 부모가 master 인 프로세스들 (워커의 bcrypt 프로세스 풀은 손자라서 빠진다)
+    pids = set()
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as stat:
+                    ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == master_pid:
+                pids.add(int(name))
+
+    return pids
+
+
+def test_prefork_server():
+    port   = free_port()
+    env    = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    master = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--bind', f'127.0.0.1:{port}', '--workers', '2',
+         '--factory', 'test_server:create_test_app', '--graceful-timeout', '5'],
+        cwd=ROOT, env=env, stderr=subprocess.DEVNULL
+    )
+
+    def ping():
+        return urllib.request.urlopen(f'http://127.0.0.1:{port}/ping', timeout=5).read()
+
+    def wait_for_workers(replaced=frozenset(), timeout=30):
+        ## 워커가 2개이고 replaced 에 있는 예전 워커가 모두 사라지고 요청을 받을 수 있을 때까지 기다린다.
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            pids = worker_pids(master.pid)
+            if len(pids) == 2 and not pids & replaced:
+                try:
+                    if ping() == b'pong':
+                        return pids
+                except OSError:
+                    pass
+            time.sleep(0.1)
+
+        raise AssertionError(f'workers did not come up: {worker_pids(master.pid)}')
+
+    try:
+        workers = wait_for_workers()
+
+        ## 죽은 워커는 다시 띄운다.
+        crashed = min(workers)
+        os.kill(crashed, signal.SIGKILL)
+        workers = wait_for_workers({crashed})
+
+        ## SIGHUP 으로 워커를 모두 새로 띄우는 동안에도 요청은 실패하지 않는다.
+        failures = []
+        stop     = threading.Event()
+
+        def request_loop():
+            while not stop.is_set():
+                try:
+                    ping()
+                except OSError as e:
+                    failures.append(e)
+
+        clients = [threading.Thread(target=request_loop) for _ in range(4)]
+        for client in clients:
+            client.start()
+
+        master.send_signal(signal.SIGHUP)
+        wait_for_workers(workers)
+
+        stop.set()
+        for client in clients:
+            client.join()
+
+        assert failures == []
+
+        ## SIGTERM 이면 워커들을 내리고 끝난다.
+        master.send_signal(signal.SIGTERM)
+        assert master.wait(timeout=20) == 0
+        assert worker_pids(master.pid) == set()
+    finally:
+        if master.poll() is None:
+            master.kill()
+
+
+def test_prefork_server_refuses_single_process_options():
+    ## 프로세스 안에만 상태를 두는 기능 (FollowGraph 등) 을 켜고 워커를 여럿 띄우면 서버가 시작하지 않는다.
+    master = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--bind', f'127.0.0.1:{free_port()}', '--workers', '2',
+         '--factory', 'test_server:create_follow_graph_app'],
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)), stderr=subprocess.PIPE, timeout=60
+    )
+
+    assert master.returncode == 1
+    assert b'FOLLOW_GRAPH' in master.stderr
@@ -3,8 +3,8 @@ import bcrypt
 import pytest
 import config
 
-from model import UserDao, TweetDao
-from service import UserService, TweetService
+from model import UserDao, TweetDao, TimelineDao, RecentTweetCache, TimelineCache, FollowGraph
+from service import UserService, TweetService, PasswordHasher
 from sqlalchemy import create_engine, text
 
 database = create_engine(config.test_config['DB_URL'], encoding='utf-8', max_overflow=0)
@@ -20,6 +20,33 @@ def tweet_service():
     return TweetService(TweetDao(database))
 
 
+@pytest.fixture
+def fan_out_services():
+    ## fan-out-on-write 모드의 서비스들
+    timeline_dao = TimelineDao(database)
+
+    return (
+        UserService(UserDao(database), config, timeline_dao=timeline_dao),
+        TweetService(TweetDao(database), timeline_dao=timeline_dao)
+    )
+
+
+@pytest.fixture
+def hybrid_services():
+    ## 팔로워가 한 명만 있어도 셀럽으로 취급하는 hybrid fan-out 모드의 서비스들
+    timeline_dao = TimelineDao(database)
+
+    return (
+        UserService(UserDao(database), config, timeline_dao=timeline_dao),
+        TweetService(
+            TweetDao(database),
+            timeline_dao=timeline_dao,
+            recent_tweets=RecentTweetCache(max_size=10),
+            fanout_threshold=0
+        )
+    )
+
+
 def setup_function():
     ## Create a test user
     hashed_password = bcrypt.hashpw(
@@ -74,6 +101,7 @@ def teardown_function():
     database.execute(text("TRUNCATE users"))
     database.execute(text("TRUNCATE tweets"))
     database.execute(text("TRUNCATE users_follow_list"))
+    database.execute(text("TRUNCATE home_timeline"))
     database.execute(text("SET FOREIGN_KEY_CHECKS=1"))
 
 
@@ -136,10 +164,57 @@ def test_login(user_service):
         'password': 'test password'
     })
 
-    ## 잘못된 비번으로 로그인 했을때 False가 리턴되는지 테스트
-    assert not user_service.login({
+    ## 로그인에 성공하면 유저 아이디를 돌려준다.
+    assert user_service.login({
+        'email': 'songew@gmail.com',
+        'password': 'test password'
+    }) == 1
+
+    ## 잘못된 비번으로 로그인 했을때 None이 리턴되는지 테스트
+    assert user_service.login({
         'email': 'songew@gmail.com',
         'password': 'test1234'
+    }) is None
+
+
+def test_login_unknown_email(user_service):
+    ## 없는 이메일은 negative cache 에 기억해 둔다.
+    assert user_service.login({
+        'email': 'hong@test.com',
+        'password': 'test1234'
+    }) is None
+    assert user_service.unknown_email_cache.get('hong@test.com')
+
+    ## 그 이메일로 가입하면 negative cache 에서 지워져서 바로 로그인 할 수 있다.
+    new_user_id = user_service.create_new_user({
+        'name': '홍길동',
+        'email': 'hong@test.com',
+        'profile': '동쪽에서 번쩍, 서쪽에서 번쩍',
+        'password': 'test1234'
+    })
+
+    assert user_service.login({
+        'email': 'hong@test.com',
+        'password': 'test1234'
+    }) == new_user_id
+
+
+def test_login_rehash():
+    ## bcrypt cost 설정이 바뀌면 로그인 할 때 새 cost 로 다시 해시해서 저장한다.
+    user_service = UserService(UserDao(database), config, password_hasher=PasswordHasher(rounds=4, workers=0))
+
+    assert user_service.login({
+        'email': 'songew@gmail.com',
+        'password': 'test password'
+    })
+
+    hashed_password = user_service.get_user_id_and_password('songew@gmail.com')['hashed_password']
+    assert hashed_password.startswith('$2b$04$')
+
+    ## 다시 해시한 비밀번호로도 로그인 할 수 있어야 한다.
+    assert user_service.login({
+        'email': 'songew@gmail.com',
+        'password': 'test password'
     })
 
 
@@ -172,6 +247,7 @@ def test_tweet(tweet_service):
 
     assert timeline == [
         {
+            'id': 2,
             'user_id': 1,
             'tweet': 'tweet test'
         }
@@ -187,15 +263,121 @@ def test_timeline(user_service, tweet_service):
 
     assert timeline == [
         {
+            'id': 3,
             'user_id': 2,
-            'tweet': 'Hello World!'
+            'tweet': 'tweet test 2'
         },
         {
+            'id': 2,
             'user_id': 1,
             'tweet': 'tweet test'
         },
         {
+            'id': 1,
             'user_id': 2,
-            'tweet': 'tweet test 2'
+            'tweet': 'Hello World!'
         }
-    ]
\ No newline at end of file
+    ]
+
+
+def test_timeline_page(user_service, tweet_service):
+    tweet_service.tweet(1, "tweet test")
+    tweet_service.tweet(2, "tweet test 2")
+    user_service.follow(1, 2)
+
+    ## 페이지가 더 남아 있으면 next_cursor 로 마지막 트윗 아이디를 돌려준다.
+    timeline, next_cursor = tweet_service.get_timeline_page(1, count=2)
+    assert [tweet['id'] for tweet in timeline] == [3, 2]
+    assert next_cursor == 2
+
+    timeline, next_cursor = tweet_service.get_timeline_page(1, max_id=next_cursor, count=2)
+    assert [tweet['id'] for tweet in timeline] == [1]
+    assert next_cursor is None
+
+
+def test_fan_out_on_write_timeline(fan_out_services):
+    user_service, tweet_service = fan_out_services
+
+    ## 팔로우 하면 유저 2의 기존 트윗이 홈 타임라인에 채워진다.
+    user_service.follow(1, 2)
+    tweet_service.tweet(1, "tweet test")
+    tweet_service.tweet(2, "tweet test 2")
+
+    timeline = tweet_service.get_timeline(1)
+    assert [tweet['tweet'] for tweet in timeline] == ['tweet test 2', 'tweet test', 'Hello World!']
+
+    ## 언팔로우 하면 유저 2의 트윗이 홈 타임라인에서 빠진다.
+    user_service.unfollow(1, 2)
+
+    timeline = tweet_service.get_timeline(1)
+    assert [tweet['tweet'] for tweet in timeline] == ['tweet test']
+
+
+def test_hybrid_fan_out_timeline(hybrid_services):
+    user_service, tweet_service = hybrid_services
+    user_service.follow(1, 2)
+
+    ## 유저 2는 팔로워가 threshold 를 넘으므로 fan-out 되지 않는다.
+    tweet_id = tweet_service.tweet(2, "tweet test 2")
+    tweet_service.tweet(1, "tweet test")
+
+    assert tweet_id not in [tweet['id'] for tweet in TimelineDao(database).get_home_timeline(1)]
+
+    ## 하지만 읽을 때 최근 트윗 캐시에서 합쳐져서 순서대로 보인다.
+    timeline = tweet_service.get_timeline(1)
+    assert [tweet['tweet'] for tweet in timeline] == ['tweet test', 'tweet test 2', 'Hello World!']
+
+    stats = tweet_service.get_fanout_stats()
+    assert stats['fanout_threshold'] == 0
+    assert stats['fanout_skipped'] == 1
+    assert stats['fanout_tweets'] == 1
+
+    ## 스트리밍도 같은 방법으로 읽어서 셀럽의 트윗이 합쳐지고, count 가 없어도 max_stream_count 개로 제한된다.
+    tweet_service.stream_chunk_size = 1
+    tweet_service.max_stream_count  = 2
+
+    stream = tweet_service.stream_timeline(1)
+    assert [tweet['tweet'] for chunk in stream for tweet in chunk] == ['tweet test', 'tweet test 2']
+    assert stream.next_cursor == tweet_id
+
+
+def test_cached_timeline():
+    timeline_cache = TimelineCache()
+    user_service = UserService(UserDao(database), config, timeline_cache=timeline_cache)
+    tweet_service = TweetService(TweetDao(database), timeline_cache=timeline_cache)
+
+    user_service.follow(1, 2)
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline(1)] == ['Hello World!']
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline(1)] == ['Hello World!']
+    assert timeline_cache.stats()['hits'] == 1
+
+    ## 팔로우 중인 유저 2가 트윗하면 유저 1의 캐시가 무효화 된다.
+    tweet_service.tweet(2, "tweet test 2")
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline(1)] == ['tweet test 2', 'Hello World!']
+
+    ## 캐시된 페이지가 없는 팔로워도 무효화 된다. 트윗 전에 DB 를 읽기 시작한 요청의 페이지는 캐시되지 않는다.
+    timeline_cache.clear()
+    generation = timeline_cache.generation(1)
+    stale_page = tweet_service.load_timeline_page(1, None, None, 20)
+    tweet_service.tweet(2, "tweet test 3")
+    assert not timeline_cache.set_page(1, None, None, 20, stale_page, generation)
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline(1)][0] == 'tweet test 3'
+
+    ## 언팔로우 하면 유저 1의 캐시가 무효화 된다.
+    user_service.unfollow(1, 2)
+    assert tweet_service.get_timeline(1) == []
+
+
+def test_follow_graph_timeline():
+    follow_graph = FollowGraph()
+    user_service = UserService(UserDao(database), config, follow_graph=follow_graph)
+    tweet_service = TweetService(TweetDao(database), follow_graph=follow_graph)
+
+    ## 팔로우/언팔로우가 FollowGraph 에도 반영되고, 타임라인은 FollowGraph 로 읽는다.
+    user_service.follow(1, 2)
+    assert follow_graph.is_following(1, 2)
+    assert [tweet['tweet'] for tweet in tweet_service.get_timeline(1)] == ['Hello World!']
+
+    user_service.unfollow(1, 2)
+    assert not follow_graph.is_following(1, 2)
+    assert tweet_service.get_timeline(1) == []
\ No newline at end of file
@@ -2,16 +2,36 @@ import pytest
 import bcrypt
 import json
 import config
+import asyncio
 
-from app import create_app
+from app import create_app, close_app
+from view.json_provider import FastJSONProvider, available_backends
+from model import Tweet
+from asgi import create_asgi_app
 from sqlalchemy import create_engine, text
 
 database = create_engine(config.test_config['DB_URL'], encoding='utf-8', max_overflow=0)
 
 
 @pytest.fixture
-def api():
-    app = create_app(config.test_config)
+def make_app():
+    ## create_app 으로 만든 앱들의 bcrypt 프로세스 풀과 백그라운드 쓰레드를 테스트가 끝날 때 정리한다.
+    apps = []
+
+    def make(test_config):
+        app = create_app(test_config)
+        apps.append(app)
+        return app
+
+    yield make
+
+    for app in apps:
+        close_app(app)
+
+
+@pytest.fixture
+def api(make_app):
+    app = make_app(config.test_config)
     app.config['TESTING'] = True
     api = app.test_client()
 
@@ -80,6 +100,22 @@ def test_ping(api):
     assert b'pong' in resp.data
 
 
+def test_json_provider(api):
+    ## 어떤 backend 를 쓰든 set 은 list 로, DAO 의 record 는 object 로 직렬화 되고 결과가 같아야 한다.
+    payload = {'user_id': 1, 'follow': {2}, 'tweet': '안녕하세요', 'timeline': [Tweet(1, 2, '트윗')]}
+
+    for backend in available_backends():
+        provider = FastJSONProvider(api.application, backend)
+
+        assert provider.loads(provider.dumps(payload)) == {
+            'user_id': 1,
+            'follow': [2],
+            'tweet': '안녕하세요',
+            'timeline': [{'id': 1, 'user_id': 2, 'tweet': '트윗'}]
+        }
+        assert provider.loads(provider.dumps_bytes(payload)) == provider.loads(provider.dumps(payload))
+
+
 def test_login(api):
     resp = api.post(
         '/login',
@@ -141,10 +177,12 @@ def test_tweet(api):
         'user_id': 1,
         'timeline': [
             {
+                'id': 2,
                 'user_id': 1,
                 'tweet': "Hello World!"
             }
-        ]
+        ],
+        'next_cursor': None
     }
 
 
@@ -165,7 +203,8 @@ def test_follow(api):
     assert resp.status_code == 200
     assert tweets == {
         'user_id': 1,
-        'timeline': []
+        'timeline': [],
+        'next_cursor': None
     }
 
     # follow 유저 아이디 = 2
@@ -186,10 +225,12 @@ def test_follow(api):
         'user_id': 1,
         'timeline': [
             {
+                'id': 1,
                 'user_id': 2,
                 'tweet': "Hello World!"
             }
-        ]
+        ],
+        'next_cursor': None
     }
 
 
@@ -221,10 +262,12 @@ def test_unfollow(api):
         'user_id': 1,
         'timeline': [
             {
+                'id': 1,
                 'user_id': 2,
                 'tweet': "Hello World!"
             }
-        ]
+        ],
+        'next_cursor': None
     }
 
     # unfollow 유저 아이디 = 2
@@ -243,5 +286,391 @@ def test_unfollow(api):
     assert resp.status_code == 200
     assert tweets == {
         'user_id': 1,
-        'timeline': []
-    }
\ No newline at end of file
+        'timeline': [],
+        'next_cursor': None
+    }
+
+
+def test_timeline_cursor(api):
+    # 로그인
+    resp = api.post(
+        '/login',
+        data=json.dumps({'email': 'songew@gmail.com', 'password': 'test password'}),
+        content_type='application/json'
+    )
+    resp_json = json.loads(resp.data.decode('utf-8'))
+    access_token = resp_json['access_token']
+
+    # follow 유저 아이디 = 2
+    resp = api.post(
+        '/follow',
+        data=json.dumps({'follow': 2}),
+        content_type='application/json',
+        headers={'Authorization': access_token}
+    )
+    assert resp.status_code == 200
+
+    ## tweet 두 개 작성
+    for tweet in ["first", "second"]:
+        resp = api.post(
+            '/tweet',
+            data=json.dumps({'tweet': tweet}),
+            content_type='application/json',
+            headers={'Authorization': access_token}
+        )
+        assert resp.status_code == 200
+
+    ## 첫 페이지는 최신 트윗부터 count 개
+    resp = api.get('/timeline', query_string={'count': 2}, headers={'Authorization': access_token})
+    page = json.loads(resp.data.decode('utf-8'))
+
+    assert resp.status_code == 200
+    assert [tweet['tweet'] for tweet in page['timeline']] == ["second", "first"]
+    assert page['next_cursor'] == 2
+
+    ## next_cursor 를 max_id 로 넘기면 그 다음(오래된) 페이지
+    resp = api.get('/timeline/1', query_string={'count': 2, 'max_id': page['next_cursor']})
+    page = json.loads(resp.data.decode('utf-8'))
+
+    assert [tweet['tweet'] for tweet in page['timeline']] == ["Hello World!"]
+    assert page['next_cursor'] is None
+
+    ## since_id 이후의 새 트윗만
+    resp = api.get('/timeline/1', query_string={'since_id': 2})
+    page = json.loads(resp.data.decode('utf-8'))
+
+    assert [tweet['tweet'] for tweet in page['timeline']] == ["second"]
+
+
+def test_timeline_stream(api):
+    # 로그인
+    resp = api.post(
+        '/login',
+        data=json.dumps({'email': 'songew@gmail.com', 'password': 'test password'}),
+        content_type='application/json'
+    )
+    resp_json = json.loads(resp.data.decode('utf-8'))
+    access_token = resp_json['access_token']
+
+    # follow 유저 아이디 = 2
+    resp = api.post(
+        '/follow',
+        data=json.dumps({'follow': 2}),
+        content_type='application/json',
+        headers={'Authorization': access_token}
+    )
+    assert resp.status_code == 200
+
+    for tweet in ["first", "second"]:
+        resp = api.post(
+            '/tweet',
+            data=json.dumps({'tweet': tweet}),
+            content_type='application/json',
+            headers={'Authorization': access_token}
+        )
+        assert resp.status_code == 200
+
+    ## ?stream=1 은 chunked 응답이지만 내용은 일반 응답과 같다.
+    ## (body 를 읽으면 응답이 list 로 바뀌어 is_streamed 가 False 가 되므로 먼저 확인한다.)
+    resp = api.get('/timeline/1', query_string={'stream': 1})
+    assert resp.is_streamed
+
+    page = json.loads(resp.data.decode('utf-8'))
+    assert [tweet['tweet'] for tweet in page['timeline']] == ["second", "first", "Hello World!"]
+    assert page['next_cursor'] is None
+
+    resp = api.get('/timeline/1', query_string={'stream': 1, 'count': 2})
+    page = json.loads(resp.data.decode('utf-8'))
+
+    assert [tweet['tweet'] for tweet in page['timeline']] == ["second", "first"]
+    assert page['next_cursor'] == 2
+
+
+def test_timeline_etag(api):
+    resp = api.get('/timeline/1')
+    etag = resp.headers['ETag']
+    assert resp.status_code == 200
+
+    ## 바뀐 것이 없으면 304
+    resp = api.get('/timeline/1', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+
+    # 로그인
+    resp = api.post(
+        '/login',
+        data=json.dumps({'email': 'songew@gmail.com', 'password': 'test password'}),
+        content_type='application/json'
+    )
+    resp_json = json.loads(resp.data.decode('utf-8'))
+    access_token = resp_json['access_token']
+
+    ## 팔로우 목록이 바뀌면 ETag 도 바뀐다.
+    resp = api.post(
+        '/follow',
+        data=json.dumps({'follow': 2}),
+        content_type='application/json',
+        headers={'Authorization': access_token}
+    )
+    assert resp.status_code == 200
+
+    resp = api.get('/timeline/1', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+
+    ## 새 트윗이 생겨도 바뀐다.
+    resp = api.post(
+        '/tweet',
+        data=json.dumps({'tweet': "new tweet"}),
+        content_type='application/json',
+        headers={'Authorization': access_token}
+    )
+    assert resp.status_code == 200
+
+    resp = api.get('/timeline/1', headers={'If-None-Match': etag})
+    page = json.loads(resp.data.decode('utf-8'))
+
+    assert resp.status_code == 200
+    assert page['timeline'][0]['tweet'] == "new tweet"
+
+
+def test_metrics(api):
+    api.get('/timeline/1')
+    api.get('/ping')
+
+    resp = api.get('/metrics')
+    metrics = resp.data.decode('utf-8')
+
+    assert resp.status_code == 200
+    assert resp.content_type.startswith('text/plain')
+    assert 'miniter_http_request_duration_seconds_count{route="/timeline/<int:user_id>",method="GET",status="200"} 1' in metrics
+    assert 'miniter_http_request_duration_seconds_count{route="/ping",method="GET",status="200"} 1' in metrics
+    assert 'miniter_dao_duration_seconds_count{dao="TweetDao",method="get_timeline"} 1' in metrics
+    assert 'dao_method="TweetDao.get_timeline",statement="SELECT"' in metrics
+    assert 'miniter_db_pool_checkouts{database="primary"}' in metrics
+
+
+def test_token_cache(api):
+    # 로그인
+    resp = api.post(
+        '/login',
+        data=json.dumps({'email': 'songew@gmail.com', 'password': 'test password'}),
+        content_type='application/json'
+    )
+    resp_json = json.loads(resp.data.decode('utf-8'))
+    access_token = resp_json['access_token']
+
+    ## 같은 토큰으로 두 번 요청하면 두 번째는 캐시된 검증 결과를 쓴다.
+    for _ in range(2):
+        resp = api.get('/timeline', headers={'Authorization': access_token})
+        assert resp.status_code == 200
+
+    token_cache = api.application.extensions['token_cache']
+    assert token_cache.stats()['misses'] == 1
+    assert token_cache.stats()['hits'] == 1
+
+    ## 잘못된 토큰은 여전히 거절된다.
+    resp = api.get('/timeline', headers={'Authorization': access_token + 'x'})
+    assert resp.status_code == 401
+
+
+def test_rate_limit(make_app):
+    ## 유저 마다 burst 개를 쓰고 나면 token 이 찰 때까지 429 + Retry-After 를 돌려준다.
+    app = make_app(dict(config.test_config, RATE_LIMITS={'/tweet': (0.01, 2)}))
+    api = app.test_client()
+
+    access_tokens = []
+    for email in ('songew@gmail.com', 'tet@gmail.com'):
+        resp = api.post('/login', json={'email': email, 'password': 'test password'})
+        access_tokens.append(json.loads(resp.data.decode('utf-8'))['access_token'])
+
+    statuses = [
+        api.post('/tweet', json={'tweet': "Hello!"}, headers={'Authorization': access_tokens[0]}).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+
+    resp = api.post('/tweet', json={'tweet': "Hello!"}, headers={'Authorization': access_tokens[0]})
+    assert int(resp.headers['Retry-After']) >= 1
+
+    ## 다른 유저와 rate limit 이 없는 라우트는 영향을 받지 않는다.
+    resp = api.post('/tweet', json={'tweet': "Hello!"}, headers={'Authorization': access_tokens[1]})
+    assert resp.status_code == 200
+
+    resp = api.post('/follow', json={'follow': 2}, headers={'Authorization': access_tokens[0]})
+    assert resp.status_code == 200
+
+
+def test_search(make_app):
+    ## 시작할 때 DB 의 트윗을 색인하고, 새 트윗은 쓰는 즉시 검색된다.
+    app = make_app(dict(config.test_config, SEARCH_INDEX=True))
+    api = app.test_client()
+
+    resp = api.post('/login', json={'email': 'songew@gmail.com', 'password': 'test password'})
+    access_token = json.loads(resp.data.decode('utf-8'))['access_token']
+
+    resp = api.get('/search?q=hello')
+    assert json.loads(resp.data.decode('utf-8')) == {
+        'query': 'hello',
+        'tweets': [{'id': 1, 'user_id': 2, 'tweet': "Hello World!"}]
+    }
+
+    api.post('/tweet', json={'tweet': "hello search, hello index"}, headers={'Authorization': access_token})
+
+    resp = api.get('/search?q=hello')
+    assert [tweet['id'] for tweet in json.loads(resp.data.decode('utf-8'))['tweets']] == [2, 1]
+
+    resp = api.get('/search?q=hello&count=1')
+    assert len(json.loads(resp.data.decode('utf-8'))['tweets']) == 1
+
+    assert api.get('/search').status_code == 400
+
+
+def test_trending(make_app):
+    app = make_app(dict(config.test_config, TRENDING=True, TRENDING_SIZE=2))
+    api = app.test_client()
+
+    resp = api.post('/login', json={'email': 'songew@gmail.com', 'password': 'test password'})
+    access_token = json.loads(resp.data.decode('utf-8'))['access_token']
+
+    for tweet in ("#Miniter #flask", "#miniter 만세", "#python"):
+        api.post('/tweet', json={'tweet': tweet}, headers={'Authorization': access_token})
+
+    resp = api.get('/trending')
+    assert json.loads(resp.data.decode('utf-8')) == {
+        'window': 3600,
+        'trends': [{'hashtag': 'miniter', 'count': 2}, {'hashtag': 'flask', 'count': 1}]
+    }
+
+    resp = api.get('/trending?count=1')
+    assert json.loads(resp.data.decode('utf-8'))['trends'] == [{'hashtag': 'miniter', 'count': 2}]
+
+
+def parse_events(chunk):
+    ## server-sent events chunk 를 [(event, id, data)] 로 나눈다. heartbeat 주석은 빼고.
+    events = []
+    for block in chunk.decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+        if fields:
+            events.append((fields['event'], fields.get('id'), json.loads(fields['data'])))
+
+    return events
+
+
+def test_timeline_push(make_app):
+    app = make_app(dict(config.test_config, TIMELINE_PUSH=True, TIMELINE_PUSH_HEARTBEAT=0.01))
+    api = app.test_client()
+
+    tokens = {}
+    for user_id, email in ((1, 'songew@gmail.com'), (2, 'tet@gmail.com')):
+        resp = api.post('/login', json={'email': email, 'password': 'test password'})
+        tokens[user_id] = json.loads(resp.data.decode('utf-8'))['access_token']
+
+    api.post('/follow', json={'follow': 2}, headers={'Authorization': tokens[1]})
+
+    resp = api.get('/timeline/stream', headers={'Authorization': tokens[1]}, buffered=False)
+    assert resp.mimetype == 'text/event-stream'
+    events = iter(resp.response)
+
+    ## 새 트윗이 없으면 heartbeat 만 온다.
+    assert next(events) == b': heartbeat\n\n'
+
+    ## 팔로우 중인 유저의 트윗은 쓰는 즉시 온다.
+    api.post('/tweet', json={'tweet': "push!"}, headers={'Authorization': tokens[2]})
+    assert parse_events(next(events)) == [('tweet', '2', {'id': 2, 'user_id': 2, 'tweet': "push!"})]
+
+    ## 연결이 끊기면 구독이 풀린다.
+    assert b'miniter_timeline_push_subscribers 1' in api.get('/metrics').data
+    resp.close()
+    assert b'miniter_timeline_push_subscribers 0' in api.get('/metrics').data
+
+    ## 다시 연결하면서 Last-Event-ID 를 주면 그 이후에 놓친 트윗부터 받는다.
+    api.post('/tweet', json={'tweet': "missed"}, headers={'Authorization': tokens[2]})
+    resp = api.get('/timeline/stream', headers={'Authorization': tokens[1], 'Last-Event-ID': '2'}, buffered=False)
+    assert parse_events(next(iter(resp.response))) == [('tweet', '3', {'id': 3, 'user_id': 2, 'tweet': "missed"})]
+    resp.close()
+
+    assert api.get('/timeline/stream').status_code == 401
+
+
+def test_admission_control(make_app):
+    ## 동시 처리 수 1, 대기 큐 0 이면 처리 중인 요청이 있는 동안 다른 요청은 라우트와 상관없이 바로 503 이고
+    ## exempt 인 /ping 은 그대로 처리된다.
+    app = make_app(dict(config.test_config, ADMISSION_CONCURRENCY=1, ADMISSION_QUEUE_SIZE=0))
+    api = app.test_client()
+
+    ## 스트리밍 응답은 본문을 다 읽을 때까지 자리를 잡고 있다.
+    streaming = api.get('/timeline/1?stream=1', buffered=False)
+
+    resp = api.get('/timeline/1')
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '1'
+    assert resp.data == b''
+
+    assert api.post('/login', json={'email': 'songew@gmail.com', 'password': 'test password'}).status_code == 503
+    assert api.get('/ping').status_code == 200
+
+    streaming.get_data()
+    streaming.close()
+
+    assert api.get('/timeline/1').status_code == 200
+
+
+def test_admission_control_route_limits(make_app):
+    ## ADMISSION_ROUTE_LIMITS 로 준 라우트는 앱 전체 자리가 남아 있어도 라우트 limit 을 넘으면 503 이다.
+    app = make_app(dict(
+        config.test_config,
+        ADMISSION_CONCURRENCY  = 2,
+        ADMISSION_QUEUE_SIZE   = 0,
+        ADMISSION_ROUTE_LIMITS = {'/timeline/<int:user_id>': 1}
+    ))
+    api = app.test_client()
+
+    streaming = api.get('/timeline/1?stream=1', buffered=False)
+
+    assert api.get('/timeline/1').status_code == 503
+    assert api.post('/login', json={'email': 'songew@gmail.com', 'password': 'test password'}).status_code == 200
+
+    streaming.get_data()
+    streaming.close()
+
+    assert api.get('/timeline/1').status_code == 200
+
+
+def test_asgi_timeline():
+    ## ASGI 앱도 같은 엔드포인트와 응답 형식을 가진다.
+    ## test_app 은 나올 때 after_serving 을 불러서 DB pool 과 bcrypt 프로세스 풀을 정리한다.
+    async def run():
+        app = create_asgi_app(config.test_config)
+
+        async with app.test_app() as test_app:
+            api = test_app.test_client()
+
+            resp = await api.post(
+                '/login',
+                json={'email': 'songew@gmail.com', 'password': 'test password'}
+            )
+            access_token = (await resp.get_json())['access_token']
+
+            resp = await api.post('/follow', json={'follow': 2}, headers={'Authorization': access_token})
+            assert resp.status_code == 200
+
+            resp = await api.post('/tweet', json={'tweet': "Hello ASGI!"}, headers={'Authorization': access_token})
+            assert resp.status_code == 200
+
+            resp = await api.get('/timeline', headers={'Authorization': access_token})
+            page = await resp.get_json()
+
+            assert [tweet['tweet'] for tweet in page['timeline']] == ["Hello ASGI!", "Hello World!"]
+            assert page['next_cursor'] is None
+
+            resp = await api.get('/timeline')
+            assert resp.status_code == 401
+
+    asyncio.run(run())
+
+
+def test_asgi_unsupported_options():
+    ## create_app 에만 있는 기능을 켜고 ASGI 앱을 만들면 시작할 때 거절한다.
+    with pytest.raises(ValueError, match='TIMELINE_FANOUT, TIMELINE_PUSH'):
+        create_asgi_app(dict(config.test_config, TIMELINE_FANOUT='write', TIMELINE_PUSH=True))
@@ -1,31 +1,44 @@
 import jwt
+import hashlib
 
-from flask import jsonify, request, current_app, Response, g
-from flask.json import JSONEncoder
+from flask import jsonify, request, current_app, Response, g, stream_with_context
 from functools import wraps
+from model import TweetQueueFull, TweetWriteTimeout, LRUCache
+from service import PasswordHasherBusy
 
-## Default JSON encoder는 set을 JSON으로 변환할 수 없다.
-## 따라서 커스텀 encoder를 작성하여 set을 list로 변환,
-## JSON으로 변환 가능하게 해주어야 한다.
-class CustomJSONEncoder(JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-
-        return JSONEncoder.default(self, obj)
+from .json_provider import FastJSONProvider
+from .admission import rate_limited
 
 ####################################################
 #       Decorators
 ####################################################
+def decode_access_token(app, access_token):
+    ## 한 번 검증한 토큰은 토큰의 sha256 digest 를 키로 캐시해 두고
+    ## 토큰의 exp 시각까지는 HMAC 검증 없이 payload 를 바로 돌려준다.
+    ## (Flask 와 Quart 앱에서 같이 쓰므로 app 을 인자로 받는다.)
+    token_cache = app.extensions.get('token_cache')
+    if token_cache is not None:
+        key     = hashlib.sha256(access_token.encode('UTF-8')).digest()
+        payload = token_cache.get(key)
+        if payload is not None:
+            return payload
+
+    try:
+        payload = jwt.decode(access_token, app.config['JWT_SECRET_KEY'], 'HS256')
+    except jwt.InvalidTokenError:
+        return None
+
+    if token_cache is not None and 'exp' in payload:
+        token_cache.set(key, payload, expires_at = payload['exp'])
+
+    return payload
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         access_token = request.headers.get('Authorization')
         if access_token is not None:
-            try:
-                payload = jwt.decode(access_token, current_app.config['JWT_SECRET_KEY'], 'HS256')
-            except jwt.InvalidTokenError:
-                payload = None
+            payload = decode_access_token(current_app, access_token)
             
             if payload is None: return Response(status=401)
 
@@ -39,7 +52,12 @@ def login_required(f):
 
 
 def create_endpoints(app, services):
-    app.json_encoder = CustomJSONEncoder
+    ## JSON_BACKEND 로 'orjson' / 'ujson' / 'json' 을 고를 수 있다. (기본값은 설치된 것 중 가장 빠른 것)
+    app.json = FastJSONProvider(app, app.config.get('JSON_BACKEND'))
+
+    ## TOKEN_CACHE_SIZE 를 0 으로 주면 매 요청마다 토큰을 다시 검증한다.
+    if app.config.get('TOKEN_CACHE_SIZE', 10000) > 0:
+        app.extensions['token_cache'] = LRUCache(max_entries = app.config.get('TOKEN_CACHE_SIZE', 10000))
 
     user_service = services.user_service
     tweet_service = services.tweet_service
@@ -51,19 +69,23 @@ def create_endpoints(app, services):
     @app.route("/sign-up", methods=['POST'])
     def sign_up():
         new_user = request.json
-        new_user = user_service.create_new_user(new_user)
+        try:
+            new_user = user_service.create_new_user(new_user)
+        except PasswordHasherBusy:
+            return Response(status = 503, headers = {'Retry-After' : '1'})
 
         return jsonify(new_user)
 
     @app.route("/login", methods=['POST'])
     def login():
         credential = request.json
-        authorized = user_service.login(credential)
+        try:
+            user_id = user_service.login(credential)
+        except PasswordHasherBusy:
+            return Response(status = 503, headers = {'Retry-After' : '1'})
 
-        if authorized:
-            user_credential = user_service.get_user_id_and_password(credential['email'])
-            user_id         = user_credential['id']
-            token           = user_service.generate_access_token(user_id)
+        if user_id is not None:
+            token = user_service.generate_access_token(user_id)
 
             return jsonify({
                 'access_token' : token,  # .decode('UTF-8')
@@ -74,12 +96,20 @@ def create_endpoints(app, services):
 
     @app.route("/tweet", methods=['POST'])
     @login_required
+    @rate_limited
     def tweet():
         user_tweet       = request.json
         tweet            = user_tweet['tweet']
         user_id          = g.user_id
 
-        result = tweet_service.tweet(user_id, tweet)
+        try:
+            result = tweet_service.tweet(user_id, tweet)
+        except TweetQueueFull:
+            return Response(status = 503, headers = {'Retry-After' : '1'})
+        except TweetWriteTimeout:
+            ## 트윗이 나중에 쓰여질 수도 있으므로 다시 시도하라고 하지 않는다.
+            return Response(status = 504)
+
         if result is None:
             return '300자를 초과했습니다', 400
 
@@ -87,6 +117,7 @@ def create_endpoints(app, services):
 
     @app.route("/follow", methods=['POST'])
     @login_required
+    @rate_limited
     def follow():
         payload       = request.json
         user_id       = g.user_id
@@ -98,6 +129,7 @@ def create_endpoints(app, services):
 
     @app.route("/unfollow", methods=['POST'])
     @login_required
+    @rate_limited
     def unfollow():
         payload       = request.json
         user_id       = g.user_id
@@ -107,21 +139,153 @@ def create_endpoints(app, services):
 
         return '', 200
 
+    ## 검색 색인 (SEARCH_INDEX) 을 켰을 때만 /search 를 연다.
+    if tweet_service.search_index is not None:
+        @app.route("/search", methods=['GET'])
+        def search():
+            ## ?q= 검색어, ?count= 결과 수 (서버 설정 최대값으로 제한), ?max_id= 그보다 오래된 트윗만
+            query = request.args.get('q', '').strip()
+            if not query:
+                return '검색어가 없습니다', 400
+
+            tweets = tweet_service.search(
+                query,
+                request.args.get('count', type = int),
+                request.args.get('max_id', type = int)
+            )
+
+            return jsonify({
+                'query'  : query,
+                'tweets' : tweets
+            })
+
+    ## 해시태그 집계 (TRENDING) 를 켰을 때만 /trending 을 연다.
+    if tweet_service.trending is not None:
+        @app.route("/trending", methods=['GET'])
+        def trending():
+            ## ?count= 해시태그 수 (TRENDING_SIZE 로 제한). count 는 sketch 로 추정한 값이라 실제보다 조금 클 수 있다.
+            return jsonify({
+                'window' : tweet_service.trending.window,
+                'trends' : tweet_service.get_trending(request.args.get('count', type = int))
+            })
+
+    ## 타임라인 push (TIMELINE_PUSH) 를 켰을 때만 /timeline/stream 을 연다.
+    if tweet_service.timeline_hub is not None:
+        @app.route("/timeline/stream", methods=['GET'])
+        @login_required
+        def timeline_events():
+            ## 타임라인에 새로 올라오는 트윗을 server-sent events 로 보낸다. 이벤트 id 는 트윗 id 이다.
+            ## 다시 연결할 때 Last-Event-ID 헤더 (또는 ?last_event_id=) 를 주면 그 이후에 놓친 트윗부터 보내고,
+            ## 놓친 트윗이 너무 많으면 먼저 reset 이벤트를 보낸다. (클라이언트는 /timeline 을 다시 읽는다)
+            last_event_id = request.headers.get('Last-Event-ID', type = int)
+            if last_event_id is None:
+                last_event_id = request.args.get('last_event_id', type = int)
+
+            subscription, missed, truncated = tweet_service.subscribe_timeline(g.user_id, last_event_id)
+            if subscription is None:
+                return Response(status = 503, headers = {'Retry-After' : '1'})
+
+            response = Response(
+                timeline_event_stream(subscription, missed, truncated),
+                mimetype = 'text/event-stream',
+                headers  = {'Cache-Control' : 'no-cache', 'X-Accel-Buffering' : 'no'}
+            )
+
+            ## 연결이 끊기면 WSGI 서버가 응답을 close 하고, 그때 구독을 푼다. (본문을 보내기 전에 끊겨도 불린다)
+            response.call_on_close(lambda: tweet_service.timeline_hub.unsubscribe(subscription))
+
+            return response
+
+    def timeline_event_stream(subscription, missed, truncated):
+        ## 새 트윗이 없으면 TIMELINE_PUSH_HEARTBEAT 초 마다 주석 한 줄을 보내서 프록시가 연결을 끊지 않게 하고
+        ## 끊긴 연결을 알아챈다. 너무 느려서 hub 에서 밀려난 연결은 evicted 이벤트를 보내고 끝낸다.
+        heartbeat = app.config.get('TIMELINE_PUSH_HEARTBEAT', 15)
+        dumps     = current_app.json.dumps_bytes
+
+        ## 놓친 트윗을 읽는 동안 publish 된 트윗은 두 번 올 수 있다.
+        replayed = {tweet['id'] for tweet in missed}
+
+        def generate():
+            events = [b'event: reset\ndata: {}\n\n'] if truncated else []
+            tweets = missed
+            while True:
+                for tweet in tweets:
+                    events.append(b'id: %d\nevent: tweet\ndata: %s\n\n' % (tweet['id'], dumps(tweet)))
+
+                yield b''.join(events) or b': heartbeat\n\n'
+
+                tweets = subscription.get(heartbeat)
+                if tweets is None:
+                    yield b'event: evicted\ndata: {}\n\n'
+                    return
+
+                events = []
+                if replayed:
+                    tweets = [tweet for tweet in tweets if tweet['id'] not in replayed]
+
+        return generate()
+
     @app.route("/timeline/<int:user_id>", methods=['GET'])
     def timeline(user_id):
-        timeline = tweet_service.get_timeline(user_id)
-
-        return jsonify({
-            'user_id'  : user_id,
-            'timeline' : timeline
-        })
+        return timeline_response(user_id)
     
     @app.route("/timeline", methods=['GET'])
     @login_required
     def user_timeline():
-        timeline = tweet_service.get_timeline(g.user_id)
+        return timeline_response(g.user_id)
+
+    def timeline_response(user_id):
+        ## ?max_id= 는 그보다 오래된 페이지, ?since_id= 는 그 이후의 새 트윗,
+        ## ?count= 는 페이지 크기 (서버 설정 최대값으로 제한)
+        ## ?stream=1 이면 응답을 chunked 로 나눠서 보낸다. (count 는 TIMELINE_STREAM_MAX_COUNT 로 제한)
+        max_id   = request.args.get('max_id', type = int)
+        since_id = request.args.get('since_id', type = int)
+        count    = request.args.get('count', type = int)
+        stream   = bool(request.args.get('stream', type = int))
+
+        ## 폴링하는 클라이언트가 If-None-Match 로 보낸 ETag 가 그대로면
+        ## 타임라인을 읽거나 직렬화 하지 않고 304 를 돌려준다.
+        ## ETag 를 타임라인보다 먼저 계산하므로 바뀐 타임라인에 304 를 주는 일은 없다.
+        etag = None
+        if app.config.get('TIMELINE_ETAG', True):
+            etag = tweet_service.get_timeline_etag(user_id, max_id, since_id, count, stream)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status = 304)
+                response.set_etag(etag, weak = True)
+                return response
+
+        if stream:
+            response = stream_timeline_response(user_id, max_id, since_id, count)
+        else:
+            timeline, next_cursor = tweet_service.get_timeline_page(user_id, max_id, since_id, count)
+
+            response = jsonify({
+                'user_id'     : user_id,
+                'timeline'    : timeline,
+                'next_cursor' : next_cursor
+            })
+
+        if etag is not None:
+            response.set_etag(etag, weak = True)
+            response.cache_control.no_cache = True
+
+        return response
+
+    def stream_timeline_response(user_id, max_id, since_id, count):
+        ## DB 에서 chunk 단위로 읽은 트윗을 바로 JSON 으로 직렬화 해서 내보낸다.
+        ## 응답 전체를 메모리에 만들지 않으므로 타임라인 길이와 상관없이 메모리 사용량이 일정하다.
+        stream = tweet_service.stream_timeline(user_id, max_id, since_id, count)
+        dumps = current_app.json.dumps_bytes
+
+        def generate():
+            yield b'{"user_id":%s,"timeline":[' % dumps(user_id)
+
+            ## chunk 하나를 한 번에 직렬화 하고 바깥 [ ] 만 떼어서 이어 붙인다.
+            separator = b''
+            for chunk in stream:
+                yield separator + dumps(chunk)[1:-1]
+                separator = b','
+
+            yield b'],"next_cursor":%s}\n' % dumps(stream.next_cursor)
 
-        return jsonify({
-            'user_id' : g.user_id,
-            'timeline' : timeline
-        })
\ No newline at end of file
+        return Response(stream_with_context(generate()), mimetype = 'application/json')
@@ -0,0 +1,229 @@
+import math
+import time
+import threading
+
+from collections import OrderedDict, deque
+from functools import wraps
+from flask import request, current_app, g, Response
+
+
+class ConcurrencyLimiter:
+    ## 동시에 처리하는 요청을 limit 개로 제한하고, 넘치는 요청은 max_queue 개까지 FIFO 로 기다리게 한다.
+    ## 큐가 꽉 찼거나, 앞에서 기다리는 요청 수와 평균 처리 시간으로 예상한 대기 시간이 timeout 을 넘으면
+    ## 기다리지 않고 바로 거절한다. 기다리다가 timeout 이 지나도 거절한다.
+    ## 그래서 DB 가 느려져도 요청이 pool 앞에 끝없이 쌓이지 않고, 거절된 요청은 DB 를 건드리지 않는다.
+    def __init__(self, limit, max_queue, timeout):
+        self.limit        = limit
+        self.max_queue    = max_queue
+        self.timeout      = timeout
+        self.active       = 0
+        self.waiters      = deque()   ## 기다리는 요청들의 Event. 자리가 나면 앞에서부터 넘겨 준다.
+        self.service_time = None      ## 자리를 잡고 있던 시간의 지수 이동 평균 (초)
+        self.lock         = threading.Lock()
+
+        self.admitted            = 0
+        self.queued              = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline   = 0
+        self.queue_timeouts      = 0
+
+    def acquire(self):
+        ## 자리를 얻으면 None, 거절하면 클라이언트가 다시 시도할 때까지 기다릴 초를 돌려준다.
+        with self.lock:
+            ## 기다리는 요청이 있으면 새 요청이 새치기 하지 않도록 자리가 있어도 줄을 선다.
+            if self.active < self.limit and not self.waiters:
+                self.active   += 1
+                self.admitted += 1
+                return None
+
+            expected_wait = self.expected_wait(len(self.waiters) + 1)
+            if len(self.waiters) >= self.max_queue:
+                self.rejected_queue_full += 1
+                return retry_after(expected_wait)
+
+            if expected_wait > self.timeout:
+                self.rejected_deadline += 1
+                return retry_after(expected_wait)
+
+            waiter = threading.Event()
+            self.waiters.append(waiter)
+            self.queued += 1
+
+        admitted = waiter.wait(self.timeout)
+
+        with self.lock:
+            ## timeout 과 거의 동시에 자리를 넘겨 받았을 수도 있으므로 lock 안에서 다시 확인한다.
+            if admitted or waiter.is_set():
+                self.admitted += 1
+                return None
+
+            self.waiters.remove(waiter)
+            self.queue_timeouts += 1
+
+            return retry_after(self.expected_wait(len(self.waiters) + 1))
+
+    def release(self, elapsed = None):
+        ## 처리하지 못하고 돌려주는 자리는 elapsed 를 주지 않아서 평균 처리 시간에 넣지 않는다.
+        with self.lock:
+            if elapsed is not None:
+                self.service_time = elapsed if self.service_time is None \
+                                    else self.service_time * 0.9 + elapsed * 0.1
+
+            ## 기다리는 요청이 있으면 active 는 그대로 두고 자리를 바로 넘겨 준다.
+            if self.waiters:
+                self.waiters.popleft().set()
+            else:
+                self.active -= 1
+
+    def expected_wait(self, position):
+        ## position 번째로 기다리는 요청이 자리를 얻을 때까지 걸릴 것으로 예상되는 시간
+        if self.service_time is None:
+            return 0.0
+
+        return self.service_time * position / self.limit
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit'               : self.limit,
+                'active'              : self.active,
+                'waiting'             : len(self.waiters),
+                'admitted'            : self.admitted,
+                'queued'              : self.queued,
+                'rejected_queue_full' : self.rejected_queue_full,
+                'rejected_deadline'   : self.rejected_deadline,
+                'queue_timeouts'      : self.queue_timeouts,
+                'service_seconds'     : self.service_time or 0.0
+            }
+
+
+class RateLimiter:
+    ## 유저마다 초당 rate 개씩 채워지고 최대 burst 개까지 쌓이는 token bucket.
+    ## 최근에 요청한 max_users 명의 bucket 만 들고 있는다. 가장 오래 요청하지 않은 유저의 bucket 부터 버리고,
+    ## 버려진 유저는 다음 요청 때 가득 찬 bucket 으로 다시 시작한다.
+    def __init__(self, rate, burst, max_users = 100000):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f'rate limit needs rate > 0 and burst >= 1, got rate={rate}, burst={burst}')
+
+        self.rate      = rate
+        self.burst     = burst
+        self.max_users = max_users
+        self.buckets   = OrderedDict()   ## user_id -> [남은 token, 마지막으로 계산한 시각]
+        self.lock      = threading.Lock()
+
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, user_id):
+        ## 허용하면 None, 막으면 token 이 하나 찰 때까지의 초를 돌려준다.
+        now = time.monotonic()
+
+        with self.lock:
+            bucket = self.buckets.get(user_id)
+            if bucket is None:
+                bucket = self.buckets[user_id] = [self.burst, now]
+                if len(self.buckets) > self.max_users:
+                    self.buckets.popitem(last = False)
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self.buckets.move_to_end(user_id)
+
+            if bucket[0] >= 1:
+                bucket[0]    -= 1
+                self.allowed += 1
+                return None
+
+            self.limited += 1
+
+            return retry_after((1 - bucket[0]) / self.rate)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'users'   : len(self.buckets),
+                'allowed' : self.allowed,
+                'limited' : self.limited
+            }
+
+
+def retry_after(seconds):
+    ## Retry-After 헤더는 정수 초
+    return max(1, math.ceil(seconds))
+
+
+def rate_limited(f):
+    ## login_required 뒤에 붙인다. 라우트에 RATE_LIMITS 가 설정되어 있으면 g.user_id 마다 token bucket 을 적용하고
+    ## token 이 없으면 서비스까지 가지 않고 바로 429 를 돌려준다.
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        limiter = current_app.extensions.get('rate_limiters', {}).get(request.url_rule.rule)
+        if limiter is not None:
+            retry = limiter.acquire(g.user_id)
+            if retry is not None:
+                return Response(status = 429, headers = {'Retry-After' : str(retry)})
+
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def register_admission_control(app, limit, max_queue, timeout, route_limits = None, exempt = (),
+                               rate_limits = None, max_users = 100000):
+    ## 앱의 모든 라우트 (exempt 제외) 를 ConcurrencyLimiter 하나로 묶어서 동시에 처리하는 요청을 limit 개 (DB pool 크기)
+    ## 로 제한하고, 자리를 얻지 못한 요청은 본문 없는 503 과 Retry-After 로 바로 돌려보낸다.
+    ## route_limits 로 준 라우트는 그 안에서 다시 라우트 별 limiter 로 제한한다. (한 라우트가 자리를 다 차지하지 않도록)
+    ## 라우트 limiter 를 먼저 얻고 앱 limiter 를 얻으므로 라우트 limiter 를 기다리는 동안에는 앱의 자리를 잡지 않는다.
+    ## rate_limits 는 {라우트 : (초당 요청 수, burst)} 이고 rate_limited 데코레이터가 붙은 엔드포인트에 적용된다.
+    ## {'*' : 앱 limiter, 라우트 : 라우트 limiter} 와 rate limiter dict 를 돌려준다. (metrics 등록용)
+    exempt      = set(exempt)
+    app_limiter = ConcurrencyLimiter(limit, max_queue, timeout)
+    limiters    = {'*' : app_limiter}
+    limiters.update({
+        route : ConcurrencyLimiter(min(route_limit, limit), max_queue, timeout)
+        for route, route_limit in (route_limits or {}).items()
+        if route not in exempt
+    })
+
+    rate_limiters = {
+        route : RateLimiter(rate, burst, max_users)
+        for route, (rate, burst) in (rate_limits or {}).items()
+    }
+    app.extensions['rate_limiters'] = rate_limiters
+
+    @app.before_request
+    def admit_request():
+        if request.url_rule is None or request.method == 'OPTIONS':
+            return None
+
+        rule = request.url_rule
+        if rule.rule in exempt or rule.endpoint == 'static':
+            return None
+
+        admitted = []
+        for limiter in (limiters.get(rule.rule), app_limiter):
+            if limiter is None:
+                continue
+
+            retry = limiter.acquire()
+            if retry is not None:
+                for held in admitted:
+                    held.release()
+                return Response(status = 503, headers = {'Retry-After' : str(retry)})
+
+            admitted.append(limiter)
+
+        request.environ['miniter.admission'] = (admitted, time.perf_counter())
+
+    ## 스트리밍 응답은 본문을 다 보낸 뒤에 teardown 되므로 그때까지 자리를 잡고 있는다.
+    ## 자리는 g 가 아니라 요청의 environ 에 기억한다. 스트리밍 중인 요청과 같은 쓰레드에서 다른 요청이 처리되면
+    ## (test client 등) app context 와 g 를 같이 써서 다른 요청의 자리를 풀어 버릴 수 있기 때문이다.
+    @app.teardown_request
+    def release_request(exception):
+        admission = request.environ.pop('miniter.admission', None)
+        if admission is not None:
+            admitted, started = admission
+            elapsed = time.perf_counter() - started
+            for limiter in reversed(admitted):
+                limiter.release(elapsed)
+
+    return limiters, rate_limiters
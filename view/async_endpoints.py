@@ -0,0 +1,121 @@
+from quart import jsonify, request, current_app, g
+from functools import wraps
+from model import LRUCache
+from service import PasswordHasherBusy
+
+from . import decode_access_token
+from .json_provider import FastJSONProvider
+
+####################################################
+#       Decorators
+####################################################
+def async_login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        access_token = request.headers.get('Authorization')
+        if access_token is not None:
+            payload = decode_access_token(current_app, access_token)
+
+            if payload is None: return '', 401
+
+            g.user_id = payload['user_id']
+        else:
+            return '', 401
+
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def create_async_endpoints(app, services):
+    ## create_endpoints 와 같은 엔드포인트들을 Quart (ASGI) 앱에 async view 로 등록한다.
+    app.json = FastJSONProvider(app, app.config.get('JSON_BACKEND'))
+
+    if app.config.get('TOKEN_CACHE_SIZE', 10000) > 0:
+        app.extensions['token_cache'] = LRUCache(max_entries = app.config.get('TOKEN_CACHE_SIZE', 10000))
+
+    user_service = services.user_service
+    tweet_service = services.tweet_service
+
+    @app.route("/ping", methods=['GET'])
+    async def ping():
+        return "pong"
+
+    @app.route("/sign-up", methods=['POST'])
+    async def sign_up():
+        new_user = await request.get_json()
+        try:
+            new_user = await user_service.create_new_user(new_user)
+        except PasswordHasherBusy:
+            return '', 503, {'Retry-After' : '1'}
+
+        return jsonify(new_user)
+
+    @app.route("/login", methods=['POST'])
+    async def login():
+        credential = await request.get_json()
+        try:
+            user_id = await user_service.login(credential)
+        except PasswordHasherBusy:
+            return '', 503, {'Retry-After' : '1'}
+
+        if user_id is not None:
+            token = user_service.generate_access_token(user_id)
+
+            return jsonify({
+                'access_token' : token,
+                'user_id'      : user_id
+            })
+        else:
+            return '', 401
+
+    @app.route("/tweet", methods=['POST'])
+    @async_login_required
+    async def tweet():
+        user_tweet = await request.get_json()
+
+        result = await tweet_service.tweet(g.user_id, user_tweet['tweet'])
+        if result is None:
+            return '300자를 초과했습니다', 400
+
+        return '', 200
+
+    @app.route("/follow", methods=['POST'])
+    @async_login_required
+    async def follow():
+        payload = await request.get_json()
+
+        await user_service.follow(g.user_id, payload['follow'])
+
+        return '', 200
+
+    @app.route("/unfollow", methods=['POST'])
+    @async_login_required
+    async def unfollow():
+        payload = await request.get_json()
+
+        await user_service.unfollow(g.user_id, payload['unfollow'])
+
+        return '', 200
+
+    @app.route("/timeline/<int:user_id>", methods=['GET'])
+    async def timeline(user_id):
+        return await timeline_response(user_id)
+
+    @app.route("/timeline", methods=['GET'])
+    @async_login_required
+    async def user_timeline():
+        return await timeline_response(g.user_id)
+
+    async def timeline_response(user_id):
+        timeline, next_cursor = await tweet_service.get_timeline_page(
+            user_id,
+            max_id   = request.args.get('max_id', type = int),
+            since_id = request.args.get('since_id', type = int),
+            count    = request.args.get('count', type = int)
+        )
+
+        return jsonify({
+            'user_id'     : user_id,
+            'timeline'    : timeline,
+            'next_cursor' : next_cursor
+        })
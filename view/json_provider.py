@@ -0,0 +1,87 @@
+import json
+
+from flask.json.provider import JSONProvider, DefaultJSONProvider
+from model import Record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def default(obj):
+    ## DAO 의 record (타임라인의 트윗 하나하나) 는 가장 자주 오므로 먼저 확인해서 JSON object 로 바꾼다.
+    ## 기본 JSON 직렬화기는 set 을 JSON 으로 변환할 수 없으므로 list 로 바꿔 준다.
+    ## 그 외 (date, Decimal, UUID, dataclass 등) 는 Flask 의 기본 처리를 따른다.
+    if isinstance(obj, Record):
+        return obj.as_dict()
+
+    if isinstance(obj, set):
+        return list(obj)
+
+    return DefaultJSONProvider.default(obj)
+
+
+def available_backends():
+    backends = []
+    if orjson is not None:
+        backends.append('orjson')
+    if ujson is not None:
+        backends.append('ujson')
+    backends.append('json')
+
+    return backends
+
+
+class FastJSONProvider(JSONProvider):
+    ## 설치되어 있으면 orjson > ujson 순으로 쓰고, 없으면 표준 라이브러리 json 을 쓰는 JSON provider.
+    ## 응답은 항상 compact (공백 없이) 하게 만들고, 키 정렬은 하지 않는다.
+    mimetype = 'application/json'
+
+    def __init__(self, app, backend = None):
+        super().__init__(app)
+
+        backend = backend or available_backends()[0]
+        if backend not in available_backends():
+            raise ValueError(f'JSON backend {backend!r} is not installed')
+
+        self.backend = backend
+
+    def dumps_bytes(self, obj):
+        ## orjson 은 bytes 를 바로 만들어 주므로 응답 body 로 쓸 때는 decode 하지 않는다.
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, default = default, option = orjson.OPT_NON_STR_KEYS)
+
+        return self.dumps(obj).encode('UTF-8')
+
+    def dumps(self, obj, **kwargs):
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, default = default, option = orjson.OPT_NON_STR_KEYS).decode('UTF-8')
+
+        if self.backend == 'ujson':
+            return ujson.dumps(obj, default = default, ensure_ascii = False)
+
+        kwargs.setdefault('default', default)
+        kwargs.setdefault('ensure_ascii', False)
+        kwargs.setdefault('separators', (',', ':'))
+
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.backend == 'orjson':
+            return orjson.loads(s)
+
+        if self.backend == 'ujson':
+            return ujson.loads(s)
+
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        return self._app.response_class(self.dumps_bytes(obj), mimetype = self.mimetype)
@@ -0,0 +1,30 @@
+import time
+
+from flask import request, g, Response
+
+
+def register_metrics(app, metrics):
+    ## 모든 요청의 처리 시간을 라우트 (URL rule), HTTP 메소드, 응답 코드 별로 기록하고
+    ## /metrics 로 Prometheus text format 을 내보낸다.
+    histogram = metrics.histogram(
+        'http_request_duration_seconds',
+        'HTTP request latency',
+        ['route', 'method', 'status']
+    )
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            histogram.observe(time.perf_counter() - started, route, request.method, response.status_code)
+
+        return response
+
+    @app.route("/metrics", methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.render(), content_type = 'text/plain; version=0.0.4; charset=utf-8')